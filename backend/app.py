@@ -1,20 +1,30 @@
 
-import os, json, datetime, hashlib, re, time
+import os, json, datetime, threading
+from contextlib import asynccontextmanager
 from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, Form, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from memstore import MemoryStore
+from store import JsonStore, etag_matches
+from blobs import BlobStore
+import tools_batch
+from reports import ReportService, KINDS as REPORT_KINDS
+from intent import IntentRouter
+from retrieval import RetrievalIndex, chunks
+from assets import StaticAssets
 
 BASE = os.path.dirname(__file__)
 ROOT = os.path.abspath(os.path.join(BASE, ".."))
 FRONT = os.path.join(ROOT, "frontend")
-DATA = os.path.join(BASE, "data")
+DATA = os.getenv("DATA_DIR") or os.path.join(BASE, "data")  # memory log, uploads, reports
 os.makedirs(DATA, exist_ok=True)
 
 SETTINGS = os.path.join(BASE, "settings.json")
 CATALOG = os.path.join(BASE, "catalog.json")
-MEMORY = os.path.join(DATA, "memory.jsonl")
+MEMORY = os.path.join(DATA, "memory.jsonl")  # pre-segment log, adopted by the store on first start
 
 # Initialize defaults
 if not os.path.exists(SETTINGS):
@@ -31,19 +41,56 @@ if not os.path.exists(CATALOG):
             {"key":"ai","name":"AI Orchestrator","desc":"مساعد نص/صوت/كاميرا + أدوات"},
         ], f, ensure_ascii=False, indent=2)
 
-def load(p): 
-    with open(p,"r",encoding="utf-8") as f: return json.load(f)
-def save(p, d):
-    with open(p,"w",encoding="utf-8") as f: json.dump(d,f,ensure_ascii=False,indent=2)
+SETTINGS_STORE = JsonStore(SETTINGS, default={})
+CATALOG_STORE = JsonStore(CATALOG, default=[])
 
-app = FastAPI(title="Future Crown Ultimate — Unified v3", version="3.0.0")
+MEM = MemoryStore(os.path.join(DATA, "memory"), legacy=MEMORY)
+BLOBS = BlobStore(os.path.join(DATA, "blobs"))
+REPORTS = ReportService(os.path.join(DATA, "reports"))
+INTENTS = IntentRouter()
+INDEX = RetrievalIndex()
+ASSETS = StaticAssets(FRONT, os.getenv("STATIC_BUILD_DIR") or None)
+
+TEXT_TYPES = ("application/json", "application/x-ndjson", "application/csv", "application/xml")
+TEXT_EXTS = (".txt", ".md", ".csv", ".json", ".jsonl", ".xml", ".html", ".log")
+
+def index_upload(sha: str, filename: str, content_type: str, size: int):
+    if size > INDEX.max_upload_bytes: return
+    if not (content_type.startswith("text/") or content_type in TEXT_TYPES or filename.lower().endswith(TEXT_EXTS)): return
+    with open(BLOBS.path(sha), "rb") as f: text = f.read().decode("utf-8", "ignore")
+    for part in chunks(text): INDEX.add(part, {"source": "upload", "filename": filename, "sha256": sha})
+
+def build_index():
+    # past asks (newest RETRIEVAL_MAX_DOCS) + text uploads; runs once in the background at startup
+    for u in BLOBS.list(limit=1000):
+        try: index_upload(u["sha256"], u["filename"], u["content_type"], u["size"])
+        except OSError: pass
+    for r in MEM.query(INDEX.max_docs, type="ask"):
+        if r.get("text"): INDEX.add(r["text"], {"source": "ask", "ts": r.get("ts")})
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(ASSETS.load)  # fingerprint + precompress frontend/ once
+    await REPORTS.start()
+    threading.Thread(target=build_index, name="retrieval-index", daemon=True).start()
+    yield
+    MEM.close()  # flush buffered log records
+    BLOBS.close()
+    REPORTS.close()
+
+app = FastAPI(title="Future Crown Ultimate — Unified v3", version="3.0.0", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
-app.mount("/", StaticFiles(directory=FRONT, html=True), name="static")
 
 # ===== Models =====
 class AskPayload(BaseModel):
     text: str
     use_voice: Optional[bool] = False
+    context: Optional[int] = 3  # related past asks / upload passages to return
+
+class ReportIn(BaseModel):
+    title: str
+    items: list[str] = []
+    format: str = "html"
 
 class AdminUpdate(BaseModel):
     password: str
@@ -55,74 +102,96 @@ class AdminUpdate(BaseModel):
 # ===== Endpoints =====
 @app.get("/api/healthz")
 def healthz():
-    return {"ok":True,"time":datetime.datetime.utcnow().isoformat()+"Z"}
+    return {"ok":True,"time":datetime.datetime.utcnow().isoformat()+"Z","static_version":ASSETS.manifest.get("version")}
 
 @app.get("/api/catalog")
-def catalog_list():
-    return load(CATALOG)
+def catalog_list(request: Request):
+    body, etag = CATALOG_STORE.body()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def check_password(password: str):
+    if password != SETTINGS_STORE.get().get("admin_password"): raise HTTPException(401, "bad password")
 
 @app.post("/api/catalog/add")
 def catalog_add(password: str = Form(...), key: str = Form(...), name: str = Form(...), desc: str = Form("")):
-    st = load(SETTINGS)
-    if password != st.get("admin_password"): raise HTTPException(401, "bad password")
-    cats = load(CATALOG)
-    if any(c.get("key")==key for c in cats): return {"ok": False, "reason":"exists"}
-    cats.append({"key":key,"name":name,"desc":desc})
-    save(CATALOG, cats)
+    check_password(password)
+    def add(cats):
+        if any(c.get("key")==key for c in cats): return False
+        cats.append({"key":key,"name":name,"desc":desc})
+        return True
+    if not CATALOG_STORE.update(add): return {"ok": False, "reason":"exists"}
     return {"ok": True}
 
 @app.post("/api/catalog/remove")
 def catalog_remove(password: str = Form(...), key: str = Form(...)):
-    st = load(SETTINGS)
-    if password != st.get("admin_password"): raise HTTPException(401, "bad password")
-    cats = [c for c in load(CATALOG) if c.get("key")!=key]
-    save(CATALOG, cats)
+    check_password(password)
+    def remove(cats):
+        cats[:] = [c for c in cats if c.get("key")!=key]
+    CATALOG_STORE.update(remove)
     return {"ok": True}
 
 @app.post("/api/admin/update")
 def admin_update(payload: AdminUpdate):
-    st = load(SETTINGS)
-    if payload.password != st.get("admin_password"): raise HTTPException(401, "bad password")
-    changed = False
-    for k in ["llm_mode","llm_endpoint","llm_api_key"]:
-        v = getattr(payload, k)
-        if v is not None: st[k]=v; changed=True
+    check_password(payload.password)
+    changes = {k: getattr(payload, k) for k in ["llm_mode","llm_endpoint","llm_api_key"] if getattr(payload, k) is not None}
     if payload.new_password:
-        st["admin_password"]=payload.new_password; changed=True
-    if changed: save(SETTINGS, st)
-    return {"ok": True, "changed": changed}
+        changes["admin_password"] = payload.new_password
+    if changes: SETTINGS_STORE.update(lambda st: st.update(changes))
+    return {"ok": True, "changed": bool(changes)}
+
+REPLIES = {
+    "evm": "EVM: SPI/CPI/EAC متاحين عبر الأدوات أو إدخال بياناتك لاحقًا.",
+    "ifrs15": "IFRS‑15: توليد جدول اعتراف مبسّط ضمن الأدوات.",
+    "procure": "Procurement: إنذار 15 يوم (☠️) — اضبطه من الإدارة.",
+}
 
 @app.post("/api/ask")
 def ask(payload: AskPayload):
     text = payload.text.strip()
     ts = datetime.datetime.utcnow().isoformat()+"Z"
-    with open(MEMORY, "a", encoding="utf-8") as f:
-        f.write(json.dumps({"ts":ts,"type":"ask","text":text}, ensure_ascii=False)+"\n")
-    t = text.lower()
-    if "evm" in t:
-        reply = "EVM: SPI/CPI/EAC متاحين عبر الأدوات أو إدخال بياناتك لاحقًا."
-    elif "ifrs" in t:
-        reply = "IFRS‑15: توليد جدول اعتراف مبسّط ضمن الأدوات."
-    elif "procure" in t or "شراء" in t:
-        reply = "Procurement: إنذار 15 يوم (☠️) — اضبطه من الإدارة."
+    MEM.append({"ts":ts,"type":"ask","text":text})
+    intent = INTENTS.route(text, CATALOG_STORE.get())
+    if intent in REPLIES:
+        reply = REPLIES[intent]
+    elif intent:
+        reply = f"{INTENTS.names[intent]}: الأمر سُجّل وسيُوجَّه للأداة عند تفعيلها."
     else:
         reply = "Future Unified: الأمر سُجّل وسيُوجَّه للأدوات/الموصلات عند تفعيلها."
-    return {"ok": True, "reply": reply, "ts": ts}
+    context = INDEX.search(text, min(payload.context, 20)) if payload.context and payload.context > 0 else []
+    INDEX.add(text, {"source": "ask", "ts": ts})
+    return {"ok": True, "reply": reply, "ts": ts, "intent": intent, "context": context}
 
 @app.post("/api/memory/upload")
-async def memory_upload(file: UploadFile = File(...)):
-    content = await file.read()
-    h = hashlib.sha256(content).hexdigest()[:16]
-    path = os.path.join(DATA, f"up_{h}_{file.filename}")
-    with open(path, "wb") as f: f.write(content)
-    return {"ok": True, "stored_as": os.path.basename(path)}
+async def memory_upload(request: Request):
+    # multipart/form-data with a "file" part, parsed as it arrives (see blobs.py)
+    meta = await BLOBS.save(request)
+    if not meta["duplicate"]:
+        await run_in_threadpool(index_upload, meta["sha256"], meta["filename"], meta["content_type"], meta["size"])
+    return {"ok": True, "stored_as": meta["sha256"], **meta}
+
+@app.get("/api/memory/uploads")
+def memory_uploads(limit: int = 100, offset: int = 0):
+    return {"ok": True, "items": BLOBS.list(max(1, min(limit, 1000)), max(0, offset))}
+
+@app.get("/api/memory/uploads/{sha256}")
+def memory_upload_info(sha256: str, download: bool = False):
+    meta = BLOBS.get(sha256)
+    if not meta: raise HTTPException(404, "not found")
+    if download:
+        last = meta["uploads"][-1]
+        return FileResponse(BLOBS.path(sha256), media_type=last["content_type"], filename=last["filename"])
+    return {"ok": True, **meta}
 
 @app.get("/api/memory/logs")
-def memory_logs(limit: int = 100):
-    items = []
-    if os.path.exists(MEMORY):
-        with open(MEMORY,"r",encoding="utf-8") as f:
-            items = [json.loads(l) for l in f.readlines()[-limit:]]
+def memory_logs(limit: int = 100, type: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None):
+    # newest `limit` entries (oldest first), optionally by type and ISO/epoch time range
+    try:
+        items = MEM.query(min(limit, 10000), type=type, since=since, until=until)
+    except ValueError:
+        raise HTTPException(400, "bad since/until")
     return {"ok": True, "items": items}
 
 # ===== Basic Tools (merged) =====
@@ -138,10 +207,50 @@ def run_ifrs15(contract_value: float, months: int):
     schedule = [{"month":i+1,"recognition":per} for i in range(months)]
     return {"ok": True, "schedule": schedule}
 
+# Batch versions: body is CSV / JSON / NDJSON / Parquet (by Content-Type or ?input=), result streamed as ?format=csv|ndjson
+async def _run_batch(request: Request, fn, input: Optional[str], format: str):
+    if format not in tools_batch.MEDIA: raise HTTPException(400, "format must be csv or ndjson")
+    fmt = tools_batch.input_format(request.headers.get("content-type", ""), input)
+    body = await request.body()
+    df = await run_in_threadpool(lambda: fn(tools_batch.read_table(body, fmt)))
+    return StreamingResponse(tools_batch.stream(df, format), media_type=tools_batch.MEDIA[format],
+                             headers={"X-Rows": str(len(df))})
+
+@app.post("/api/tools/batch/evm")
+async def batch_evm(request: Request, input: Optional[str] = None, format: str = "ndjson"):
+    # columns: id?, ev, ac, pv, bac (or boq_total) -> SPI, CPI, SV, CV, EAC, ETC, VAC
+    return await _run_batch(request, tools_batch.evm, input, format)
+
+@app.post("/api/tools/batch/ifrs15")
+async def batch_ifrs15(request: Request, input: Optional[str] = None, format: str = "csv"):
+    # columns: id?, contract_value, months, start? (YYYY-MM) -> one row per contract-month
+    return await _run_batch(request, tools_batch.ifrs15, input, format)
+
 @app.post("/api/tools/report_build")
-def report_build(title: str, items: str):
-    html = "<h1>"+title+"</h1><ul>" + "".join(f"<li>{x}</li>" for x in items.split("|")) + "</ul>"
-    fname = re.sub(r"[^a-zA-Z0-9_-]+","_",title) or "report"
-    out = os.path.join(DATA, f"{fname}_{int(time.time())}.html")
-    with open(out,"w",encoding="utf-8") as f: f.write(html)
-    return {"ok": True, "html": os.path.basename(out)}
+async def report_build(title: str, items: str):
+    job, _ = REPORTS.submit("html", title, items.split("|"))
+    await REPORTS.wait(job)
+    if job.status != "done": raise HTTPException(500, job.error or "render failed")
+    return {"ok": True, "html": f"{job.id}.html", "id": job.id}
+
+# ===== Reports (rendered off the event loop, cached by content) =====
+@app.post("/api/reports", status_code=202)
+async def report_submit(payload: ReportIn):
+    job, cached = REPORTS.submit(payload.format, payload.title, payload.items)
+    return {"ok": True, "cached": cached, **REPORTS.info(job)}
+
+@app.get("/api/reports/{id}")
+def report_status(id: str):
+    job = REPORTS.get(id)
+    if not job: raise HTTPException(404, "unknown report")
+    return {"ok": True, **REPORTS.info(job)}
+
+@app.get("/api/reports/{id}/download")
+def report_download(id: str):
+    job = REPORTS.get(id)
+    if not job: raise HTTPException(404, "unknown report")
+    if job.status != "done": raise HTTPException(409, f"report is {job.status}")
+    return FileResponse(REPORTS.path(job.id, job.kind), media_type=REPORT_KINDS[job.kind], filename=f"report_{job.id}.{job.kind}")
+
+# ===== Frontend (mounted last: routes match in order, so every /api route above wins) =====
+app.mount("/", ASSETS, name="static")
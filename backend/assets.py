@@ -0,0 +1,231 @@
+import os, re, gzip, json, hashlib, mimetypes
+from typing import Optional
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are produced
+    brotli = None
+
+# ---------- Static assets ----------
+# frontend/ is built once (at startup, or ahead of time with `python backend/assets.py
+# <out dir>`): every file except the HTML pages, manifest.json and service-worker.js is
+# renamed to name.<hash>.ext and references to it in those files (and CSS) are rewritten,
+# text files get gzip (and brotli when installed) variants, and the service worker gets
+# the build version and precache list. Everything is then served from memory:
+#   fingerprinted  -> Cache-Control: public, max-age=31536000, immutable
+#   pages, sw, original asset names -> Cache-Control: no-cache (revalidated by ETag, 304)
+#   STATIC_BUILD_DIR=<dir>   serve a prebuilt output instead of building frontend/ at startup
+
+STABLE = ("service-worker.js", "manifest.json", "robots.txt", "favicon.ico")
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                "image/svg+xml", "application/xml")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+MIN_COMPRESS = 256  # bytes; smaller bodies are not worth a Content-Encoding
+
+mimetypes.add_type("text/javascript", ".js")
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+
+def media_type(path: str) -> str:
+    if path.endswith("manifest.json"):
+        return "application/manifest+json"
+    mt = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return mt + "; charset=utf-8" if mt.startswith("text/") or mt.endswith(("json", "javascript")) else mt
+
+def compressible(mt: str) -> bool:
+    return mt.startswith(COMPRESSIBLE)
+
+def fingerprinted(rel: str) -> bool:
+    return not (rel.endswith(".html") or rel in STABLE or rel.endswith(".webmanifest"))
+
+def hashed_name(rel: str, digest: str) -> str:
+    stem, ext = os.path.splitext(rel)
+    return f"{stem}.{digest[:10]}{ext}"
+
+class Asset:
+    __slots__ = ("body", "gzip", "br", "etag", "media_type", "cache_control")
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str, digest: Optional[str] = None,
+                 variants: Optional[tuple[Optional[bytes], Optional[bytes]]] = None):
+        self.body = body
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = '"%s"' % (digest or hashlib.sha256(body).hexdigest())[:20]
+        self.gzip = self.br = None
+        if variants is not None:   # (gzip, br) already on disk
+            self.gzip, self.br = variants
+        elif compressible(media_type) and len(body) >= MIN_COMPRESS:
+            gz = gzip.compress(body, 9, mtime=0)
+            self.gzip = gz if len(gz) < len(body) else None
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                self.br = br if len(br) < len(body) else None
+
+def _rewrite(text: str, urls: dict[str, str]) -> str:
+    # "/assets/app.js" -> "/assets/app.<hash>.js" where the path is quoted or in url(...)
+    if not urls:
+        return text
+    alt = "|".join(re.escape(u) for u in sorted(urls, key=len, reverse=True))
+    return re.sub(r"(?<=[\"'(=])(%s)(?=[\"')?#])" % alt, lambda m: urls[m.group(1)], text)
+
+def _service_worker(text: str, version: str, precache: list[str]) -> str:
+    text = re.sub(r"const VERSION = '[^']*';", f"const VERSION = '{version}';", text, count=1)
+    return re.sub(r"const PRECACHE = \[[^\]]*\];", "const PRECACHE = %s;" % json.dumps(precache), text, count=1)
+
+def build(src: str) -> tuple[dict[str, Asset], dict]:
+    # -> (url path -> Asset, manifest {version, files: {original: fingerprinted}})
+    files: dict[str, bytes] = {}
+    for dirpath, dirnames, filenames in os.walk(src):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if name.startswith("."):
+                continue
+            full = os.path.join(dirpath, name)
+            with open(full, "rb") as f:
+                files[os.path.relpath(full, src).replace(os.sep, "/")] = f.read()
+    urls: dict[str, str] = {}    # "/assets/app.js" -> "/assets/app.<hash>.js"
+    assets: dict[str, Asset] = {}
+    # leaf files first (images, fonts...), then CSS that may point at them, JS last
+    order = sorted((r for r in files if fingerprinted(r)), key=lambda r: (r.endswith(".css"), r.endswith(".js"), r))
+    for rel in order:
+        body = files[rel]
+        mt = media_type(rel)
+        if rel.endswith(".css"):
+            body = _rewrite(body.decode("utf-8"), urls).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        url = "/" + hashed_name(rel, digest)
+        urls["/" + rel] = url
+        assets[url] = Asset(body, mt, IMMUTABLE, digest)
+        assets["/" + rel] = Asset(body, mt, REVALIDATE, digest)   # old references keep working
+    pages = [r for r in files if not fingerprinted(r) and r != "service-worker.js"]
+    for rel in pages:
+        body = files[rel]
+        if rel.endswith((".html", ".json", ".webmanifest")):
+            body = _rewrite(body.decode("utf-8"), urls).encode("utf-8")
+        assets["/" + rel] = Asset(body, media_type(rel), REVALIDATE)
+    version = hashlib.sha256("".join(sorted(a.etag for a in assets.values())).encode()).hexdigest()[:12]
+    precache = (["/"] if "index.html" in files else []) + ["/" + r for r in sorted(pages)] + sorted(urls.values())
+    if "service-worker.js" in files:
+        sw = _service_worker(files["service-worker.js"].decode("utf-8"), version, precache)
+        assets["/service-worker.js"] = Asset(sw.encode("utf-8"), media_type("service-worker.js"), REVALIDATE)
+    return assets, {"version": version, "files": urls, "precache": precache}
+
+def write(assets: dict[str, Asset], manifest: dict, out: str):
+    # build output for a CDN / nginx gzip_static: every file plus .gz/.br siblings and asset-manifest.json
+    for url, a in assets.items():
+        path = os.path.join(out, url.lstrip("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for suffix, data in (("", a.body), (".gz", a.gzip), (".br", a.br)):
+            if data is not None:
+                with open(path + suffix, "wb") as f:
+                    f.write(data)
+    with open(os.path.join(out, "asset-manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+def load(out: str) -> tuple[dict[str, Asset], dict]:
+    # read back what write() produced
+    with open(os.path.join(out, "asset-manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    hashed = set(manifest["files"].values())
+    assets: dict[str, Asset] = {}
+    for dirpath, _, filenames in os.walk(out):
+        for name in filenames:
+            if name.endswith((".gz", ".br")) or name == "asset-manifest.json":
+                continue
+            full = os.path.join(dirpath, name)
+            url = "/" + os.path.relpath(full, out).replace(os.sep, "/")
+            variants = []
+            for path in (full, full + ".gz", full + ".br"):
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        variants.append(f.read())
+                else:
+                    variants.append(None)
+            assets[url] = Asset(variants[0], media_type(url), IMMUTABLE if url in hashed else REVALIDATE,
+                                variants=(variants[1], variants[2]))
+    return assets, manifest
+
+def _accepts(header: str) -> set[str]:
+    # codings from Accept-Encoding with q > 0
+    out = set()
+    for part in header.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        out.add(coding.strip())
+    return out
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match against any representation of the asset (identity, -gzip, -br)
+    base = etag.strip('"')
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.removeprefix("W/").strip('"') in (base, base + "-gzip", base + "-br"):
+            return True
+    return False
+
+class StaticAssets:
+    # ASGI app for the frontend; mount it after the API routes so /api/* always wins
+    def __init__(self, src: str, prebuilt: Optional[str] = None):
+        self.src = src
+        self.prebuilt = prebuilt
+        self.assets: dict[str, Asset] = {}
+        self.manifest: dict = {}
+
+    def load(self):
+        if self.prebuilt:
+            self.assets, self.manifest = load(self.prebuilt)
+        else:
+            self.assets, self.manifest = build(self.src)
+
+    def stats(self) -> dict:
+        return {"version": self.manifest.get("version"), "files": len(self.assets),
+                "fingerprinted": len(self.manifest.get("files", {})), "brotli": brotli is not None}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        path = scope["path"]
+        if path.endswith("/"):
+            path += "index.html"
+        a = self.assets.get(path)
+        if a is None:
+            return await Response("Not Found", 404, media_type="text/plain")(scope, receive, send)
+        if scope["method"] not in ("GET", "HEAD"):
+            return await Response("Method Not Allowed", 405, headers={"Allow": "GET, HEAD"})(scope, receive, send)
+        headers = dict((k.decode("latin-1").lower(), v.decode("latin-1")) for k, v in scope["headers"])
+        codings = _accepts(headers.get("accept-encoding", ""))
+        body, encoding = a.body, None
+        if a.br is not None and "br" in codings:
+            body, encoding = a.br, "br"
+        elif a.gzip is not None and ("gzip" in codings or "*" in codings):
+            body, encoding = a.gzip, "gzip"
+        etag = a.etag if encoding is None else f'{a.etag[:-1]}-{encoding}"'
+        out = {"Cache-Control": a.cache_control, "ETag": etag}
+        if a.gzip is not None or a.br is not None:
+            out["Vary"] = "Accept-Encoding"
+        if _etag_matches(headers.get("if-none-match", ""), a.etag):
+            return await Response(status_code=304, headers=out)(scope, receive, send)
+        if encoding:
+            out["Content-Encoding"] = encoding
+        out["Content-Length"] = str(len(body))
+        await Response(b"" if scope["method"] == "HEAD" else body, 200, headers=out,
+                       media_type=a.media_type)(scope, receive, send)
+
+if __name__ == "__main__":
+    # python backend/assets.py [out dir]  -> prebuilt output for STATIC_BUILD_DIR or a CDN
+    import sys
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = sys.argv[1] if len(sys.argv) > 1 else os.path.join(here, "static_build")
+    assets, manifest = build(os.path.join(here, "..", "frontend"))
+    write(assets, manifest, out)
+    print(json.dumps({"out": out, "version": manifest["version"], "files": len(assets),
+                      "brotli": brotli is not None}))
@@ -0,0 +1,200 @@
+import os, re, time, asyncio, hashlib, sqlite3, tempfile, threading
+from typing import Optional
+import multipart
+from multipart.multipart import parse_options_header
+from fastapi import HTTPException, Request
+
+# ---------- Content-addressed uploads ----------
+# The multipart body is parsed straight off the request stream (nothing is spooled by
+# the framework first): a Content-Length over the limit is rejected before reading,
+# and the file part is hashed, size-checked and written to a temp file chunk by chunk
+# from a worker thread, then renamed to blobs/<sha[:2]>/<sha>. The same content is
+# stored once; every upload (name, type, time) is a row in the SQLite manifest, which
+# is what listing and lookups read.
+#   UPLOAD_MAX_BYTES=52428800   UPLOAD_CHUNK_BYTES=1048576 (disk writes are batched up to this)
+
+SHA_RE = re.compile(r"^[0-9a-f]{64}$")
+FORM_OVERHEAD = 16 * 1024   # multipart framing and part headers allowed on top of UPLOAD_MAX_BYTES
+
+def safe_name(name: Optional[str]) -> str:
+    name = os.path.basename((name or "").replace("\\", "/"))
+    return re.sub(r"[^\w.\-]+", "_", name).strip("._")[:128] or "upload"
+
+class _Sink:
+    # temp file + running hash; every method runs in a worker thread
+    def __init__(self, directory: str):
+        fd, self.path = tempfile.mkstemp(prefix="up-", suffix=".part", dir=directory)
+        self.f = os.fdopen(fd, "wb")
+        self.h = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.h.update(chunk)
+        self.f.write(chunk)
+        self.size += len(chunk)
+
+    def finish(self) -> str:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        return self.h.hexdigest()
+
+    def discard(self):
+        if not self.f.closed:
+            self.f.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class _FormParts:
+    # python-multipart callbacks turned into events, drained after each feed():
+    #   ("part", name, filename | None, content_type) / ("data", bytes) / ("end",)
+    def __init__(self, boundary: bytes):
+        self.events: list[tuple] = []
+        self._headers: dict[bytes, bytes] = {}
+        self._field = self._value = b""
+        self.parser = multipart.MultipartParser(boundary, {
+            "on_part_begin": self._begin, "on_header_field": self._header_field,
+            "on_header_value": self._header_value, "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_done, "on_part_data": self._data, "on_part_end": self._end})
+
+    def _begin(self):
+        self._headers = {}
+
+    def _header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+
+    def _header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def _headers_done(self):
+        _, opts = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = opts.get(b"filename")
+        self.events.append(("part", opts.get(b"name", b"").decode("utf-8", "replace"),
+                            filename.decode("utf-8", "replace") if filename is not None else None,
+                            self._headers.get(b"content-type", b"").decode("latin-1")))
+
+    def _data(self, data: bytes, start: int, end: int):
+        self.events.append(("data", data[start:end]))
+
+    def _end(self):
+        self.events.append(("end",))
+
+    def feed(self, chunk: bytes) -> list[tuple]:
+        self.parser.write(chunk)
+        events, self.events = self.events, []
+        return events
+
+class BlobStore:
+    def __init__(self, directory: str):
+        self.dir = directory
+        self.tmp = os.path.join(directory, "tmp")
+        self.max_bytes = int(os.getenv("UPLOAD_MAX_BYTES", "") or 50 * 1024 * 1024)
+        self.chunk = int(os.getenv("UPLOAD_CHUNK_BYTES", "") or 1024 * 1024)
+        os.makedirs(self.tmp, exist_ok=True)
+        for p in os.listdir(self.tmp):  # leftovers from an interrupted upload
+            try:
+                os.remove(os.path.join(self.tmp, p))
+            except OSError:
+                pass
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "manifest.db"), check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS blobs (sha256 TEXT PRIMARY KEY, size INTEGER, created REAL);
+            CREATE TABLE IF NOT EXISTS uploads (id INTEGER PRIMARY KEY, sha256 TEXT, filename TEXT,
+                                                content_type TEXT, ts REAL);
+            CREATE INDEX IF NOT EXISTS uploads_sha ON uploads(sha256);
+        """)
+
+    def path(self, sha: str) -> str:
+        return os.path.join(self.dir, sha[:2], sha)
+
+    async def save(self, request: Request, field: str = "file") -> dict:
+        # stores the first file part named `field` of a multipart/form-data request
+        ctype, opts = parse_options_header(request.headers.get("content-type", ""))
+        if ctype != b"multipart/form-data" or not opts.get(b"boundary"):
+            raise HTTPException(415, "expected multipart/form-data with a boundary")
+        try:
+            length = int(request.headers.get("content-length") or 0)
+        except ValueError:
+            raise HTTPException(400, "bad Content-Length")
+        if length > self.max_bytes + FORM_OVERHEAD:
+            raise HTTPException(413, f"upload larger than {self.max_bytes} bytes")
+        parts = _FormParts(opts[b"boundary"])
+        sink: Optional[_Sink] = None
+        filename, content_type = "upload", "application/octet-stream"
+        current = done = False
+        pending: list[bytes] = []     # file bytes not yet on disk, written in UPLOAD_CHUNK_BYTES batches
+        buffered = 0
+        try:
+            async for chunk in request.stream():
+                for ev in parts.feed(chunk):
+                    if ev[0] == "part":
+                        current = not done and sink is None and ev[1] == field and ev[2] is not None
+                        if current:
+                            sink = await asyncio.to_thread(_Sink, self.tmp)
+                            filename, content_type = safe_name(ev[2]), ev[3] or content_type
+                    elif ev[0] == "data" and current:
+                        buffered += len(ev[1])
+                        if sink.size + buffered > self.max_bytes:
+                            raise HTTPException(413, f"upload larger than {self.max_bytes} bytes")
+                        pending.append(ev[1])
+                    elif ev[0] == "end" and current:
+                        current, done = False, True
+                if pending and (buffered >= self.chunk or done):
+                    await asyncio.to_thread(sink.write, b"".join(pending))
+                    pending, buffered = [], 0
+            parts.parser.finalize()
+            if not done:
+                raise HTTPException(400, f"no complete '{field}' file part in the form")
+            sha = await asyncio.to_thread(sink.finish)
+            duplicate = await asyncio.to_thread(self._commit, sink, sha, filename, content_type)
+        finally:
+            if sink is not None:
+                await asyncio.to_thread(sink.discard)
+        return {"sha256": sha, "size": sink.size, "duplicate": duplicate, "filename": filename,
+                "content_type": content_type}
+
+    def _commit(self, sink: _Sink, sha: str, filename: str, content_type: str) -> bool:
+        now = time.time()
+        with self._lock:
+            known = self._db.execute("SELECT 1 FROM blobs WHERE sha256=?", (sha,)).fetchone() is not None
+            if not (known and os.path.exists(self.path(sha))):
+                os.makedirs(os.path.dirname(self.path(sha)), exist_ok=True)
+                os.replace(sink.path, self.path(sha))
+                self._db.execute("INSERT OR REPLACE INTO blobs VALUES (?,?,?)", (sha, sink.size, now))
+            self._db.execute("INSERT INTO uploads (sha256, filename, content_type, ts) VALUES (?,?,?,?)",
+                             (sha, filename, content_type, now))
+            self._db.commit()
+        return known
+
+    def get(self, sha: str) -> Optional[dict]:
+        if not SHA_RE.match(sha):
+            return None
+        with self._lock:
+            b = self._db.execute("SELECT size, created FROM blobs WHERE sha256=?", (sha,)).fetchone()
+            if not b:
+                return None
+            names = self._db.execute("SELECT filename, content_type, ts FROM uploads WHERE sha256=? ORDER BY id",
+                                     (sha,)).fetchall()
+        return {"sha256": sha, "size": b[0], "created": b[1],
+                "uploads": [{"filename": n, "content_type": ct, "ts": ts} for n, ct, ts in names]}
+
+    def list(self, limit: int = 100, offset: int = 0) -> list[dict]:
+        # newest uploads first
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT u.sha256, u.filename, u.content_type, u.ts, b.size FROM uploads u "
+                "JOIN blobs b ON b.sha256 = u.sha256 ORDER BY u.id DESC LIMIT ? OFFSET ?",
+                (limit, offset)).fetchall()
+        return [{"sha256": s, "filename": n, "content_type": ct, "ts": ts, "size": size} for s, n, ct, ts, size in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
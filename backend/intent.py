@@ -0,0 +1,115 @@
+import re
+from collections import deque
+from typing import Optional
+
+# ---------- Intent routing ----------
+# Every catalog key, name and synonym (Arabic and English) is compiled into one
+# Aho-Corasick automaton, so routing a message is a single pass over its text no
+# matter how many tools are registered. Catalog entries can add their own
+# "synonyms": [...]; SYNONYMS below covers the built-in tools.
+
+SYNONYMS = {
+    "evm": ["evm", "earned value", "spi", "cpi", "eac", "القيمة المكتسبة", "مؤشر الأداء", "أداء المشروع"],
+    "ifrs15": ["ifrs", "ifrs15", "ifrs 15", "revenue recognition", "الاعتراف بالإيراد", "الاعتراف بالايراد", "إيرادات العقود"],
+    "procure": ["procure", "procurement", "purchase", "purchasing", "شراء", "مشتريات", "توريد", "طلب شراء"],
+    "reports": ["report", "reports", "تقرير", "تقارير"],
+    "ai": ["assistant", "orchestrator", "مساعد"],
+}
+
+_TASHKEEL = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u0640]")  # harakat, superscript alef, tatweel
+_ARABIC_MAP = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ة": "ه", "ى": "ي", "ؤ": "و", "ئ": "ي",
+                             "\u2011": "-", "\u2010": "-", "\u2013": "-", "\u00a0": " "})
+
+def normalize(text: str) -> str:
+    # lowercase, strip Arabic diacritics/tatweel and fold letter variants (أ/إ/آ -> ا, ة -> ه, ى -> ي)
+    return _TASHKEEL.sub("", text.lower()).translate(_ARABIC_MAP)
+
+class Automaton:
+    def __init__(self):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.out: list[list[tuple[int, str]]] = [[]]   # (pattern length, intent) ending at this state
+
+    def add(self, pattern: str, intent: str):
+        s = 0
+        for ch in pattern:
+            nxt = self.goto[s].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[s][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            s = nxt
+        self.out[s].append((len(pattern), intent))
+
+    def build(self):
+        q = deque(self.goto[0].values())
+        while q:
+            s = q.popleft()
+            for ch, nxt in self.goto[s].items():
+                q.append(nxt)
+                f = self.fail[s]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if self.goto[f].get(ch, 0) != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text: str):
+        # yields (start, length, intent) for every pattern occurrence
+        s = 0
+        goto, fail, out = self.goto, self.fail, self.out
+        for i, ch in enumerate(text):
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            for n, intent in out[s]:
+                yield i - n + 1, n, intent
+
+def _latin(p: str) -> bool:
+    return p[:1].isascii() and p[:1].isalnum()
+
+def _word_char(t: str, i: int) -> bool:
+    # ASCII letter/digit at index i (False outside the text)
+    return 0 <= i < len(t) and t[i].isascii() and t[i].isalnum()
+
+class IntentRouter:
+    def __init__(self, synonyms: Optional[dict[str, list[str]]] = None):
+        self.synonyms = synonyms if synonyms is not None else SYNONYMS
+        self.source = None
+        self.names: dict[str, str] = {}
+        self.order: dict[str, int] = {}
+        self.auto = Automaton()
+
+    def compile(self, catalog: list[dict]):
+        auto, names, order = Automaton(), {}, {}
+        for i, c in enumerate(catalog):
+            key = str(c.get("key", "")).strip()
+            if not key:
+                continue
+            names[key], order[key] = c.get("name") or key, i
+            pats = {key, c.get("name") or ""} | set(self.synonyms.get(key, ())) | set(c.get("synonyms") or ())
+            for p in pats:
+                p = normalize(str(p)).strip()
+                if len(p) >= 2:
+                    auto.add(p, key)
+        auto.build()
+        self.auto, self.names, self.order, self.source = auto, names, order, catalog
+
+    def route(self, text: str, catalog: list[dict]) -> Optional[str]:
+        # best intent for text, recompiling only when the catalog object changed
+        if catalog is not self.source:
+            self.compile(catalog)
+        t = normalize(text)
+        score: dict[str, int] = {}
+        first: dict[str, int] = {}
+        for start, n, intent in self.auto.find(t):
+            # Latin patterns must be whole words ("ai" is not in "said" or "aim", "eac" not in "each");
+            # Arabic ones may follow a prefix (ال، و، ب)
+            if _latin(t[start]) and (_word_char(t, start - 1) or _word_char(t, start + n)):
+                continue
+            score[intent] = score.get(intent, 0) + n
+            first.setdefault(intent, start)
+        if not score:
+            return None
+        return max(score, key=lambda k: (score[k], -first[k], -self.order.get(k, 0)))
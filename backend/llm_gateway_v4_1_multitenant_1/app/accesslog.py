@@ -0,0 +1,164 @@
+import os, sys, json, random, asyncio, typing as t
+
+try:
+    import orjson
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:  # orjson is optional; stdlib json is ~5x slower but fine off the loop
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# ---------- Access log pipeline ----------
+# The request path only samples and does put_nowait() on a bounded queue; a
+# background task drains it in batches, serializes, and writes from a worker
+# thread, so a slow stdout/collector never stalls the event loop. When the
+# queue is full the record is dropped and counted.
+#   ACCESS_LOG=stdout|file|off   ACCESS_LOG_FILE=./data/access.log
+#   ACCESS_LOG_MAX_BYTES=100MB   ACCESS_LOG_BACKUPS=5
+#   ACCESS_LOG_QUEUE=10000       ACCESS_LOG_BATCH=500
+#   ACCESS_LOG_SAMPLE="default=1,2xx=0.1,tenant:mars=0.5"
+# Sampling rules are checked in order: exact status ("429"), tenant ("tenant:<name>"),
+# status class ("5xx"), "default"; the first match gives the keep ratio. Without an
+# explicit rule, responses >= 400 are always kept.
+
+def parse_sampling(spec: str) -> dict[str, float]:
+    rules = {}
+    for part in spec.split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            rules[k.strip().lower()] = max(0.0, min(1.0, float(v)))
+    return rules
+
+class _StdoutSink:
+    def write(self, data: bytes):
+        out = sys.stdout.buffer
+        out.write(data)
+        out.flush()
+
+    def close(self):
+        pass
+
+class _RotatingFileSink:
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._f = open(path, "ab")
+        self._size = self._f.tell()
+
+    def _rotate(self):
+        self._f.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self._f = open(self.path, "wb")
+        self._size = 0
+
+    def write(self, data: bytes):
+        if self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._f.write(data)
+        self._f.flush()
+        self._size += len(data)
+
+    def close(self):
+        self._f.close()
+
+class AccessLog:
+    def __init__(self):
+        mode = os.getenv("ACCESS_LOG", "stdout").strip().lower()
+        self.enabled = mode not in ("off", "none", "0", "")
+        self.mode = mode
+        self.rules = parse_sampling(os.getenv("ACCESS_LOG_SAMPLE", "default=1"))
+        self.batch = int(os.getenv("ACCESS_LOG_BATCH", "500") or "500")
+        self.maxsize = int(os.getenv("ACCESS_LOG_QUEUE", "10000") or "10000")
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._sink: t.Any = None
+        self.enqueued = self.written = self.dropped = self.sampled_out = self.write_errors = 0
+
+    def _keep(self, status: int, tenant: t.Optional[str]) -> bool:
+        rules = self.rules
+        ratio = rules.get(str(status))
+        if ratio is None and tenant:
+            ratio = rules.get(f"tenant:{tenant.lower()}")
+        if ratio is None:
+            ratio = rules.get(f"{status // 100}xx")
+        if ratio is None:
+            ratio = 1.0 if status >= 400 else rules.get("default", 1.0)
+        return ratio >= 1.0 or (ratio > 0.0 and random.random() < ratio)
+
+    def emit(self, record: dict):
+        # hot path: never blocks, never raises
+        if not self.enabled or self._queue is None:
+            return
+        if not self._keep(record.get("status", 0), record.get("tenant")):
+            self.sampled_out += 1
+            return
+        try:
+            self._queue.put_nowait(record)
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def start(self):
+        if not self.enabled:
+            return
+        if self.mode == "file":
+            self._sink = _RotatingFileSink(os.getenv("ACCESS_LOG_FILE", "./data/access.log"),
+                                           int(os.getenv("ACCESS_LOG_MAX_BYTES", str(100 * 1024 * 1024)) or "0"),
+                                           int(os.getenv("ACCESS_LOG_BACKUPS", "5") or "5"))
+        else:
+            self._sink = _StdoutSink()
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._drain(self._queue))
+
+    def _take_batch(self, q: asyncio.Queue, first: dict) -> tuple[list[dict], bool]:
+        # -> (records, saw the shutdown sentinel)
+        items = [first]
+        while len(items) < self.batch and not q.empty():
+            r = q.get_nowait()
+            if r is None:
+                return items, True
+            items.append(r)
+        return items, False
+
+    async def _write(self, items: list[dict]):
+        data = b"".join(_dumps(r) + b"\n" for r in items)
+        try:
+            await asyncio.to_thread(self._sink.write, data)
+            self.written += len(items)
+        except Exception as e:
+            self.write_errors += 1
+            print("Access log write failed:", e, file=sys.stderr)
+
+    async def _drain(self, q: asyncio.Queue):
+        while True:
+            first = await q.get()
+            if first is None:
+                return
+            items, done = self._take_batch(q, first)
+            await self._write(items)
+            if done:
+                return
+
+    async def close(self):
+        # stop accepting records, let the drainer flush what is queued, then close the sink
+        if self._task is None:
+            return
+        q, self._queue = self._queue, None
+        await q.put(None)
+        await self._task
+        self._task = None
+        self._sink.close()
+
+    def stats(self) -> dict:
+        return {"enqueued": self.enqueued, "written": self.written, "dropped": self.dropped,
+                "sampled_out": self.sampled_out, "write_errors": self.write_errors,
+                "queued": self._queue.qsize() if self._queue else 0}
+
+ACCESS_LOG = AccessLog()
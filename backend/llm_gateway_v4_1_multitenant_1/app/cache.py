@@ -0,0 +1,217 @@
+import os, json, time, asyncio, hashlib, sqlite3, threading, typing as t
+from collections import OrderedDict
+
+# ---------- Completion cache ----------
+# Backends share one interface: get(key) -> str | None, set(key, text), stats().
+#   CACHE_BACKEND=memory|disk|off   CACHE_TTL_S=300   CACHE_MAX_BYTES=64MB
+#   CACHE_MAX_ENTRIES=10000         CACHE_DIR=./data/cache
+#   CACHE_MAX_TEMPERATURE=0   (only cache deterministic-ish requests)
+
+def cache_key(scope: str, provider: str, model: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    raw = json.dumps([scope, provider, model, prompt, temperature, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class CacheStats:
+    __slots__ = ("hits", "misses", "evictions", "expired", "coalesced", "sets")
+
+    def __init__(self):
+        self.hits = self.misses = self.evictions = self.expired = self.coalesced = self.sets = 0
+
+class MemoryCache:
+    # LRU + TTL, bounded by entry count and by total UTF-8 bytes of cached text
+    name = "memory"
+    blocking = False   # plain dict work: called on the event loop
+
+    def __init__(self, ttl: float, max_bytes: int, max_entries: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.bytes = 0
+        self.stats = CacheStats()
+        self._data: "OrderedDict[str, tuple[float, int, str]]" = OrderedDict()  # key -> (expires, size, text)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str) -> t.Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[0] < time.time():
+            self._drop(key)
+            self.stats.expired += 1
+            return None
+        self._data.move_to_end(key)
+        return item[2]
+
+    def set(self, key: str, text: str):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self._drop(key)
+        self._data[key] = (time.time() + self.ttl, size, text)
+        self.bytes += size
+        self.stats.sets += 1
+        while self._data and (self.bytes > self.max_bytes or len(self._data) > self.max_entries):
+            old, _ = next(iter(self._data.items()))
+            self._drop(old)
+            self.stats.evictions += 1
+
+    def _drop(self, key: str):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+class DiskCache:
+    # SQLite file so entries survive restarts and are shared by workers on one host
+    name = "disk"
+    blocking = True    # file I/O and commits: called through asyncio.to_thread
+
+    def __init__(self, path: str, ttl: float, max_bytes: int, max_entries: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, expires REAL, used REAL, size INTEGER, v TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache(used)")
+        self._bytes, self._count = self._totals()
+
+    def _totals(self) -> tuple[int, int]:
+        row = self._db.execute("SELECT COALESCE(SUM(size),0), COUNT(*) FROM cache").fetchone()
+        return int(row[0]), int(row[1])
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> t.Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT expires, v FROM cache WHERE k=?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[0] < now:
+                self._delete("k=?", (key,))
+                self.stats.expired += 1
+                return None
+            self._db.execute("UPDATE cache SET used=? WHERE k=?", (now, key))
+            return row[1]
+
+    def _delete(self, where: str, args: tuple) -> int:
+        size, n = self._db.execute(f"SELECT COALESCE(SUM(size),0), COUNT(*) FROM cache WHERE {where}", args).fetchone()
+        if n:
+            self._db.execute(f"DELETE FROM cache WHERE {where}", args)
+            self._bytes -= int(size)
+            self._count -= int(n)
+        return int(n)
+
+    def set(self, key: str, text: str):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._delete("k=?", (key,))
+            self._db.execute("INSERT INTO cache(k, expires, used, size, v) VALUES (?,?,?,?,?)",
+                             (key, now + self.ttl, now, size, text))
+            self._bytes += size
+            self._count += 1
+            self.stats.sets += 1
+            if self._bytes > self.max_bytes or self._count > self.max_entries:
+                self._delete("expires < ?", (now,))
+            while self._count and (self._bytes > self.max_bytes or self._count > self.max_entries):
+                self.stats.evictions += self._delete(
+                    "k IN (SELECT k FROM cache ORDER BY used LIMIT ?)", (max(1, self._count // 10),))
+
+class SingleFlight:
+    # concurrent callers with the same key share one in-flight upstream call
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: t.Callable[[], t.Awaitable[str]]) -> tuple[str, bool]:
+        while (fut := self._inflight.get(key)) is not None:
+            try:
+                return await asyncio.shield(fut), True
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    raise  # this caller was cancelled, not the leader
+                # the leader went away (client disconnect): take over below
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            res = await fn()
+            fut.set_result(res)
+            return res, False
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+class CompletionCache:
+    def __init__(self):
+        backend = os.getenv("CACHE_BACKEND", "memory").strip().lower()
+        ttl = float(os.getenv("CACHE_TTL_S", "300") or "300")
+        max_bytes = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)) or "0")
+        max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "10000") or "10000")
+        self.max_temperature = float(os.getenv("CACHE_MAX_TEMPERATURE", "0") or "0")
+        if backend == "disk":
+            path = os.path.join(os.getenv("CACHE_DIR", "./data/cache"), "completions.sqlite3")
+            self.backend: t.Any = DiskCache(path, ttl, max_bytes, max_entries)
+        elif backend in ("off", "none", ""):
+            self.backend = None
+        else:
+            self.backend = MemoryCache(ttl, max_bytes, max_entries)
+        self.flight = SingleFlight()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def cacheable(self, temperature: t.Optional[float]) -> bool:
+        return self.enabled and (temperature or 0.0) <= self.max_temperature
+
+    async def get_or_call(self, key: str, fn: t.Callable[[], t.Awaitable[str]]) -> tuple[str, str]:
+        # -> (text, "hit" | "miss" | "coalesced")
+        st = self.backend.stats
+        b = self.backend
+        hit = await asyncio.to_thread(b.get, key) if b.blocking else b.get(key)
+        if hit is not None:
+            st.hits += 1
+            return hit, "hit"
+        text, shared = await self.flight.do(key, fn)
+        if shared:
+            st.coalesced += 1
+            return text, "coalesced"
+        st.misses += 1
+        if b.blocking:
+            await asyncio.to_thread(b.set, key, text)
+        else:
+            b.set(key, text)
+        return text, "miss"
+
+    def stats(self) -> dict:
+        if not self.backend:
+            return {}
+        st = self.backend.stats
+        return {
+            "backend": self.backend.name,
+            "hits": st.hits, "misses": st.misses, "coalesced": st.coalesced,
+            "evictions": st.evictions, "expired": st.expired, "sets": st.sets,
+            "entries": len(self.backend), "bytes": self.backend.bytes,
+            "inflight": len(self.flight._inflight),
+        }
+
+CACHE = CompletionCache()
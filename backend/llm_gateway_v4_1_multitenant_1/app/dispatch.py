@@ -0,0 +1,220 @@
+import os, re, time, heapq, asyncio, logging, itertools, typing as t
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from .metrics import REGISTRY
+
+# ---------- Per-provider dispatch ----------
+# Caps concurrent upstream calls per provider. Callers over the cap wait in a
+# weighted fair queue (start-time fair queueing: a tenant with weight 2 gets
+# twice the dispatch share of weight 1 while both are backlogged), and are
+# rejected with 503 when the queue is full or they waited too long.
+#   DISPATCH_MAX_CONCURRENCY=64   DISPATCH_OLLAMA_MAX_CONCURRENCY=4
+#   DISPATCH_MAX_QUEUE=1000       DISPATCH_QUEUE_TIMEOUT_S=10
+# Optional micro-batching for vLLM (/v1/completions takes a list of prompts; main.py
+# sends them as token ids with the model's chat template already applied):
+#   DISPATCH_VLLM_BATCH_MAX=8     DISPATCH_VLLM_BATCH_WINDOW_MS=5
+
+log = logging.getLogger("llm_gateway.dispatch")
+
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+M_QUEUE_DEPTH = REGISTRY.gauge("dispatch_queue_depth", "Requests waiting for an upstream slot", ("provider",))
+M_ACTIVE = REGISTRY.gauge("dispatch_active", "Upstream calls currently running", ("provider",))
+M_WAIT = REGISTRY.histogram("dispatch_queue_wait_seconds", "Time spent waiting for an upstream slot",
+                            ("provider", "tenant"), buckets=WAIT_BUCKETS, quantiles="dispatch_queue_wait_quantile_seconds")
+M_REJECTED = REGISTRY.counter("dispatch_rejected_total", "Requests rejected by the dispatcher (503)",
+                              ("provider", "tenant", "reason"))
+M_BATCH = REGISTRY.histogram("dispatch_batch_size", "Prompts per upstream micro-batch", ("provider",),
+                             buckets=(1, 2, 4, 8, 16, 32, 64))
+
+def _dispatch_env(name: str, key: str, default: str) -> str:
+    v = os.getenv(f"DISPATCH_{re.sub(r'[^A-Z0-9]', '_', name.upper())}_{key}", "").strip()
+    if v:
+        return v
+    return os.getenv(f"DISPATCH_{key}", default).strip() or default
+
+class Dispatcher:
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._heap: list[tuple[float, int, asyncio.Future]] = []
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._vtime = 0.0                      # virtual time of the last dispatched waiter
+        self._last_tag: dict[str, float] = {}  # tenant -> finish tag of its newest waiter
+
+    def _reject(self, tenant: str, reason: str, detail: str):
+        M_REJECTED.inc(self.name, tenant, reason)
+        raise HTTPException(503, detail, headers={"Retry-After": "1"})
+
+    async def _acquire(self, tenant: str, weight: float):
+        if self.active < self.max_concurrency and not self._waiting:
+            self.active += 1
+            return
+        if self._waiting >= self.max_queue:
+            self._reject(tenant, "queue_full", f"Upstream {self.name} is busy, try again")
+        tag = max(self._vtime, self._last_tag.get(tenant, 0.0)) + 1.0 / max(weight, 0.001)
+        self._last_tag[tenant] = tag
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (tag, next(self._seq), fut))
+        self._waiting += 1
+        M_QUEUE_DEPTH.set(self.name, value=self._waiting)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                return  # handed a slot right as the timer fired; keep it
+            fut.cancel()
+            self._reject(tenant, "queue_timeout", f"Upstream {self.name} queue wait exceeded {self.queue_timeout:g}s")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release()  # pass on the slot we were just given
+            else:
+                fut.cancel()
+            raise
+        finally:
+            if not fut.done() or fut.cancelled():
+                self._waiting -= 1
+                M_QUEUE_DEPTH.set(self.name, value=self._waiting)
+
+    def _release(self):
+        # hand the slot straight to the next live waiter (active count unchanged)
+        while self._heap:
+            tag, _, fut = heapq.heappop(self._heap)
+            if fut.done():
+                continue
+            self._vtime = tag
+            self._waiting -= 1
+            M_QUEUE_DEPTH.set(self.name, value=self._waiting)
+            fut.set_result(None)
+            return
+        self.active -= 1
+        if not self.active:
+            self._last_tag.clear()
+            self._vtime = 0.0
+
+    @asynccontextmanager
+    async def slot(self, tenant: str = "default", weight: float = 1.0):
+        started = time.perf_counter()
+        await self._acquire(tenant, weight)
+        M_WAIT.observe(self.name, tenant, value=time.perf_counter() - started)
+        M_ACTIVE.set(self.name, value=self.active)
+        try:
+            yield
+        finally:
+            self._release()
+            M_ACTIVE.set(self.name, value=self.active)
+
+class MicroBatcher:
+    # Groups prompts that share (model, temperature, max_tokens) for up to
+    # `window` seconds or `max_size` prompts, then runs them as one upstream call.
+    # send(model, temperature, max_tokens, prompts) -> (texts, usage) is supplied by the caller;
+    # texts[i] is the reply to prompts[i]. Every prompt takes its own dispatcher slot under
+    # its own tenant and weight before joining a batch and holds it until the batch returns,
+    # so the fair queue orders prompts exactly as it would unbatched calls. prepare(), when
+    # given, builds the prompt inside that slot (it may call upstream itself); if it returns
+    # None the prompt cannot be batched and submit returns None without joining a batch.
+    def __init__(self, name: str, max_size: int, window: float,
+                 send: t.Callable[[str, float, int, list], t.Awaitable[tuple[list[str], dict]]]):
+        self.name = name
+        self.max_size = max_size
+        self.window = window
+        self.send = send
+        self._open: dict[tuple, list[tuple[t.Any, asyncio.Future]]] = {}
+        self._tasks: set[asyncio.Task] = set()   # batches in flight; the loop keeps only weak refs
+
+    async def submit(self, dispatcher: Dispatcher, tenant: str, weight: float, model: str,
+                     temperature: float, max_tokens: int, prompt: t.Any = None,
+                     prepare: t.Callable[[], t.Awaitable[t.Any]] | None = None) -> tuple[str, dict] | None:
+        async with dispatcher.slot(tenant, weight):
+            if prepare is not None:
+                prompt = await prepare()
+                if prompt is None:
+                    return None
+            key = (model, temperature, max_tokens)
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            batch = self._open.get(key)
+            if batch is None:
+                batch = self._open[key] = []
+                loop.call_later(self.window, self._close, key, batch)
+            batch.append((prompt, fut))
+            if len(batch) >= self.max_size:
+                self._close(key, batch)
+            return await fut
+
+    def _close(self, key: tuple, batch: list):
+        if self._open.get(key) is not batch:
+            return  # already flushed by size
+        del self._open[key]
+        task = asyncio.ensure_future(self._run(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("micro-batch for %s failed", self.name, exc_info=task.exception())
+
+    async def aclose(self):
+        # shutdown: cancel batches still in flight (their callers get CancelledError)
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, key: tuple, batch: list):
+        live = [(p, f) for p, f in batch if not f.done()]
+        if not live:
+            return
+        M_BATCH.observe(self.name, value=len(live))
+        try:
+            texts, usage = await self.send(key[0], key[1], key[2], [p for p, _ in live])
+            if len(texts) != len(live):
+                raise HTTPException(502, f"Upstream {self.name} returned {len(texts)} replies for {len(live)} prompts")
+        except asyncio.CancelledError:
+            for _, f in live:
+                f.cancel()
+            raise
+        except BaseException as e:
+            for _, f in live:
+                if not f.done():
+                    f.set_exception(e)
+            return
+        n = len(live)
+        share = {k: v / n for k, v in usage.items()}
+        for (_, f), text in zip(live, texts):
+            if not f.done():
+                f.set_result((text, dict(share)))
+
+class Dispatchers:
+    def __init__(self):
+        self._by_name: dict[str, Dispatcher] = {}
+        self._batchers: dict[str, MicroBatcher | None] = {}
+
+    def get(self, name: str) -> Dispatcher:
+        d = self._by_name.get(name)
+        if d is None:
+            d = self._by_name[name] = Dispatcher(
+                name,
+                int(_dispatch_env(name, "MAX_CONCURRENCY", "64")),
+                int(_dispatch_env(name, "MAX_QUEUE", "1000")),
+                float(_dispatch_env(name, "QUEUE_TIMEOUT_S", "10")))
+        return d
+
+    def batcher(self, name: str, send) -> MicroBatcher | None:
+        if name not in self._batchers:
+            size = int(_dispatch_env(name, "BATCH_MAX", "1"))
+            window = float(_dispatch_env(name, "BATCH_WINDOW_MS", "5")) / 1000.0
+            self._batchers[name] = MicroBatcher(name, size, window, send) if size > 1 else None
+        return self._batchers[name]
+
+    async def aclose(self):
+        for b in self._batchers.values():
+            if b is not None:
+                await b.aclose()
+
+DISPATCH = Dispatchers()
@@ -0,0 +1,384 @@
+import os, sys, math, asyncio, sqlite3, threading, time, typing as t
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+
+# ---------- Rate limit + quota backends ----------
+# Every backend answers one call per request:
+#   await LIMITER.admit(ident, rps, burst, quota_key, quota_limit, cost) -> None | "rate" | "quota"
+# ident is the token-bucket id ("key:..." / "ip:..."); quota_key is None when no daily quota applies.
+# When the real cost is only known afterwards (LLM tokens), the difference is settled with
+#   await LIMITER.adjust(ident, rps, burst, quota_key, delta)   # delta < 0 refunds, > 0 charges (may go into debt)
+#   LIMITER_BACKEND=memory   process-local (one bucket per worker, quotas reset on restart)
+#   LIMITER_BACKEND=sqlite   shared by all workers on one host, durable quotas (LIMITER_SQLITE_PATH)
+#   LIMITER_BACKEND=redis    shared by all replicas, one round trip per request (LIMITER_REDIS_URL)
+
+def _today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+class Bucket:
+    __slots__ = ("tokens", "ts", "full_at")
+
+    def __init__(self, tokens: float, ts: float):
+        self.tokens = tokens
+        self.ts = ts
+        self.full_at = ts  # when the bucket is back to `burst`; evicting it after that is lossless
+
+class MemoryLimiter:
+    # Buckets sit in an OrderedDict in last-used order, so both bounds are cheap:
+    #   LIMITER_MAX_BUCKETS  LRU cap, oldest bucket goes first (new identities, e.g. key spraying)
+    #   LIMITER_IDLE_S       sweep every LIMITER_SWEEP_S drops buckets idle that long and already refilled
+    # Quotas keep only the current UTC day; older days are dropped on rollover.
+    name = "memory"
+
+    def __init__(self, default_rps: float, default_burst: float, max_buckets: int = 100_000,
+                 idle_s: float = 600.0, sweep_s: float = 30.0):
+        self.default_rps = default_rps
+        self.default_burst = default_burst
+        self.max_buckets = max_buckets
+        self.idle_s = idle_s
+        self.sweep_s = sweep_s
+        self.buckets: "OrderedDict[str, Bucket]" = OrderedDict()
+        self.key_bytes = 0
+        self.evicted_lru = 0
+        self.evicted_idle = 0
+        self.quota_day = ""
+        self.quota_used: dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self.sweep_s > 0:
+            self._task = asyncio.create_task(self._sweeper())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_s)
+            self.sweep()
+
+    def _drop(self, ident: str):
+        del self.buckets[ident]
+        self.key_bytes -= sys.getsizeof(ident)
+
+    def sweep(self, now: float | None = None) -> int:
+        # walk from the least recently used end; stop at the first bucket that is not idle yet
+        now = time.time() if now is None else now
+        cutoff = now - self.idle_s
+        drop = []
+        for ident, b in self.buckets.items():
+            if b.ts > cutoff:
+                break
+            if b.full_at <= now:
+                drop.append(ident)
+        for ident in drop:
+            self._drop(ident)
+        self.evicted_idle += len(drop)
+        return len(drop)
+
+    async def admit(self, ident: str, rps: float, burst: float, quota_key: str | None = None,
+                    quota_limit: int = 0, cost: float = 1.0) -> str | None:
+        now = time.time()
+        b = self.buckets.get(ident)
+        if b is None:
+            b = self.buckets[ident] = Bucket(burst, now)
+            self.key_bytes += sys.getsizeof(ident)
+            if len(self.buckets) > self.max_buckets:
+                self._drop(next(iter(self.buckets)))
+                self.evicted_lru += 1
+        else:
+            self.buckets.move_to_end(ident)
+            # refill
+            b.tokens = min(burst, b.tokens + (now - b.ts) * rps)
+            b.ts = now
+        if b.tokens < cost:
+            return "rate"
+        # quota before debiting the bucket: a quota reject costs no rate tokens (same as the Lua script)
+        if quota_key is not None:
+            today = _today()
+            if today != self.quota_day:
+                self.quota_day, self.quota_used = today, {}
+            used = self.quota_used.get(quota_key, 0.0)
+            if used + cost > quota_limit:
+                return "quota"
+            self.quota_used[quota_key] = used + cost
+        b.tokens -= cost
+        b.full_at = now + (burst - b.tokens) / rps if rps > 0 else math.inf
+        return None
+
+    async def adjust(self, ident: str, rps: float, burst: float, quota_key: str | None, delta: float):
+        b = self.buckets.get(ident)
+        if b is not None:
+            b.tokens = min(burst, b.tokens - delta)
+            b.full_at = b.ts + (burst - b.tokens) / rps if rps > 0 else math.inf
+        if quota_key is not None and self.quota_day == _today():
+            self.quota_used[quota_key] = max(0.0, self.quota_used.get(quota_key, 0.0) + delta)
+
+    def memory_bytes(self) -> int:
+        # container + per-entry objects (Bucket with three floats, key strings)
+        n = len(self.buckets)
+        per_bucket = sys.getsizeof(Bucket(0.0, 0.0)) + 3 * sys.getsizeof(0.0)
+        return (sys.getsizeof(self.buckets) + n * per_bucket + self.key_bytes
+                + sys.getsizeof(self.quota_used) + sum(sys.getsizeof(k) for k in self.quota_used))
+
+    def stats(self) -> dict:
+        return {"buckets": len(self.buckets), "bytes": self.memory_bytes(),
+                "evicted_lru": self.evicted_lru, "evicted_idle": self.evicted_idle,
+                "quota_keys": len(self.quota_used)}
+
+class SQLiteLimiter:
+    # Token buckets live in one SQLite file (WAL) so every worker on the host sees
+    # the same bucket; a bucket update is a single short IMMEDIATE transaction.
+    # Quota increments are counted locally and flushed in batches every
+    # LIMITER_QUOTA_FLUSH_S; admission checks the last shared total plus the
+    # local unflushed count, so the overshoot across workers is bounded by one
+    # flush interval of traffic. Like the memory backend, buckets idle for LIMITER_IDLE_S
+    # and already refilled are deleted every LIMITER_SWEEP_S, so the table stays bounded.
+    name = "sqlite"
+
+    def __init__(self, path: str, flush_s: float, idle_s: float = 600.0, sweep_s: float = 30.0):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.flush_s = flush_s
+        self.idle_s = idle_s
+        self.sweep_s = sweep_s
+        self.evicted_idle = 0
+        self._local = threading.local()
+        self._pending: dict[tuple[str, str], float] = defaultdict(float)
+        self._shared: dict[tuple[str, str], float] = {}
+        self._task: asyncio.Task | None = None
+        self._sweep_task: asyncio.Task | None = None
+        db = self._db()
+        db.execute("CREATE TABLE IF NOT EXISTS buckets (ident TEXT PRIMARY KEY, tokens REAL, ts REAL, full_at REAL)")
+        db.execute("CREATE TABLE IF NOT EXISTS quotas (day TEXT, key TEXT, used REAL, PRIMARY KEY (day, key))")
+        if "full_at" not in [r[1] for r in db.execute("PRAGMA table_info(buckets)")]:
+            db.execute("ALTER TABLE buckets ADD COLUMN full_at REAL")   # files from before idle pruning
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flusher())
+        if self.sweep_s > 0:
+            self._sweep_task = asyncio.create_task(self._sweeper())
+
+    async def close(self):
+        for task in (self._task, self._sweep_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        await self.flush()
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_s)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except sqlite3.Error as e:
+                print("Limiter bucket sweep failed:", e)
+
+    def sweep(self, now: float | None = None) -> int:
+        # a bucket idle that long and back at `burst` is the same as no row; rows from older
+        # files have no full_at and go once they are idle
+        now = time.time() if now is None else now
+        n = self._db().execute("DELETE FROM buckets WHERE ts <= ? AND (full_at IS NULL OR full_at <= ?)",
+                               (now - self.idle_s, now)).rowcount
+        self.evicted_idle += n
+        return n
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_s)
+            try:
+                await self.flush()
+            except sqlite3.Error as e:
+                print("Limiter quota flush failed:", e)
+
+    async def flush(self):
+        # swap the pending map on the loop thread so admit() never races the writer
+        pending, self._pending = self._pending, defaultdict(float)
+        try:
+            today, rows = await asyncio.to_thread(self._write_quotas, pending)
+        except BaseException:
+            for k, n in pending.items():  # keep them for the next flush
+                self._pending[k] += n
+            raise
+        self._shared = {(today, k): used for k, used in rows}
+
+    def _write_quotas(self, pending: dict) -> tuple[str, list]:
+        db = self._db()
+        today = _today()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for (day, key), n in pending.items():
+                db.execute("INSERT INTO quotas(day, key, used) VALUES (?,?,?) "
+                           "ON CONFLICT(day, key) DO UPDATE SET used = used + excluded.used", (day, key, n))
+            rows = db.execute("SELECT key, used FROM quotas WHERE day=?", (today,)).fetchall()
+            db.execute("DELETE FROM quotas WHERE day < date(?, '-7 day')", (today,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return today, rows
+
+    def _take_bucket(self, ident: str, rps: float, burst: float, cost: float) -> bool:
+        db = self._db()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT tokens, ts FROM buckets WHERE ident=?", (ident,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rps)
+            ok = tokens >= cost
+            if ok:
+                tokens -= cost
+            full_at = now + (burst - tokens) / rps if rps > 0 else math.inf
+            db.execute("INSERT OR REPLACE INTO buckets(ident, tokens, ts, full_at) VALUES (?,?,?,?)",
+                       (ident, tokens, now, full_at))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return ok
+
+    async def admit(self, ident: str, rps: float, burst: float, quota_key: str | None = None,
+                    quota_limit: int = 0, cost: float = 1.0) -> str | None:
+        if not await asyncio.to_thread(self._take_bucket, ident, rps, burst, cost):
+            return "rate"
+        if quota_key is not None:
+            k = (_today(), quota_key)
+            if self._shared.get(k, 0.0) + self._pending.get(k, 0.0) + cost > quota_limit:
+                # give the rate tokens back, as the memory and Redis backends never take them
+                await asyncio.to_thread(self._adjust_bucket, ident, rps, burst, -cost)
+                return "quota"
+            self._pending[k] += cost
+        return None
+
+    def _adjust_bucket(self, ident: str, rps: float, burst: float, delta: float):
+        # full_at from the new token count (a debt pushes it out, a refund brings it in)
+        self._db().execute("UPDATE buckets SET tokens = MIN(?1, tokens - ?2), "
+                           "full_at = ts + (?1 - MIN(?1, tokens - ?2)) / ?3 WHERE ident=?4",
+                           (burst, delta, rps if rps > 0 else 1e-9, ident))
+
+    async def adjust(self, ident: str, rps: float, burst: float, quota_key: str | None, delta: float):
+        await asyncio.to_thread(self._adjust_bucket, ident, rps, burst, delta)
+        if quota_key is not None:
+            self._pending[(_today(), quota_key)] += delta
+
+    def stats(self) -> dict:
+        return {"pending_quota_keys": len(self._pending), "evicted_idle": self.evicted_idle}
+
+# KEYS[1]=bucket KEYS[2]=quota ; ARGV = rps, burst, cost, quota_limit (-1 = none), quota_ttl_s
+REDIS_ADMIT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rps, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rps)
+if tokens < cost then
+  redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+  redis.call('EXPIRE', KEYS[1], math.ceil(burst / math.max(rps, 0.001)) + 60)
+  return 1
+end
+local limit = tonumber(ARGV[4])
+if limit >= 0 then
+  local used = tonumber(redis.call('GET', KEYS[2]) or '0')
+  if used + cost > limit then
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    return 2
+  end
+  redis.call('INCRBYFLOAT', KEYS[2], cost)
+  redis.call('EXPIRE', KEYS[2], tonumber(ARGV[5]))
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens - cost, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / math.max(rps, 0.001)) + 60)
+return 0
+"""
+
+# KEYS[1]=bucket KEYS[2]=quota ; ARGV = burst, delta, has_quota (0/1)
+REDIS_ADJUST = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+  redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[1]), tokens - tonumber(ARGV[2])))
+end
+if ARGV[3] == '1' and redis.call('EXISTS', KEYS[2]) == 1 then
+  redis.call('INCRBYFLOAT', KEYS[2], ARGV[2])
+end
+return 0
+"""
+
+class RedisLimiter:
+    # bucket refill + take + quota increment in one atomic Lua call (one round trip);
+    # daily quota keys persist with Redis and expire two days after first use
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str, fail_open: bool):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("LIMITER_BACKEND=redis needs the 'redis' package (pip install redis)") from e
+        self._redis = aioredis.from_url(url)
+        self._script = self._redis.register_script(REDIS_ADMIT)
+        self._adjust = self._redis.register_script(REDIS_ADJUST)
+        self.prefix = prefix
+        self.fail_open = fail_open
+        self.errors = 0
+
+    async def start(self):
+        await self._redis.ping()
+
+    async def close(self):
+        await self._redis.aclose()
+
+    async def admit(self, ident: str, rps: float, burst: float, quota_key: str | None = None,
+                    quota_limit: int = 0, cost: float = 1.0) -> str | None:
+        keys = [f"{self.prefix}bucket:{ident}", f"{self.prefix}quota:{_today()}:{quota_key or ''}"]
+        args = [rps, burst, cost, quota_limit if quota_key is not None else -1, 2 * 86400]
+        try:
+            res = int(await self._script(keys=keys, args=args))
+        except Exception as e:
+            self.errors += 1
+            if self.fail_open:
+                return None
+            raise RuntimeError(f"rate limiter unavailable: {e!r}") from e
+        return (None, "rate", "quota")[res]
+
+    async def adjust(self, ident: str, rps: float, burst: float, quota_key: str | None, delta: float):
+        keys = [f"{self.prefix}bucket:{ident}", f"{self.prefix}quota:{_today()}:{quota_key or ''}"]
+        try:
+            await self._adjust(keys=keys, args=[burst, delta, 1 if quota_key is not None else 0])
+        except Exception:
+            self.errors += 1  # best effort: the request was already admitted
+
+    def stats(self) -> dict:
+        return {"errors": self.errors}
+
+def make_limiter(default_rps: float, default_burst: float):
+    backend = os.getenv("LIMITER_BACKEND", "memory").strip().lower()
+    idle_s = float(os.getenv("LIMITER_IDLE_S", "600") or "600")
+    sweep_s = float(os.getenv("LIMITER_SWEEP_S", "30") or "30")
+    if backend == "sqlite":
+        return SQLiteLimiter(os.getenv("LIMITER_SQLITE_PATH", "./data/limiter.sqlite3"),
+                             float(os.getenv("LIMITER_QUOTA_FLUSH_S", "1") or "1"), idle_s, sweep_s)
+    if backend == "redis":
+        return RedisLimiter(os.getenv("LIMITER_REDIS_URL", "redis://localhost:6379/0"),
+                            os.getenv("LIMITER_PREFIX", "llmgw:"),
+                            os.getenv("LIMITER_FAIL_OPEN", "1") not in ("0", "false", "no"))
+    return MemoryLimiter(default_rps, default_burst,
+                         max_buckets=int(os.getenv("LIMITER_MAX_BUCKETS", "100000") or "100000"),
+                         idle_s=idle_s, sweep_s=sweep_s)
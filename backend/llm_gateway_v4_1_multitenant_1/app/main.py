@@ -1,17 +1,27 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, HTMLResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
-import os, httpx, typing as t, json, asyncio, time, uuid
-from collections import defaultdict
-from datetime import datetime
+import os, httpx, typing as t, json, asyncio, hmac, logging, math, time, uuid
+from contextlib import asynccontextmanager
+from .pools import POOLS
+from .cache import CACHE, cache_key
+from .metrics import REGISTRY, Counter, Gauge
+from .limiter import make_limiter
+from .accesslog import ACCESS_LOG
+from .dispatch import DISPATCH
+from .routing import Router, Route, Backend
+from .tokens import ESTIMATOR, TokenMeter, heuristic_tokens
+from .tenants import TenantConfig, TenantRegistry
+
+log = logging.getLogger("llm_gateway")
 
 # -------- OpenTelemetry (optional) --------
 def _init_tracing():
     try:
         endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT","").strip()
         if not endpoint:
-            return None
+            return None, None
         protocol = os.getenv("OTEL_EXPORTER_OTLP_PROTOCOL","grpc").strip().lower()
         service_name = os.getenv("OTEL_RESOURCE_SERVICE_NAME","llm-gateway")
         headers = os.getenv("OTEL_HEADERS","")
@@ -25,17 +35,47 @@ def _init_tracing():
         else:
             from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
             exporter = OTLPSpanExporter(endpoint=endpoint, headers=dict([h.split("=",1) for h in headers.split(",") if "=" in h]) if headers else None)
-        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
-        provider.add_span_processor(BatchSpanProcessor(exporter))
+        from .tracing import sampling_from_env
+        batch = BatchSpanProcessor(exporter)
+        sampler, tail = sampling_from_env(batch)   # see app/tracing.py for TRACE_* settings
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}), sampler=sampler)
+        provider.add_span_processor(tail or batch)
         trace.set_tracer_provider(provider)
-        return trace.get_tracer(__name__)
+        return trace.get_tracer(__name__), tail
     except Exception as e:
         print("Tracing init failed:", e)
-        return None
-
-tracer = _init_tracing()
+        return None, None
+
+tracer, TRACE_TAIL = _init_tracing()
+ROUTER = Router(tracer)
+
+# ---------- Lifespan: upstream pools, limiter, access log ----------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # warm every routed backend (or only those in POOL_WARMUP=openai-main,gpu-1) so
+    # the first request does not pay for the TCP/TLS handshake
+    only = {p.strip() for p in env("POOL_WARMUP").split(",") if p.strip()}
+    conns = int(env("POOL_WARMUP_CONNECTIONS", "1") or "1")
+    warm = [POOLS.warmup(b.name, _provider_base(b), conns, b.provider) for b in ROUTER.backends.values()
+            if _provider_base(b) and (not only or b.name in only)]
+    if warm:
+        await asyncio.gather(*warm)
+    if ESTIMATOR.mode != "heuristic":
+        loaded = await asyncio.to_thread(ESTIMATOR.load)
+        print(f"Token estimator: tiktoken {loaded}" if loaded else "Token estimator: heuristic (tiktoken tables unavailable)")
+    await LIMITER.start()
+    await ACCESS_LOG.start()
+    await TENANTS.start()
+    try:
+        yield
+    finally:
+        await TENANTS.close()
+        await LIMITER.close()
+        await DISPATCH.aclose()
+        await POOLS.aclose()
+        await ACCESS_LOG.close()
 
-app = FastAPI(title="LLM Gateway v4.1 — Multi-tenant + OTLP", version="4.1.0")
+app = FastAPI(title="LLM Gateway v4.1 — Multi-tenant + OTLP", version="4.1.0", lifespan=lifespan)
 
 # --- CORS ---
 app.add_middleware(
@@ -50,121 +90,280 @@ def env(name: str, default: str = "") -> str:
     return os.getenv(name, default)
 
 # ---------- Multi-tenant keys ----------
-API_KEYS_FILE = env("API_KEYS_FILE", "").strip()
-MULTI_TENANT = False
-TENANT_KEYS: dict[str, dict] = {}   # key -> {tenant, rps, burst, quota_daily}
-if API_KEYS_FILE and os.path.exists(API_KEYS_FILE):
-    try:
-        with open(API_KEYS_FILE, "r", encoding="utf-8") as f:
-            arr = json.load(f)
-        for item in arr:
-            TENANT_KEYS[str(item["key"])] = {
-                "tenant": item["tenant"],
-                "rps": float(item.get("rps", 5)),
-                "burst": float(item.get("burst", 20)),
-                "quota_daily": int(item.get("quota_daily", 10000)),
-            }
-        MULTI_TENANT = True
-        print(f"Multi-tenant mode ON. Tenants: {[v['tenant'] for v in TENANT_KEYS.values()]}")
-    except Exception as e:
-        print("Failed loading API_KEYS_FILE:", e)
+# TENANTS.current is swapped whole on reload. guard_and_trace reads it once per request and
+# keeps that snapshot in request.state.tenants; everything downstream uses _config(request).
+TENANTS = TenantRegistry(env("API_KEYS_FILE", "").strip(), float(env("API_KEYS_WATCH_S", "2") or "2"))
+TENANTS.load()
+ADMIN_TOKEN = env("ADMIN_TOKEN", "").strip()   # enables POST /admin/reload (X-Admin-Token)
 
-BACKEND_KEY = env("BACKEND_API_KEY", "") if not MULTI_TENANT else ""
+def _config(req: Request) -> TenantConfig:
+    return getattr(req.state, "tenants", None) or TENANTS.current
 
 # ---------- Rate limit + quotas ----------
 GLOBAL_RPS = float(env("RATE_LIMIT_RPS", "5") or "5")
 GLOBAL_BURST = float(env("RATE_LIMIT_BURST", "20") or "20")
 
-# token buckets
-TOKENS = defaultdict(lambda: {"tokens": GLOBAL_BURST, "ts": time.time(), "rps": GLOBAL_RPS, "burst": GLOBAL_BURST})
-# daily quotas per key {date_str: {key: used_count}}
-QUOTAS: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+LIMITER = make_limiter(GLOBAL_RPS, GLOBAL_BURST)
 
 def _id_for_request(req: Request, key: str | None) -> str:
-    if MULTI_TENANT:
+    if _config(req).multi_tenant:
         return f"key:{key or 'unknown'}"
     if key:
         return f"key:{key}"
     ip = req.client.host if req.client else "unknown"
     return f"ip:{ip}"
 
-def rate_limit_and_quota(req: Request, key: str | None):
+async def rate_limit_and_quota(req: Request, key: str | None, cfg: TenantConfig, tenant: str):
     # choose limits
     rps, burst = GLOBAL_RPS, GLOBAL_BURST
-    if MULTI_TENANT and key in TENANT_KEYS:
-        rps = TENANT_KEYS[key]["rps"]
-        burst = TENANT_KEYS[key]["burst"]
-
-    ident = _id_for_request(req, key)
-    b = TOKENS[ident]
-    now = time.time()
-    # update RPS/BURST if changed
-    b["rps"] = rps
-    b["burst"] = burst
-    # refill
-    elapsed = now - b["ts"]
-    b["tokens"] = min(b["burst"], b["tokens"] + elapsed * b["rps"])
-    b["ts"] = now
-    if b["tokens"] < 1.0:
+    quota_key, quota_limit = None, 0
+    if cfg.multi_tenant and key in cfg.keys:
+        rps = cfg.keys[key]["rps"]
+        burst = cfg.keys[key]["burst"]
+        # quota (per day, simple count of requests)
+        quota_key, quota_limit = key, cfg.keys[key]["quota_daily"]
+
+    verdict = await LIMITER.admit(_id_for_request(req, key), rps, burst, quota_key, quota_limit)
+    if verdict == "rate":
+        M_RATE_LIMITED.inc(tenant)
         raise HTTPException(429, "Rate limit exceeded")
-    b["tokens"] -= 1.0
-
-    # quota (per day, simple count of requests)
-    if MULTI_TENANT and key in TENANT_KEYS:
-        today = datetime.utcnow().strftime("%Y-%m-%d")
-        used = QUOTAS[today][key]
-        if used >= TENANT_KEYS[key]["quota_daily"]:
-            raise HTTPException(403, "Daily quota exceeded for this API key")
-        QUOTAS[today][key] = used + 1
+    if verdict == "quota":
+        M_QUOTA_REJECTED.inc(tenant)
+        raise HTTPException(403, "Daily quota exceeded for this API key")
+
+# ---------- Token budgets ----------
+# The bucket above counts requests; these count work. /llm/complete reserves its
+# estimated prompt tokens + max_tokens from a token bucket and a daily token quota
+# before going upstream, then settles the difference against the usage the provider
+# reports (or an estimate of prompt + reply when it reports none). Cache hits and
+# failed calls are refunded. Tenants override the defaults with token_rps /
+# token_burst / token_quota_daily in API_KEYS_FILE; 0 disables a limit.
+#   TOKEN_RATE_LIMIT_TPS=0   TOKEN_RATE_LIMIT_BURST=0 (0 = 60 s worth of TPS)   TOKEN_QUOTA_DAILY=0
+TOKEN_TPS = float(env("TOKEN_RATE_LIMIT_TPS", "0") or "0")
+TOKEN_BURST = float(env("TOKEN_RATE_LIMIT_BURST", "0") or "0")
+TOKEN_QUOTA = int(env("TOKEN_QUOTA_DAILY", "0") or "0")
+TOKEN_UNLIMITED = 1e15          # bucket size/refill for quota-only budgets
+TOKEN_OFFLOAD_CHARS = 65536     # estimate longer prompts / replies off the event loop
+TOKEN_METER = TokenMeter(float(env("TOKEN_METER_TAU_S", "60") or "60"))
+
+class TokenGrant:
+    __slots__ = ("ident", "rps", "burst", "quota_key", "reserved", "prompt_estimate", "prompt_heuristic", "prompt")
+
+    def __init__(self, ident: str | None, rps: float, burst: float, quota_key: str | None,
+                 reserved: float, prompt_estimate: int, prompt_heuristic: int, prompt: str | None = None):
+        self.ident = ident          # None when no token limit applies (usage is still metered)
+        self.rps = rps
+        self.burst = burst
+        self.quota_key = quota_key
+        self.reserved = reserved
+        self.prompt_estimate = prompt_estimate
+        self.prompt_heuristic = prompt_heuristic   # uncalibrated count for ESTIMATOR.observe (0 = exact)
+        self.prompt = prompt        # set when admission skipped the estimate (no token limits)
+
+async def reserve_tokens(req: Request, key: str | None, tenant: str, model: str, prompt: str,
+                         max_tokens: int) -> TokenGrant:
+    tenants = _config(req)
+    cfg = tenants.keys.get(key or "", {}) if tenants.multi_tenant else {}
+    rps = cfg.get("token_rps", TOKEN_TPS)
+    burst = cfg.get("token_burst", TOKEN_BURST) or rps * 60
+    quota = cfg.get("token_quota_daily", TOKEN_QUOTA)
+    if rps <= 0 and quota <= 0:
+        # no budget to reserve from, so no estimate up front; settle_tokens meters the prompt
+        # from the provider's usage, or counts it then if the provider reports none
+        return TokenGrant(None, 0, 0, None, 0, 0, 0, prompt)
+    if len(prompt) > TOKEN_OFFLOAD_CHARS:
+        estimate, heuristic = await asyncio.to_thread(ESTIMATOR.estimate, prompt, model)
+    else:
+        estimate, heuristic = ESTIMATOR.estimate(prompt, model)
+    if rps <= 0:
+        rps = burst = TOKEN_UNLIMITED
+    # a single request larger than the bucket would never fit; it drains the bucket instead
+    cost = float(min(estimate + max(0, max_tokens), burst))
+    ident = "tok:" + _id_for_request(req, key)
+    quota_key = ident if quota > 0 else None
+    verdict = await LIMITER.admit(ident, rps, burst, quota_key, quota, cost)
+    if verdict == "rate":
+        M_TOKEN_REJECTED.inc(tenant, "rate")
+        raise HTTPException(429, "Token rate limit exceeded", headers={"Retry-After": str(max(1, math.ceil(cost / rps)))})
+    if verdict == "quota":
+        M_TOKEN_REJECTED.inc(tenant, "quota")
+        raise HTTPException(403, "Daily token quota exceeded for this API key")
+    M_TOKENS_RESERVED.inc(tenant, amount=cost)
+    return TokenGrant(ident, rps, burst, quota_key, cost, estimate, heuristic)
+
+async def _heuristic_count(text: str) -> int:
+    if len(text) > TOKEN_OFFLOAD_CHARS:
+        return await asyncio.to_thread(heuristic_tokens, text)
+    return heuristic_tokens(text)
+
+async def settle_tokens(grant: TokenGrant, tenant: str, model: str, usage: dict, text: str | None):
+    # text is None when nothing was generated upstream for this request (cache hit, failure).
+    # The prompt is never counted again here: calibration reuses the admission-time count.
+    actual = 0
+    if text is not None:
+        prompt_n = usage.get("prompt_tokens") or 0
+        completion_n = usage.get("completion_tokens") or 0
+        if prompt_n and grant.prompt is None:
+            M_TOKEN_ESTIMATE.observe(model, value=prompt_n / max(1, grant.prompt_estimate))
+            ESTIMATOR.observe(model, grant.prompt_heuristic, prompt_n)
+        if not prompt_n:
+            prompt_n = grant.prompt_estimate if grant.prompt is None else await _heuristic_count(grant.prompt)
+        if not completion_n and text:
+            completion_n = await _heuristic_count(text)
+        actual = prompt_n + completion_n
+        TOKEN_METER.add(tenant, actual)
+        M_TOKENS_CHARGED.inc(tenant, amount=actual)
+    if grant.ident is not None and actual != grant.reserved:
+        await LIMITER.adjust(grant.ident, grant.rps, grant.burst, grant.quota_key, actual - grant.reserved)
 
 # ---------- Metrics & logs ----------
-METRICS = {
-    "requests_total": 0,
-    "errors_total": 0,
-    "latency_sum_ms": 0.0,
-    "latency_count": 0,
-    "endpoint_requests": defaultdict(int),
-    "endpoint_errors": defaultdict(int),
-}
-
-def record_metrics(path: str, start_ts: float, ok: bool):
-    METRICS["requests_total"] += 1
-    METRICS["endpoint_requests"][path] += 1
-    if not ok:
-        METRICS["errors_total"] += 1
-        METRICS["endpoint_errors"][path] += 1
-    METRICS["latency_sum_ms"] += (time.time() - start_ts) * 1000.0
-    METRICS["latency_count"] += 1
+M_REQUESTS = REGISTRY.counter("requests_total", "HTTP requests handled")
+M_ERRORS = REGISTRY.counter("errors_total", "HTTP requests answered with status >= 400")
+M_ENDPOINT_REQUESTS = REGISTRY.counter("endpoint_requests", "HTTP requests per route", ("path",))
+M_ENDPOINT_ERRORS = REGISTRY.counter("endpoint_errors", "HTTP errors per route", ("path",))
+M_LATENCY = REGISTRY.histogram("gateway_request_duration_seconds", "End-to-end request latency",
+                               ("path", "tenant", "provider", "model", "status"),
+                               quantiles="gateway_request_duration_quantile_seconds")
+M_OVERHEAD = REGISTRY.histogram("gateway_overhead_duration_seconds", "Request latency minus time spent waiting on the upstream",
+                                ("path", "tenant"), quantiles="gateway_overhead_duration_quantile_seconds")
+M_UPSTREAM = REGISTRY.histogram("gateway_upstream_duration_seconds", "Upstream provider call latency",
+                                ("provider", "model", "status"), quantiles="gateway_upstream_duration_quantile_seconds")
+M_INFLIGHT = REGISTRY.gauge("gateway_requests_in_flight", "Requests currently being handled", ("path",))
+M_RATE_LIMITED = REGISTRY.counter("gateway_rate_limited_total", "Requests rejected by the token bucket (429)", ("tenant",))
+M_QUOTA_REJECTED = REGISTRY.counter("gateway_quota_rejected_total", "Requests rejected by the daily quota (403)", ("tenant",))
+M_TOKENS = REGISTRY.counter("gateway_tokens_total", "Tokens reported by the upstream provider",
+                            ("tenant", "provider", "model", "kind"))
+M_TOKENS_RESERVED = REGISTRY.counter("gateway_tokens_reserved_total", "Tokens reserved by token admission before the upstream call", ("tenant",))
+M_TOKENS_CHARGED = REGISTRY.counter("gateway_tokens_charged_total", "Tokens charged after reconciliation with provider usage", ("tenant",))
+M_TOKEN_REJECTED = REGISTRY.counter("gateway_token_rejected_total", "Requests rejected by token budgets", ("tenant", "reason"))
+M_TOKEN_ESTIMATE = REGISTRY.histogram("gateway_token_estimate_ratio", "Provider-reported prompt tokens / pre-admission estimate",
+                                      ("model",), buckets=(0.5, 0.67, 0.8, 0.9, 0.95, 1.0, 1.05, 1.1, 1.25, 1.5, 2.0))
+
+def _tenant_label(cfg: TenantConfig, key: str | None) -> str:
+    if cfg.multi_tenant:
+        return cfg.keys.get(key or "", {}).get("tenant", "unknown")
+    return "default"
+
+def _route_label(request: Request) -> str:
+    # route template keeps label cardinality bounded (404 scans all map to one value)
+    return request.url.path if "endpoint" in request.scope else "unmatched"
+
+def record_metrics(request: Request, path: str, tenant: str, start_ts: float, status: int):
+    elapsed = time.perf_counter() - start_ts
+    st = request.state
+    M_REQUESTS.inc()
+    M_ENDPOINT_REQUESTS.inc(path)
+    if status >= 400:
+        M_ERRORS.inc()
+        M_ENDPOINT_ERRORS.inc(path)
+    M_LATENCY.observe(path, tenant, getattr(st, "provider", ""), getattr(st, "model", ""), str(status), value=elapsed)
+    M_OVERHEAD.observe(path, tenant, value=max(0.0, elapsed - getattr(st, "upstream_s", 0.0)))
+
+def record_usage(tenant: str, provider: str, model: str, usage: dict):
+    for kind in ("prompt_tokens", "completion_tokens"):
+        n = usage.get(kind)
+        if n:
+            M_TOKENS.inc(tenant, provider, model, kind[:-7], amount=float(n))
+
+@REGISTRY.collector
+def _pool_and_cache_metrics():
+    fams = []
+    pools = POOLS.stats()
+    for k in ("in_use", "idle", "open", "max", "waits", "pool_timeouts", "requests"):
+        cumulative = k in ("waits", "pool_timeouts", "requests")
+        fam = (Counter if cumulative else Gauge)(f"upstream_pool_{k}" + ("_total" if cumulative else ""),
+                                                 f"Upstream connection pool {k.replace('_', ' ')}", ("provider",))
+        for name, st in pools.items():
+            fam.inc(name, amount=st[k])
+        fams.append(fam)
+    lim = Gauge("gateway_limiter_state", "Rate limiter backend state", ("backend", "field"))
+    for k, v in LIMITER.stats().items():
+        lim.set(LIMITER.name, k, value=v)
+    fams.append(lim)
+    for k, v in ACCESS_LOG.stats().items():
+        cumulative = k != "queued"
+        fam = (Counter if cumulative else Gauge)(f"access_log_{k}" + ("_total" if cumulative else ""),
+                                                 f"Access log records {k.replace('_', ' ')}")
+        fam.inc(amount=v)
+        fams.append(fam)
+    rst = ROUTER.stats()
+    up = Gauge("router_backend_up", "1 when the backend's circuit breaker is closed", ("backend", "state"))
+    lat = Gauge("router_backend_latency_ewma_seconds", "Smoothed upstream latency per backend", ("backend",))
+    err = Gauge("router_backend_error_rate", "Smoothed upstream error rate per backend", ("backend",))
+    for name, h in rst.items():
+        up.set(name, h["state"], value=1 if h["state"] == "closed" else 0)
+        lat.set(name, value=h["ewma_ms"] / 1000.0)
+        err.set(name, value=h["error_rate"])
+    fams += [up, lat, err]
+    tps = Gauge("gateway_tenant_tokens_per_second", f"Tokens per second per tenant, decayed over {TOKEN_METER.tau:g}s", ("tenant",))
+    for tenant, rate in TOKEN_METER.rates().items():
+        tps.set(tenant, value=rate)
+    ratio = Gauge("gateway_token_estimator_ratio", "Learned actual/heuristic prompt token ratio per model", ("model",))
+    for model, r in ESTIMATOR.ratio.items():
+        ratio.set(model, value=r)
+    fams += [tps, ratio]
+    tst = TENANTS.stats()
+    reloads = Counter("gateway_config_reloads_total", "API_KEYS_FILE reloads by source and result", ("source", "result"))
+    for (source, result), n in TENANTS.reloads.items():
+        reloads.inc(source, result, amount=n)
+    version = Gauge("gateway_config_version", "Version of the tenant config in use (bumped on every applied change)")
+    version.set(value=tst["version"])
+    keys = Gauge("gateway_config_tenant_keys", "API keys in the tenant config in use")
+    keys.set(value=tst["keys"])
+    loaded = Gauge("gateway_config_loaded_timestamp_seconds", "When the tenant config in use was loaded")
+    loaded.set(value=tst["loaded_at"])
+    fams += [reloads, version, keys, loaded]
+    if TRACE_TAIL:
+        trs = TRACE_TAIL.stats()
+        traces = Counter("gateway_traces_sampled_total", "Traces by sampling decision (head, or kept/dropped at the tail)", ("decision",))
+        for k in ("head", "error", "slow", "dropped", "evicted"):
+            traces.inc(k, amount=trs[k])
+        buffered = Gauge("gateway_traces_buffered", "Traces waiting for their root span before the tail decision")
+        buffered.set(value=trs["buffered"])
+        fams += [traces, buffered]
+    cst = CACHE.stats()
+    if cst:
+        for k in ("hits", "misses", "coalesced", "evictions", "expired", "entries", "bytes", "inflight"):
+            cumulative = k not in ("entries", "bytes", "inflight")
+            fam = (Counter if cumulative else Gauge)(f"cache_{k}" + ("_total" if cumulative else ""),
+                                                     f"Completion cache {k}", ("backend",))
+            fam.inc(cst["backend"], amount=cst[k])
+            fams.append(fam)
+    return fams
+
+INFLIGHT_PATHS = frozenset(("/llm/complete", "/metrics", "/healthz", "/"))
+OPEN_PATHS = frozenset(("/healthz", "/metrics", "/admin/reload"))   # no X-API-KEY (reload has its own token)
 
 @app.middleware("http")
 async def guard_and_trace(request: Request, call_next):
     req_id = request.headers.get("X-Request-ID") or str(uuid.uuid4())
     api_key = request.headers.get("X-API-KEY", "")
+    cfg = request.state.tenants = TENANTS.current   # one snapshot for the whole request
 
     # Multi-tenant auth
-    if MULTI_TENANT:
-        if request.url.path not in ("/healthz", "/metrics"):
-            if api_key not in TENANT_KEYS:
+    if cfg.multi_tenant:
+        if request.url.path not in OPEN_PATHS:
+            if api_key not in cfg.keys:
                 return JSONResponse({"detail":"Invalid or missing X-API-KEY"}, status_code=401)
     else:
-        if env("BACKEND_API_KEY") and request.url.path not in ("/healthz", "/metrics"):
+        if env("BACKEND_API_KEY") and request.url.path not in OPEN_PATHS:
             if api_key != env("BACKEND_API_KEY"):
                 return JSONResponse({"detail":"Invalid or missing X-API-KEY"}, status_code=401)
 
     # rate+quota
-    start = time.time()
+    start = time.perf_counter()
     ok = True
     status = 500
+    tenant = _tenant_label(cfg, api_key)
+    M_INFLIGHT.inc(request.url.path if request.url.path in INFLIGHT_PATHS else "other")
     try:
-        rate_limit_and_quota(request, api_key if api_key else None)
-        # tracing span
+        await rate_limit_and_quota(request, api_key if api_key else None, cfg, tenant)
+        # tracing span; attributes go in at start so the sampler can pick the tenant's ratio
         if tracer:
-            with tracer.start_as_current_span("http.request") as span:
-                span.set_attribute("http.target", str(request.url.path))
-                span.set_attribute("http.method", request.method)
-                if MULTI_TENANT:
-                    span.set_attribute("tenant", TENANT_KEYS.get(api_key,{}).get("tenant","unknown"))
+            with tracer.start_as_current_span("http.request", attributes={
+                    "http.target": request.url.path, "http.method": request.method, "tenant": tenant}) as span:
                 response = await call_next(request)
+                span.set_attribute("http.status_code", response.status_code)
         else:
             response = await call_next(request)
         status = response.status_code
@@ -178,7 +377,8 @@ async def guard_and_trace(request: Request, call_next):
         ok = False
         response = JSONResponse({"detail": "Internal Server Error"}, status_code=500)
     finally:
-        record_metrics(str(request.url.path), start, ok)
+        M_INFLIGHT.dec(request.url.path if request.url.path in INFLIGHT_PATHS else "other")
+        record_metrics(request, _route_label(request), tenant, start, status)
         log = {
             "ts": time.time(),
             "request_id": req_id,
@@ -186,10 +386,13 @@ async def guard_and_trace(request: Request, call_next):
             "status": status,
             "ok": ok,
             "client": request.client.host if request.client else None,
+            "duration_ms": round((time.perf_counter() - start) * 1000.0, 3),
         }
-        if MULTI_TENANT and api_key in TENANT_KEYS:
-            log["tenant"] = TENANT_KEYS[api_key]["tenant"]
-        print(json.dumps(log, ensure_ascii=False))
+        if cfg.multi_tenant and api_key in cfg.keys:
+            log["tenant"] = cfg.keys[api_key]["tenant"]
+        if cfg.version:
+            log["config_version"] = cfg.version
+        ACCESS_LOG.emit(log)
         if hasattr(response, "headers"):
             response.headers["X-Request-ID"] = req_id
         return response
@@ -200,120 +403,455 @@ class CompleteIn(BaseModel):
     model: t.Optional[str] = None
     temperature: t.Optional[float] = 0.2
     max_tokens: t.Optional[int] = 512
+    stream: t.Optional[bool] = False
 
 class CompleteOut(BaseModel):
     provider: str
     model: str
     text: str
-
-def get_provider() -> str:
-    return env("LLM_PROVIDER", "local_stub").lower()
+    backend: t.Optional[str] = None
 
 def get_model(override: t.Optional[str]) -> str:
     return override or env("LLM_MODEL", "gpt-4o-mini")
 
 @app.get("/healthz")
 async def healthz():
-    return {"ok": True, "multi_tenant": MULTI_TENANT}
+    cfg = TENANTS.current
+    return {"ok": True, "multi_tenant": cfg.multi_tenant, "config_version": cfg.version}
 
 @app.get("/metrics", response_class=PlainTextResponse)
 async def metrics():
-    lines = []
-    lines.append(f"requests_total {METRICS['requests_total']}")
-    lines.append(f"errors_total {METRICS['errors_total']}")
-    avg = 0.0
-    if METRICS['latency_count'] > 0:
-        avg = METRICS['latency_sum_ms'] / METRICS['latency_count']
-    lines.append(f"latency_avg_ms {avg:.2f}")
-    for path,count in METRICS['endpoint_requests'].items():
-        lines.append(f'endpoint_requests{{path="{path}"}} {count}')
-    for path,count in METRICS['endpoint_errors'].items():
-        lines.append(f'endpoint_errors{{path="{path}"}} {count}')
-    return "\n".join(lines) + "\n"
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request):
+    # re-read API_KEYS_FILE now instead of waiting for the watcher; only this worker reloads,
+    # the others pick the file up on their next poll
+    if not ADMIN_TOKEN:
+        raise HTTPException(404, "Not Found")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(401, "Invalid or missing X-Admin-Token")
+    if not TENANTS.path:
+        raise HTTPException(400, "API_KEYS_FILE is not set")
+    res = await TENANTS.reload("admin")
+    return JSONResponse(res, status_code=200 if res["ok"] else 422)
 
 # ---------- Core LLM proxy ----------
+def _cache_scope(request: Request) -> t.Optional[str]:
+    # None -> this caller has not opted into the completion cache
+    tenants = _config(request)
+    if not tenants.multi_tenant:
+        return "global"
+    cfg = tenants.keys.get(request.headers.get("X-API-KEY", ""))
+    if not cfg:
+        return None
+    opt = str(cfg.get("cache", "false")).strip().lower()
+    if opt == "shared":
+        return "shared"
+    if opt in ("1", "true", "yes", "on"):
+        return f"tenant:{cfg['tenant']}"
+    return None
+
 @app.post("/llm/complete", response_model=CompleteOut)
-async def llm_complete(body: CompleteIn, request: Request):
-    provider = get_provider()
+async def llm_complete(body: CompleteIn, request: Request, response: Response):
     model = get_model(body.model)
     prompt = body.prompt.strip()
     if not prompt:
         raise HTTPException(status_code=400, detail="Empty prompt")
 
-    if tracer:
-        with tracer.start_as_current_span("llm.complete") as span:
-            span.set_attribute("provider", provider)
-            span.set_attribute("model", model)
-            text = await _call_provider(provider, model, prompt, body.temperature, body.max_tokens)
-    else:
-        text = await _call_provider(provider, model, prompt, body.temperature, body.max_tokens)
+    api_key = request.headers.get("X-API-KEY")
+    cfg = _config(request)
+    tenant = _tenant_label(cfg, api_key)
+    weight = cfg.keys.get(api_key or "", {}).get("weight", 1.0)
+    route = ROUTER.match(tenant, model)
+    # metrics provider label: the backend that answered, "cache" (hit / coalesced follower)
+    # or "none" (nothing answered), never the route name
+    request.state.provider = "none"
+    request.state.model = model
+    grant = await reserve_tokens(request, api_key, tenant, model, prompt, body.max_tokens or 0)
+    started = time.perf_counter()
+    if body.stream:
+        try:
+            return await _stream_response(route, model, prompt, body, tenant, weight, request, grant)
+        finally:
+            request.state.upstream_s = time.perf_counter() - started
+
+    usage: dict = {}
+    served: list[Backend] = []
+
+    async def call():
+        text, b = await ROUTER.execute(route, lambda b: _call_provider(
+            b, _upstream_model(b, model), prompt, body.temperature, body.max_tokens, usage, tenant, weight))
+        served.append(b)
+        return text
+
+    scope = _cache_scope(request) if CACHE.cacheable(body.temperature) else None
+    if scope:
+        key = cache_key(scope, route.name, model, prompt, body.temperature, body.max_tokens)
+        upstream = call
+        call = lambda: CACHE.get_or_call(key, upstream)
 
-    return CompleteOut(provider=provider, model=model, text=text)
+    try:
+        if tracer:
+            with tracer.start_as_current_span("llm.complete") as span:
+                span.set_attribute("route", route.name)
+                span.set_attribute("model", model)
+                res = await call()
+                if scope:
+                    span.set_attribute("cache", res[1])
+                if served:
+                    span.set_attribute("provider", served[0].name)
+        else:
+            res = await call()
+    except BaseException:
+        await settle_tokens(grant, tenant, model, usage, None)
+        raise
+    finally:
+        request.state.upstream_s = time.perf_counter() - started
 
-async def _call_provider(provider: str, model: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    if scope:
+        text, outcome = res
+        response.headers["X-Cache"] = outcome
+    else:
+        text = res
+    # cache hits and coalesced followers did not call upstream themselves
+    backend = served[0] if served else None
+    await settle_tokens(grant, tenant, model, usage, text if backend else None)
+    request.state.provider = backend.name if backend else "cache"
+    if backend:
+        record_usage(tenant, backend.name, model, usage)
+        response.headers["X-Backend"] = backend.name
+    provider = backend.provider if backend else ROUTER.backends[route.backends[0]].provider
+    return CompleteOut(provider=provider, model=model, text=text, backend=backend.name if backend else None)
+
+def _upstream_model(b: Backend, model: str) -> str:
+    return b.model or model
+
+def _provider_base(b: Backend) -> str:
+    if b.endpoint:
+        return b.endpoint
+    return {"openai": "https://api.openai.com/v1", "vllm": "http://127.0.0.1:8000/v1",
+            "ollama": "http://localhost:11434"}.get(b.provider, "")
+
+def _build_request(b: Backend, model: str, prompt: str, temperature: float, max_tokens: int, stream: bool = False):
+    # -> (url, headers, payload) for the upstream chat/generate call
+    provider = b.provider
     if provider == "openai":
-        endpoint = env("LLM_ENDPOINT", "https://api.openai.com/v1").rstrip("/")
-        api_key = env("LLM_API_KEY")
+        endpoint = _provider_base(b)
+        api_key = b.api_key
         if not api_key:
-            raise HTTPException(400, "Missing LLM_API_KEY for OpenAI")
+            raise HTTPException(400, f"Missing API key for OpenAI backend {b.name}")
         url = f"{endpoint}/chat/completions"
         headers = {"Authorization": f"Bearer {api_key}"}
         payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "temperature": temperature, "max_tokens": max_tokens}
-        async with httpx.AsyncClient(timeout=60) as client:
-            r = await client.post(url, headers=headers, json=payload)
-        if r.status_code >= 400:
-            raise HTTPException(r.status_code, r.text)
-        data = r.json()
-        return data["choices"][0]["message"]["content"]
 
     elif provider == "azure":
-        base = env("LLM_ENDPOINT").rstrip("/")
-        api_key = env("LLM_API_KEY")
-        deploy = env("AZURE_DEPLOYMENT")
-        api_version = env("AZURE_API_VERSION", "2024-02-15-preview")
+        base = _provider_base(b)
+        api_key = b.api_key
+        deploy = b.deployment
+        api_version = b.api_version or "2024-02-15-preview"
         if not (base and api_key and deploy):
-            raise HTTPException(400, "Missing one of LLM_ENDPOINT, LLM_API_KEY, AZURE_DEPLOYMENT")
+            raise HTTPException(400, f"Missing endpoint, API key or deployment for Azure backend {b.name}")
         url = f"{base}/openai/deployments/{deploy}/chat/completions?api-version={api_version}"
         headers = {"api-key": api_key}
         payload = {"messages": [{"role": "user", "content": prompt}], "temperature": temperature, "max_tokens": max_tokens}
-        async with httpx.AsyncClient(timeout=60) as client:
-            r = await client.post(url, headers=headers, json=payload)
-        if r.status_code >= 400:
-            raise HTTPException(r.status_code, r.text)
-        data = r.json()
-        return data["choices"][0]["message"]["content"]
 
     elif provider == "vllm":
-        endpoint = env("LLM_ENDPOINT", "http://127.0.0.1:8000/v1").rstrip("/")
-        api_key = env("LLM_API_KEY", "")
+        endpoint = _provider_base(b)
+        api_key = b.api_key
         url = f"{endpoint}/chat/completions"
         headers = {}
         if api_key:
             headers["Authorization"] = f"Bearer {api_key}"
         payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "temperature": temperature, "max_tokens": max_tokens}
-        async with httpx.AsyncClient(timeout=60) as client:
-            r = await client.post(url, headers=headers, json=payload)
-        if r.status_code >= 400:
-            raise HTTPException(r.status_code, r.text)
-        data = r.json()
-        return data["choices"][0]["message"]["content"]
 
     elif provider == "ollama":
-        base = env("LLM_ENDPOINT", "http://localhost:11434").rstrip("/")
+        base = _provider_base(b)
         url = f"{base}/api/generate"
-        payload = {"model": model, "prompt": prompt, "stream": False}
-        async with httpx.AsyncClient(timeout=180) as client:
-            r = await client.post(url, json=payload)
+        headers = {}
+        payload = {"model": model, "prompt": prompt, "stream": stream}
+        return url, headers, payload
+
+    else:
+        raise HTTPException(400, f"Unsupported provider: {provider}")
+
+    if stream:
+        payload["stream"] = True
+        if provider in ("openai", "vllm"):
+            payload["stream_options"] = {"include_usage": True}
+    return url, headers, payload
+
+def _usage_from(provider: str, data: dict) -> dict:
+    if provider == "ollama":
+        return {"prompt_tokens": data.get("prompt_eval_count") or 0, "completion_tokens": data.get("eval_count") or 0}
+    u = data.get("usage") or {}
+    return {"prompt_tokens": u.get("prompt_tokens") or 0, "completion_tokens": u.get("completion_tokens") or 0}
+
+def _upstream_span(b: Backend, model: str, url: str, **attrs):
+    # client span around one upstream HTTP call; None when tracing is off or the trace is not recorded
+    if not tracer:
+        return None
+    from opentelemetry.trace import SpanKind
+    span = tracer.start_span("upstream.http", kind=SpanKind.CLIENT, attributes={
+        "http.method": "POST", "http.url": url, "upstream.backend": b.name, "upstream.provider": b.provider,
+        "llm.model": model, **attrs})
+    return span if span.is_recording() else None
+
+def _end_upstream_span(span, r: httpx.Response | None, queued: float, sent: float | None, ttfb: float | None,
+                       error: BaseException | None = None, **attrs):
+    # queued/sent/ttfb are perf_counter() stamps: slot+connection wait, request written, response headers
+    if sent is not None:
+        span.set_attribute("upstream.queue_ms", (sent - queued) * 1000.0)
+        if ttfb is not None:
+            span.set_attribute("upstream.ttfb_ms", (ttfb - sent) * 1000.0)
+    if r is not None:
+        span.set_attribute("http.status_code", r.status_code)
+        span.set_attribute("http.request_content_length", int(r.request.headers.get("content-length") or 0))
+        span.set_attribute("http.response_content_length", r.num_bytes_downloaded)
+    for k, v in attrs.items():
+        span.set_attribute(k, v)
+    if error is not None and not isinstance(error, (HTTPException, GeneratorExit, asyncio.CancelledError)):
+        from opentelemetry.trace import StatusCode
+        span.record_exception(error)
+        span.set_status(StatusCode.ERROR, f"{type(error).__name__}: {error}")
+    span.end()
+
+VLLM_NO_TOKENIZE: set[str] = set()   # vLLM backends without /tokenize: their calls are not batched
+
+async def _vllm_chat_ids(b: Backend, model: str, prompt: str) -> list[int] | None:
+    # the prompt with the model's chat template applied, as token ids, from vLLM's own /tokenize,
+    # so a batched /completions call sees exactly what /chat/completions would have
+    base = _provider_base(b)
+    url = (base[:-3] if base.endswith("/v1") else base) + "/tokenize"   # served next to /v1, not under it
+    headers = {"Authorization": f"Bearer {b.api_key}"} if b.api_key else {}
+    payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "add_generation_prompt": True}
+    async with POOLS.acquire(b.name, b.provider) as client:
+        r = await client.post(url, headers=headers, json=payload)
+    if r.status_code in (404, 405):
+        VLLM_NO_TOKENIZE.add(b.name)
+        log.warning("vLLM backend %s has no /tokenize; micro-batching disabled for it", b.name)
+        return None
+    if r.status_code >= 400:
+        raise HTTPException(r.status_code, r.text)
+    return r.json()["tokens"]
+
+def _batch_texts(data: dict, n: int) -> list[str]:
+    # /completions choices come back tagged with the index of their prompt, in any order
+    texts: list[str | None] = [None] * n
+    for i, choice in enumerate(data.get("choices") or ()):
+        idx = choice.get("index", i)
+        if 0 <= idx < n:
+            texts[idx] = choice.get("text", "")
+    missing = [i for i, text in enumerate(texts) if text is None]
+    if missing:
+        raise HTTPException(502, f"Upstream batch reply has no choice for prompts {missing}")
+    return texts
+
+def _vllm_batch_sender(b: Backend):
+    async def send(model: str, temperature: float, max_tokens: int, prompts: list[list[int]]) -> tuple[list[str], dict]:
+        # one /completions call for several templated prompts (token ids)
+        headers = {"Authorization": f"Bearer {b.api_key}"} if b.api_key else {}
+        payload = {"model": model, "prompt": prompts, "temperature": temperature, "max_tokens": max_tokens}
+        url = f"{_provider_base(b)}/completions"
+        span = _upstream_span(b, model, url, **{"batch.size": len(prompts)})
+        started = time.perf_counter()
+        status = "error"
+        r = sent = ttfb = err = None
+        try:
+            async with POOLS.acquire(b.name, b.provider) as client:
+                sent = time.perf_counter()
+                async with client.stream("POST", url, headers=headers, json=payload) as r:
+                    ttfb = time.perf_counter()
+                    await r.aread()
+            status = str(r.status_code)
+        except BaseException as e:
+            err = e
+            raise
+        finally:
+            M_UPSTREAM.observe(b.name, model, status, value=time.perf_counter() - started)
+            if span:
+                _end_upstream_span(span, r, started, sent, ttfb, err)
         if r.status_code >= 400:
             raise HTTPException(r.status_code, r.text)
         data = r.json()
-        return data.get("response", "")
-
-    elif provider == "local_stub":
+        return _batch_texts(data, len(prompts)), _usage_from("vllm", data)
+    return send
+
+async def _call_provider(b: Backend, model: str, prompt: str, temperature: float, max_tokens: int,
+                         usage: dict | None = None, tenant: str = "default", weight: float = 1.0) -> str:
+    # `usage`, when given, is filled with the token counts the provider reports
+    provider = b.provider
+    if provider == "local_stub":
         return f"[STUB REPLY] {prompt[:80]}..."
+    url, headers, payload = _build_request(b, model, prompt, temperature, max_tokens)
+    dispatcher = DISPATCH.get(b.name)
+    batcher = DISPATCH.batcher(b.name, _vllm_batch_sender(b)) if provider == "vllm" else None
+    if batcher and b.name not in VLLM_NO_TOKENIZE:
+        ids: list[int] = []
+
+        async def templated():
+            # /tokenize runs inside this prompt's dispatcher slot, throttled like any upstream call
+            got = await _vllm_chat_ids(b, model, prompt)
+            ids.extend(got or ())
+            return got
+        res = await batcher.submit(dispatcher, tenant, weight, model, temperature, max_tokens, prepare=templated)
+        if res is not None:
+            text, batch_usage = res
+            if usage is not None:
+                # prompt tokens are exact per prompt; completion tokens are only known for the whole batch
+                usage.update(batch_usage, prompt_tokens=len(ids))
+            return text
+    span = _upstream_span(b, model, url)
+    started = time.perf_counter()
+    status = "error"
+    r = sent = ttfb = err = None
+    try:
+        async with dispatcher.slot(tenant, weight), POOLS.acquire(b.name, provider) as client:
+            sent = time.perf_counter()
+            async with client.stream("POST", url, headers=headers, json=payload) as r:
+                ttfb = time.perf_counter()
+                await r.aread()
+        status = str(r.status_code)
+    except BaseException as e:
+        err = e
+        raise
+    finally:
+        M_UPSTREAM.observe(b.name, model, status, value=time.perf_counter() - started)
+        if span:
+            _end_upstream_span(span, r, started, sent, ttfb, err)
+    if r.status_code >= 400:
+        raise HTTPException(r.status_code, r.text)
+    data = r.json()
+    if usage is not None:
+        usage.update(_usage_from(provider, data))
+    if provider == "ollama":
+        return data.get("response", "")
+    return data["choices"][0]["message"]["content"]
+
+async def _stream_provider(b: Backend, model: str, prompt: str, temperature: float, max_tokens: int,
+                           usage: dict | None = None, tenant: str = "default", weight: float = 1.0) -> t.AsyncIterator[str]:
+    # yields text deltas as they arrive: SSE for openai/azure/vllm, NDJSON for ollama
+    provider = b.provider
+    if provider == "local_stub":
+        for word in f"[STUB REPLY] {prompt[:80]}...".split(" "):
+            yield word + " "
+        return
+    url, headers, payload = _build_request(b, model, prompt, temperature, max_tokens, stream=True)
+    # started explicitly, not as the current span: the generator resumes in the response task's context
+    span = _upstream_span(b, model, url, stream=True)
+    started = time.perf_counter()
+    status = "error"
+    r = sent = ttfb = first = err = None
+    chunks = 0
+    try:
+        async with DISPATCH.get(b.name).slot(tenant, weight), POOLS.acquire(b.name, provider) as client:
+            sent = time.perf_counter()
+            async with client.stream("POST", url, headers=headers, json=payload) as r:
+                ttfb = time.perf_counter()
+                status = str(r.status_code)
+                if r.status_code >= 400:
+                    raise HTTPException(r.status_code, (await r.aread()).decode("utf-8", "replace"))
+                async for line in r.aiter_lines():
+                    if not line:
+                        continue
+                    chunks += 1
+                    if first is None:
+                        first = time.perf_counter()
+                    if provider == "ollama":
+                        data = json.loads(line)
+                        if data.get("response"):
+                            yield data["response"]
+                        if data.get("done"):
+                            if usage is not None:
+                                usage.update(_usage_from(provider, data))
+                            return
+                        continue
+                    if not line.startswith("data:"):
+                        continue
+                    chunk = line[5:].strip()
+                    if chunk == "[DONE]":
+                        return
+                    data = json.loads(chunk)
+                    if usage is not None and data.get("usage"):
+                        usage.update(_usage_from(provider, data))
+                    for choice in data.get("choices") or ():
+                        delta = (choice.get("delta") or {}).get("content")
+                        if delta:
+                            yield delta
+    except BaseException as e:
+        err = e
+        raise
+    finally:
+        M_UPSTREAM.observe(b.name, model, status, value=time.perf_counter() - started)
+        if span:
+            extra = {"upstream.chunks": chunks}
+            if first is not None:
+                extra["upstream.first_chunk_ms"] = (first - sent) * 1000.0
+            _end_upstream_span(span, r, started, sent, ttfb, err, **extra)
+
+def _sse(obj) -> bytes:
+    return f"data: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8")
+
+async def _stream_response(route: Route, model: str, prompt: str, body: CompleteIn, tenant: str,
+                           weight: float, request: Request, grant: TokenGrant) -> StreamingResponse:
+    usage: dict = {}
+    span = tracer.start_span("llm.complete") if tracer else None
+    if span:
+        span.set_attribute("route", route.name)
+        span.set_attribute("model", model)
+        span.set_attribute("stream", True)
+    started = time.time()
+
+    async def open_stream(b: Backend):
+        # pull the first delta before answering so upstream errors keep their HTTP status
+        # and the router can still fail over to another backend
+        gen = _stream_provider(b, _upstream_model(b, model), prompt, body.temperature, body.max_tokens, usage, tenant, weight)
+        try:
+            return gen, await gen.__anext__()
+        except StopAsyncIteration:
+            return gen, None
+        except BaseException:
+            await gen.aclose()
+            raise
 
-    else:
-        raise HTTPException(400, f"Unsupported provider: {provider}")
+    try:
+        (deltas, first), backend = await ROUTER.execute(route, open_stream, hedge=False)
+    except BaseException as e:
+        await settle_tokens(grant, tenant, model, usage, None)
+        if span:
+            span.record_exception(e)
+            span.end()
+        raise
+    request.state.provider = backend.name
+    if span:
+        span.set_attribute("provider", backend.name)
+        span.set_attribute("ttft_ms", (time.time() - started) * 1000.0)
+
+    async def events():
+        parts: list[str] = []
+        try:
+            yield _sse({"provider": backend.provider, "model": model, "backend": backend.name})
+            if first is not None:
+                parts.append(first)
+                yield _sse({"text": first})
+                async for delta in deltas:
+                    parts.append(delta)
+                    yield _sse({"text": delta})
+            yield b"data: [DONE]\n\n"
+        except HTTPException as e:
+            yield _sse({"error": e.detail, "status": e.status_code})
+        except (httpx.HTTPError, ValueError) as e:
+            yield _sse({"error": f"upstream stream failed: {e!r}"})
+        finally:
+            await deltas.aclose()
+            record_usage(tenant, backend.name, model, usage)
+            await settle_tokens(grant, tenant, model, usage, "".join(parts))
+            if span:
+                span.set_attribute("chunks", len(parts))
+                span.end()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Backend": backend.name})
 
 # ---------- Simple UI kept minimal ----------
 HTML = """<!doctype html><html dir="rtl" lang="ar"><head>
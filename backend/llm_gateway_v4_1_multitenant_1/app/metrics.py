@@ -0,0 +1,157 @@
+import bisect, math, typing as t
+
+# ---------- Prometheus instrumentation ----------
+# Minimal, allocation-light registry: a metric family keeps one slot per label
+# tuple, so the hot path is a dict lookup plus an add. Rendered in the text
+# exposition format (version 0.0.4) by REGISTRY.render().
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+class _Family:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values: dict[tuple, t.Any] = {}
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Family):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def render(self) -> list[str]:
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in self._values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value: float):
+        slot = self._values.get(labels)
+        if slot is None:
+            # [per-bucket counts (non-cumulative, last = +Inf), sum, count]
+            slot = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        slot[0][bisect.bisect_left(self.buckets, value)] += 1
+        slot[1] += value
+        slot[2] += 1
+
+    def quantile(self, q: float, *labels) -> float:
+        # linear interpolation inside the bucket, same as PromQL histogram_quantile
+        slot = self._values.get(labels)
+        if not slot or not slot[2]:
+            return math.nan
+        rank = q * slot[2]
+        seen = 0
+        for i, n in enumerate(slot[0]):
+            if seen + n >= rank and n:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                if i >= len(self.buckets):
+                    return lo
+                return lo + (self.buckets[i] - lo) * ((rank - seen) / n)
+            seen += n
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        out = self.header()
+        for k, (counts, total, n) in self._values.items():
+            acc = 0
+            for b, c in zip(self.buckets + (math.inf,), counts):
+                acc += c
+                le = 'le="%s"' % _num(b)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {n}")
+        return out
+
+    def render_quantiles(self, name: str) -> list[str]:
+        # p50/p95/p99 estimated from the buckets, for dashboards without PromQL
+        out = [f"# HELP {name} Estimated quantiles of {self.name}", f"# TYPE {name} gauge"]
+        for k in self._values:
+            for q in QUANTILES:
+                v = self.quantile(q, *k)
+                if not math.isnan(v):
+                    qs = 'quantile="%s"' % q
+                    out.append(f"{name}{_labels(self.labelnames, k, qs)} {_num(v)}")
+        return out
+
+class Registry:
+    def __init__(self):
+        self._families: list[_Family] = []
+        self._quantiles: list[tuple[Histogram, str]] = []
+        self._collectors: list[t.Callable[[], t.Iterable[_Family]]] = []
+
+    def _add(self, fam):
+        self._families.append(fam)
+        return fam
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS,
+                  quantiles: str = "") -> Histogram:
+        h = self._add(Histogram(name, help, labels, buckets))
+        if quantiles:
+            self._quantiles.append((h, quantiles))
+        return h
+
+    def collector(self, fn: t.Callable[[], t.Iterable[_Family]]):
+        # fn is called at scrape time and returns freshly built families
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for fam in self._families:
+            lines.extend(fam.render())
+        for h, name in self._quantiles:
+            lines.extend(h.render_quantiles(name))
+        for fn in self._collectors:
+            for fam in fn():
+                lines.extend(fam.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
@@ -0,0 +1,142 @@
+import os, re, asyncio, time, typing as t
+from contextlib import asynccontextmanager
+import httpx
+
+# ---------- Upstream connection pools ----------
+# One long-lived httpx.AsyncClient per upstream backend, created at startup and
+# closed at shutdown. Limits/timeouts come from env, with per-backend overrides:
+#   POOL_MAX_CONNECTIONS=100        POOL_OPENAI_MAX_CONNECTIONS=200
+#   POOL_MAX_KEEPALIVE=20           POOL_OLLAMA_READ_TIMEOUT=180
+#   POOL_KEEPALIVE_EXPIRY=30        POOL_HTTP2=1
+#   POOL_CONNECT_TIMEOUT=5  POOL_READ_TIMEOUT=60  POOL_WRITE_TIMEOUT=30  POOL_ACQUIRE_TIMEOUT=10
+
+DEFAULT_READ_TIMEOUT = {"ollama": 180.0}
+
+def _pool_env(name: str, key: str, default: str) -> str:
+    v = os.getenv(f"POOL_{re.sub(r'[^A-Z0-9]', '_', name.upper())}_{key}", "").strip()
+    if v:
+        return v
+    return os.getenv(f"POOL_{key}", default).strip() or default
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+class PoolConfig:
+    __slots__ = ("max_connections", "max_keepalive", "keepalive_expiry", "http2",
+                 "connect_timeout", "read_timeout", "write_timeout", "acquire_timeout")
+
+    def __init__(self, name: str, kind: str = ""):
+        self.max_connections = int(_pool_env(name, "MAX_CONNECTIONS", "100"))
+        self.max_keepalive = int(_pool_env(name, "MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(_pool_env(name, "KEEPALIVE_EXPIRY", "30"))
+        self.http2 = _pool_env(name, "HTTP2", "1") not in ("0", "false", "no") and _http2_available()
+        self.connect_timeout = float(_pool_env(name, "CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(_pool_env(name, "READ_TIMEOUT", str(DEFAULT_READ_TIMEOUT.get(kind or name.lower(), 60.0))))
+        self.write_timeout = float(_pool_env(name, "WRITE_TIMEOUT", "30"))
+        self.acquire_timeout = float(_pool_env(name, "ACQUIRE_TIMEOUT", "10"))
+
+class PoolStats:
+    __slots__ = ("in_use", "waits", "pool_timeouts", "requests")
+
+    def __init__(self):
+        self.in_use = 0
+        self.waits = 0          # requests that started while every connection was busy
+        self.pool_timeouts = 0  # httpx.PoolTimeout raised while waiting for a connection
+        self.requests = 0
+
+class ProviderPools:
+    def __init__(self):
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._configs: dict[str, PoolConfig] = {}
+        self._stats: dict[str, PoolStats] = {}
+        self._closed = False
+
+    def _make(self, name: str, kind: str) -> httpx.AsyncClient:
+        cfg = PoolConfig(name, kind)
+        limits = httpx.Limits(max_connections=cfg.max_connections,
+                              max_keepalive_connections=cfg.max_keepalive,
+                              keepalive_expiry=cfg.keepalive_expiry)
+        timeout = httpx.Timeout(connect=cfg.connect_timeout, read=cfg.read_timeout,
+                                write=cfg.write_timeout, pool=cfg.acquire_timeout)
+        self._configs[name] = cfg
+        self._stats.setdefault(name, PoolStats())
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=cfg.http2)
+
+    def client(self, name: str, kind: str = "") -> httpx.AsyncClient:
+        # name = upstream backend (pool key), kind = its provider type (for defaults)
+        c = self._clients.get(name)
+        if c is None or c.is_closed:
+            if self._closed:
+                raise RuntimeError("connection pools are shut down")
+            c = self._clients[name] = self._make(name, kind)
+        return c
+
+    @asynccontextmanager
+    async def acquire(self, name: str, kind: str = "") -> t.AsyncIterator[httpx.AsyncClient]:
+        client = self.client(name, kind)
+        st = self._stats[name]
+        if st.in_use >= self._configs[name].max_connections:
+            st.waits += 1
+        st.in_use += 1
+        st.requests += 1
+        try:
+            yield client
+        except httpx.PoolTimeout:
+            st.pool_timeouts += 1
+            raise
+        finally:
+            st.in_use -= 1
+
+    async def warmup(self, name: str, url: str, connections: int = 1, kind: str = ""):
+        # open `connections` sockets (TCP+TLS) ahead of the first real request;
+        # any HTTP status is fine, we only care that the handshake happened
+        client = self.client(name, kind)
+        async def _one():
+            try:
+                await client.get(url, timeout=self._configs[name].connect_timeout + 5)
+            except httpx.HTTPError as e:
+                print(f"Pool warm-up for {name} failed: {e!r}")
+        await asyncio.gather(*(_one() for _ in range(max(1, connections))))
+
+    async def aclose(self):
+        self._closed = True
+        clients, self._clients = self._clients, {}
+        await asyncio.gather(*(c.aclose() for c in clients.values()), return_exceptions=True)
+
+    def _connections(self, name: str) -> tuple[int, int]:
+        # (open, idle) read from the httpcore pool behind the client, if reachable
+        c = self._clients.get(name)
+        pool = getattr(getattr(c, "_transport", None), "_pool", None)
+        conns = getattr(pool, "connections", None)
+        if conns is None:
+            return 0, 0
+        idle = 0
+        for conn in list(conns):
+            try:
+                idle += 1 if conn.is_idle() else 0
+            except Exception:
+                pass
+        return len(conns), idle
+
+    def stats(self) -> dict[str, dict]:
+        out = {}
+        for name, st in self._stats.items():
+            open_, idle = self._connections(name)
+            cfg = self._configs.get(name)
+            out[name] = {
+                "in_use": st.in_use,
+                "idle": idle,
+                "open": open_,
+                "max": cfg.max_connections if cfg else 0,
+                "waits": st.waits,
+                "pool_timeouts": st.pool_timeouts,
+                "requests": st.requests,
+                "http2": bool(cfg and cfg.http2),
+            }
+        return out
+
+POOLS = ProviderPools()
@@ -0,0 +1,323 @@
+import os, json, math, time, random, asyncio, contextlib, typing as t
+from collections import deque
+import httpx
+from fastapi import HTTPException
+from .metrics import REGISTRY
+
+# ---------- Multi-backend routing ----------
+# ROUTES_FILE (JSON) lists upstream backends and which of them serve a tenant/model:
+#   {"backends": [{"name": "openai-main", "provider": "openai", "endpoint": "https://api.openai.com/v1",
+#                  "api_key_env": "LLM_API_KEY"},
+#                 {"name": "gpu-1", "provider": "vllm", "endpoint": "http://10.0.0.5:8000/v1", "model": "qwen2.5-7b"}],
+#    "routes":   [{"tenant": "mars", "model": "*", "backends": ["gpu-1", "openai-main"], "hedge": true},
+#                 {"backends": ["openai-main", "gpu-1"], "strategy": "weighted"}]}
+# Without ROUTES_FILE there is one backend built from LLM_PROVIDER/LLM_ENDPOINT/LLM_API_KEY
+# (named after the provider) and one route to it, i.e. the single-provider behaviour.
+#
+# Each backend has a circuit breaker (ROUTER_BREAKER_FAILURES consecutive failures open it for
+# ROUTER_BREAKER_COOLDOWN_S, then one probe is let through) and a passive health score
+# (EWMA latency and error rate). When no candidate's breaker lets a call through the request
+# gets 503 with Retry-After at once instead of waiting on a dead provider.
+# Retryable failures fail over to the next candidate. With
+# "hedge": true a duplicate goes to the second candidate after the first one's observed p95
+# latency (ROUTER_HEDGE_MIN_MS..ROUTER_HEDGE_MAX_MS) and the first answer wins.
+
+RETRYABLE_STATUS = frozenset((408, 409, 425, 429, 500, 502, 503, 504))
+
+M_ATTEMPTS = REGISTRY.counter("router_attempts_total", "Upstream attempts per backend and outcome", ("backend", "outcome"))
+M_FAILOVERS = REGISTRY.counter("router_failovers_total", "Requests that moved to another backend after a failure", ("route",))
+M_HEDGES = REGISTRY.counter("router_hedges_total", "Hedged duplicates sent, by which copy won", ("route", "winner"))
+M_UNAVAILABLE = REGISTRY.counter("router_unavailable_total", "Requests answered 503 because every candidate's breaker was open",
+                                 ("route",))
+
+def retryable(e: BaseException) -> bool:
+    if isinstance(e, HTTPException):
+        return e.status_code in RETRYABLE_STATUS
+    return isinstance(e, (httpx.TransportError, asyncio.TimeoutError))
+
+def _fenv(name: str, default: str) -> float:
+    return float(os.getenv(name, default) or default)
+
+class Backend:
+    __slots__ = ("name", "provider", "endpoint", "api_key", "deployment", "api_version", "model", "weight")
+
+    def __init__(self, name: str, provider: str, endpoint: str = "", api_key: str = "", deployment: str = "",
+                 api_version: str = "", model: str = "", weight: float = 1.0):
+        self.name = name
+        self.provider = provider.lower()
+        self.endpoint = endpoint.rstrip("/")
+        self.api_key = api_key
+        self.deployment = deployment
+        self.api_version = api_version
+        self.model = model          # upstream model name override; "" = use the requested model
+        self.weight = weight
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Backend":
+        api_key = d.get("api_key") or (os.getenv(d["api_key_env"], "") if d.get("api_key_env") else "")
+        return cls(d["name"], d["provider"], d.get("endpoint", ""), api_key, d.get("deployment", ""),
+                   d.get("api_version", ""), d.get("model", ""), float(d.get("weight", 1)))
+
+    @classmethod
+    def from_env(cls) -> "Backend":
+        provider = os.getenv("LLM_PROVIDER", "local_stub").lower()
+        return cls(provider, provider, os.getenv("LLM_ENDPOINT", ""), os.getenv("LLM_API_KEY", ""),
+                   os.getenv("AZURE_DEPLOYMENT", ""), os.getenv("AZURE_API_VERSION", ""))
+
+class Health:
+    __slots__ = ("state", "failures", "opened_at", "probing", "ewma_s", "err_rate", "recent")
+
+    def __init__(self):
+        self.state = "closed"      # closed -> open (after N failures) -> half_open (cooldown over) -> closed
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.ewma_s = 0.0
+        self.err_rate = 0.0
+        self.recent: deque = deque(maxlen=256)  # recent successful latencies, for the hedge delay
+
+    def available(self, now: float, cooldown: float) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and now - self.opened_at >= cooldown:
+            self.state = "half_open"
+        return self.state == "half_open" and not self.probing
+
+    def p95(self) -> float | None:
+        if len(self.recent) < 20:
+            return None
+        xs = sorted(self.recent)
+        return xs[int(0.95 * (len(xs) - 1))]
+
+    def score(self, weight: float) -> float:
+        # higher is better: configured weight, discounted by latency and error rate
+        return weight * (1.0 - min(self.err_rate, 0.99)) / (1.0 + self.ewma_s)
+
+class Route:
+    __slots__ = ("name", "tenant", "model", "backends", "strategy", "hedge", "max_attempts")
+
+    def __init__(self, name: str, backends: list[str], tenant: str = "*", model: str = "*",
+                 strategy: str = "ordered", hedge: bool = False, max_attempts: int = 0):
+        self.name = name
+        self.tenant = tenant
+        self.model = model
+        self.backends = backends
+        self.strategy = strategy
+        self.hedge = hedge
+        self.max_attempts = max_attempts or len(backends)
+
+class Router:
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+        self.breaker_failures = int(_fenv("ROUTER_BREAKER_FAILURES", "5"))
+        self.breaker_cooldown = _fenv("ROUTER_BREAKER_COOLDOWN_S", "30")
+        self.hedge_min = _fenv("ROUTER_HEDGE_MIN_MS", "50") / 1000.0
+        self.hedge_max = _fenv("ROUTER_HEDGE_MAX_MS", "5000") / 1000.0
+        self.alpha = 0.2
+        self.backends: dict[str, Backend] = {}
+        self.routes: list[Route] = []
+        self.health: dict[str, Health] = {}
+        self.load(os.getenv("ROUTES_FILE", "").strip())
+
+    def load(self, path: str):
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                cfg = json.load(f)
+            backends = {b["name"]: Backend.from_dict(b) for b in cfg.get("backends", [])}
+            routes = []
+            for i, r in enumerate(cfg.get("routes", [])):
+                unknown = [n for n in r["backends"] if n not in backends]
+                if unknown:
+                    raise ValueError(f"route {i} references unknown backends {unknown}")
+                routes.append(Route(r.get("name", f"route{i}"), list(r["backends"]), r.get("tenant", "*"),
+                                    r.get("model", "*"), r.get("strategy", "ordered"), bool(r.get("hedge", False)),
+                                    int(r.get("max_attempts", 0))))
+            if not routes:
+                routes = [Route("default", list(backends))]
+        else:
+            b = Backend.from_env()
+            backends = {b.name: b}
+            routes = [Route("default", [b.name])]
+        self.backends = backends
+        self.routes = routes
+        self.health = {n: self.health.get(n) or Health() for n in backends}
+
+    def match(self, tenant: str, model: str) -> Route:
+        for r in self.routes:
+            if r.tenant in ("*", tenant) and r.model in ("*", model):
+                return r
+        raise HTTPException(404, f"No route for tenant={tenant} model={model}")
+
+    def candidates(self, route: Route) -> list[Backend]:
+        now = time.time()
+        names = list(route.backends)
+        if route.strategy == "weighted":
+            # weighted random by health score, so traffic drifts away from slow/erroring backends
+            keyed = [(random.random() ** (1.0 / max(self.health[n].score(self.backends[n].weight), 1e-6)), n) for n in names]
+            names = [n for _, n in sorted(keyed, reverse=True)]
+        up = [n for n in names if self.health[n].available(now, self.breaker_cooldown)]
+        if not up:
+            M_UNAVAILABLE.inc(route.name)
+            raise HTTPException(503, "No upstream backend available (circuit open)",
+                                headers={"Retry-After": str(self._retry_after(names, now))})
+        return [self.backends[n] for n in up][:route.max_attempts]
+
+    def _retry_after(self, names: list[str], now: float) -> int:
+        # seconds until the first open breaker lets a probe through (1 while a probe is running)
+        waits = [self.health[n].opened_at + self.breaker_cooldown - now for n in names if self.health[n].state == "open"]
+        return max(1, math.ceil(min(waits))) if waits else 1
+
+    def hedge_delay(self, b: Backend) -> float:
+        p95 = self.health[b.name].p95()
+        return min(self.hedge_max, max(self.hedge_min, p95 if p95 is not None else self.hedge_max))
+
+    def _record(self, b: Backend, ok: bool, elapsed: float):
+        h = self.health[b.name]
+        h.err_rate += self.alpha * ((0.0 if ok else 1.0) - h.err_rate)
+        if ok:
+            h.ewma_s += self.alpha * (elapsed - h.ewma_s)
+            h.recent.append(elapsed)
+            h.failures = 0
+            h.state = "closed"
+        else:
+            h.failures += 1
+            if h.state == "half_open" or h.failures >= self.breaker_failures:
+                h.state = "open"
+                h.opened_at = time.time()
+        h.probing = False
+
+    def _child_span(self, name: str, parent):
+        if not self.tracer:
+            return None
+        if parent is None:
+            return self.tracer.start_span(name)
+        from opentelemetry import trace
+        return self.tracer.start_span(name, context=trace.set_span_in_context(parent))
+
+    def _current(self, span):
+        # upstream.http spans opened inside fn() become children of the attempt
+        if span is None:
+            return contextlib.nullcontext()
+        from opentelemetry import trace
+        return trace.use_span(span, end_on_exit=False, record_exception=False, set_status_on_exception=False)
+
+    async def _attempt(self, b: Backend, fn, attempt: int, parent=None):
+        h = self.health[b.name]
+        if not h.available(time.time(), self.breaker_cooldown):
+            # opened, or its one probe taken by another request, since candidates() ran
+            M_ATTEMPTS.inc(b.name, "breaker_open")
+            raise HTTPException(503, f"Upstream {b.name} unavailable (circuit open)", headers={"Retry-After": "1"})
+        if h.state == "half_open":
+            h.probing = True
+        span = self._child_span("llm.attempt", parent)
+        if span:
+            span.set_attribute("backend", b.name)
+            span.set_attribute("provider", b.provider)
+            span.set_attribute("attempt", attempt)
+            span.set_attribute("breaker", h.state)
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            with self._current(span):
+                res = await fn(b)
+            self._record(b, True, time.perf_counter() - started)
+            return res
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            h.probing = False
+            raise
+        except BaseException as e:
+            outcome = "retryable" if retryable(e) else "error"
+            if outcome == "retryable":
+                self._record(b, False, time.perf_counter() - started)
+            else:
+                h.probing = False
+            if span:
+                span.record_exception(e)
+            raise
+        finally:
+            M_ATTEMPTS.inc(b.name, outcome)
+            if span:
+                span.set_attribute("outcome", outcome)
+                span.end()
+
+    async def _hedged(self, route: Route, a: Backend, b: Backend, fn, span):
+        delay = self.hedge_delay(a)
+        first = asyncio.ensure_future(self._attempt(a, fn, 1, span))
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        if done:
+            e = first.exception()
+            if e is None:
+                return first.result(), a
+            if not retryable(e):
+                raise e
+            # failed before the hedge timer: plain failover to the second candidate
+            M_FAILOVERS.inc(route.name)
+            return await self._attempt(b, fn, 2, span), b
+        if span:
+            span.set_attribute("hedge_delay_ms", delay * 1000.0)
+        second = asyncio.ensure_future(self._attempt(b, fn, 2, span))
+        owner = {first: a, second: b}
+        pending = {first, second}
+        error: BaseException | None = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        M_HEDGES.inc(route.name, "hedge" if task is second else "primary")
+                        return task.result(), owner[task]
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def execute(self, route: Route, fn: t.Callable[[Backend], t.Awaitable[t.Any]], hedge: bool = True):
+        # -> (result, backend that produced it); fn(backend) does one upstream call
+        cands = self.candidates(route)
+        span = self._child_span("llm.route", None)
+        if span:
+            span.set_attribute("route", route.name)
+            span.set_attribute("candidates", ",".join(b.name for b in cands))
+        tried = 0
+        error: BaseException | None = None
+        try:
+            if hedge and route.hedge and len(cands) >= 2:
+                tried = 2
+                try:
+                    res, b = await self._hedged(route, cands[0], cands[1], fn, span)
+                    if span:
+                        span.set_attribute("backend", b.name)
+                    return res, b
+                except BaseException as e:
+                    if not retryable(e):
+                        raise
+                    error = e
+                cands = cands[2:]
+            for b in cands:
+                tried += 1
+                if tried > 1:
+                    M_FAILOVERS.inc(route.name)
+                try:
+                    res = await self._attempt(b, fn, tried, span)
+                    if span:
+                        span.set_attribute("backend", b.name)
+                    return res, b
+                except BaseException as e:
+                    if not retryable(e):
+                        raise
+                    error = e
+            raise error or HTTPException(503, "No upstream backend available")
+        finally:
+            if span:
+                span.set_attribute("attempts", tried)
+                span.end()
+
+    def stats(self) -> dict[str, dict]:
+        return {n: {"state": h.state, "ewma_ms": h.ewma_s * 1000.0, "error_rate": h.err_rate,
+                    "p95_ms": (h.p95() or 0.0) * 1000.0} for n, h in self.health.items()}
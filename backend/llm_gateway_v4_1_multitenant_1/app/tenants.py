@@ -0,0 +1,163 @@
+import os, json, math, time, hashlib, asyncio, typing as t
+
+# ---------- Tenant keys (live config) ----------
+# API_KEYS_FILE is parsed into an immutable TenantConfig. A reload (file watcher or
+# POST /admin/reload) validates the whole file first and then swaps the config in
+# with one attribute assignment, so request handlers read TENANTS.current without
+# a lock and see either the old or the new config, never a mix. A file that fails
+# validation is rejected and the previous config stays. Limiter buckets and quotas
+# are keyed by API key, so keys that survive a reload keep their state.
+#   API_KEYS_FILE=./api_keys.json   API_KEYS_WATCH_S=2 (0 = no watcher)
+
+CACHE_OPTIONS = ("true", "false", "shared", "1", "0", "yes", "no", "on", "off")
+
+class TenantConfig:
+    __slots__ = ("keys", "multi_tenant", "version", "digest", "loaded_at")
+
+    def __init__(self, keys: dict[str, dict], multi_tenant: bool, version: int, digest: str):
+        self.keys = keys                  # key -> {tenant, rps, burst, quota_daily, token_*, weight, cache}
+        self.multi_tenant = multi_tenant
+        self.version = version
+        self.digest = digest
+        self.loaded_at = time.time()
+
+def _number(item: dict, name: str, default, cast):
+    v = item.get(name, default)
+    try:
+        v = cast(v if v not in ("", None) else 0)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"{item.get('tenant', '?')}: {name} must be a number, got {v!r}")
+    # json.loads accepts NaN / Infinity; a NaN rps or burst would admit everything
+    if not math.isfinite(v):
+        raise ValueError(f"{item.get('tenant', '?')}: {name} must be a finite number, got {v!r}")
+    if v < 0:
+        raise ValueError(f"{item.get('tenant', '?')}: {name} must be >= 0")
+    return v
+
+def parse_keys(arr: t.Any) -> dict[str, dict]:
+    # raises ValueError describing the first problem; nothing is applied on error
+    if not isinstance(arr, list):
+        raise ValueError("API_KEYS_FILE must hold a JSON list")
+    if not arr:
+        # an emptied file would turn every request into a 401; keep the keys we have
+        raise ValueError("API_KEYS_FILE lists no keys")
+    env = os.getenv
+    keys: dict[str, dict] = {}
+    for i, item in enumerate(arr):
+        if not isinstance(item, dict) or not str(item.get("key") or "").strip() or not str(item.get("tenant") or "").strip():
+            raise ValueError(f"entry {i}: needs non-empty 'key' and 'tenant'")
+        key = str(item["key"])
+        if key in keys:
+            raise ValueError(f"entry {i}: duplicate key for tenant {item['tenant']}")
+        cache = item.get("cache", env("CACHE_TENANT_DEFAULT", "false"))
+        if str(cache).strip().lower() not in CACHE_OPTIONS:
+            raise ValueError(f"{item['tenant']}: cache must be true, false or \"shared\"")
+        keys[key] = {
+            "tenant": str(item["tenant"]),
+            "rps": _number(item, "rps", 5, float),
+            "burst": _number(item, "burst", 20, float),
+            "quota_daily": _number(item, "quota_daily", 10000, int),
+            # LLM token budgets (prompt + completion); 0 = no limit, see "Token budgets"
+            "token_rps": _number(item, "token_rps", env("TOKEN_RATE_LIMIT_TPS", "0"), float),
+            "token_burst": _number(item, "token_burst", env("TOKEN_RATE_LIMIT_BURST", "0"), float),
+            "token_quota_daily": _number(item, "token_quota_daily", env("TOKEN_QUOTA_DAILY", "0"), int),
+            # share of upstream capacity when providers are saturated (fair queue weight)
+            "weight": _number(item, "weight", 1, float) or 1.0,
+            # completion cache opt-in: true (per-tenant), "shared" (across tenants) or false
+            "cache": cache,
+        }
+    return keys
+
+class TenantRegistry:
+    def __init__(self, path: str, watch_s: float = 2.0):
+        self.path = path
+        self.watch_s = watch_s
+        self.current = TenantConfig({}, False, 0, "")
+        self._stat: tuple[int, int] | None = None
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()       # serializes reloads only; readers never take it
+        self.reloads: dict[tuple[str, str], int] = {}   # (source, result) -> count
+        self.last_error = ""
+
+    def _read(self) -> tuple[bytes, tuple[int, int]]:
+        st = os.stat(self.path)
+        with open(self.path, "rb") as f:
+            return f.read(), (st.st_mtime_ns, st.st_size)
+
+    def _count(self, source: str, result: str):
+        self.reloads[(source, result)] = self.reloads.get((source, result), 0) + 1
+
+    def _apply(self, raw: bytes, source: str) -> dict:
+        digest = hashlib.sha256(raw).hexdigest()[:16]
+        cur = self.current
+        if digest == cur.digest:
+            self._count(source, "unchanged")
+            return {"ok": True, "changed": False, "version": cur.version}
+        keys = parse_keys(json.loads(raw.decode("utf-8")))
+        old = cur.keys
+        added = [k for k in keys if k not in old]
+        removed = [k for k in old if k not in keys]
+        updated = [k for k in keys if k in old and keys[k] != old[k]]
+        self.current = TenantConfig(keys, True, cur.version + 1, digest)
+        self.last_error = ""
+        self._count(source, "applied")
+        tenants = lambda ks, src: sorted({src[k]["tenant"] for k in ks})
+        info = {"ok": True, "changed": True, "version": self.current.version, "digest": digest,
+                "tenants": len({v["tenant"] for v in keys.values()}), "added": tenants(added, keys),
+                "removed": tenants(removed, old), "updated": tenants(updated, keys)}
+        print(json.dumps({"ts": time.time(), "event": "config_reload", "source": source, **info}, ensure_ascii=False))
+        return info
+
+    def load(self):
+        # startup: a missing or broken file leaves the gateway single-tenant, as before
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            raw, self._stat = self._read()
+            self._apply(raw, "startup")
+            print(f"Multi-tenant mode ON. Tenants: {[v['tenant'] for v in self.current.keys.values()]}")
+        except Exception as e:
+            self._count("startup", "error")
+            self.last_error = str(e)
+            print("Failed loading API_KEYS_FILE:", e)
+
+    async def reload(self, source: str = "admin") -> dict:
+        async with self._lock:
+            try:
+                raw, stat = await asyncio.to_thread(self._read)
+                self._stat = stat
+                return self._apply(raw, source)
+            except (OSError, ValueError) as e:   # JSON and validation errors are ValueErrors
+                self._count(source, "error")
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(json.dumps({"ts": time.time(), "event": "config_reload", "source": source, "ok": False,
+                                  "error": self.last_error, "version": self.current.version}, ensure_ascii=False))
+                return {"ok": False, "error": self.last_error, "version": self.current.version}
+
+    async def start(self):
+        if self.path and self.watch_s > 0:
+            self._task = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _watch(self):
+        # each worker polls the file itself, so all of them converge on the same version
+        while True:
+            await asyncio.sleep(self.watch_s)
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                continue
+            if (st.st_mtime_ns, st.st_size) != self._stat:
+                await self.reload("watch")
+
+    def stats(self) -> dict:
+        cur = self.current
+        return {"version": cur.version, "digest": cur.digest, "loaded_at": cur.loaded_at,
+                "multi_tenant": cur.multi_tenant, "keys": len(cur.keys), "last_error": self.last_error}
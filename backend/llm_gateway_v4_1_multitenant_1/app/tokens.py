@@ -0,0 +1,134 @@
+import os, re, math, time, typing as t
+
+# ---------- Token estimation ----------
+# Admission needs a token count before the provider has seen the prompt. With
+# `tiktoken` installed and its BPE files available offline (TIKTOKEN_CACHE_DIR), the
+# real encoder is used; the encoders are loaded once at startup, off the event loop
+# (ESTIMATOR.load in the app lifespan), and never on a request path. Otherwise a
+# character-class estimate is used (Latin words, Arabic words, CJK chars, digit groups,
+# punctuation), computed with C-level regex counts only. Either way the estimate is
+# corrected per model by the ratio of actual to estimated prompt tokens reported
+# back by the provider (EWMA), so the heuristic converges to each model's tokenizer.
+#   TOKEN_ESTIMATOR=auto|tiktoken|heuristic   TOKEN_CHAT_OVERHEAD=4
+
+_LATIN = re.compile(r"[A-Za-z]+")
+_ARABIC = re.compile(r"[؀-ۿݐ-ݿﭐ-﷿ﹰ-﻿]+")
+_CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+_DIGITS = re.compile(r"\d+")
+_PUNCT = re.compile(r"[^\w\s]")
+
+ENCODING_FOR = (("gpt-4o", "o200k_base"), ("gpt-4.1", "o200k_base"), ("o1", "o200k_base"), ("o3", "o200k_base"),
+                ("gpt-4", "cl100k_base"), ("gpt-3.5", "cl100k_base"), ("text-embedding-3", "cl100k_base"))
+
+def _load_encoder(name: str):
+    # None when tiktoken is missing or its tables cannot be loaded (get_encoding may download them)
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None
+
+def _encoding_name(model: str) -> str:
+    m = model.lower()
+    for prefix, name in ENCODING_FOR:
+        if m.startswith(prefix):
+            return name
+    return "cl100k_base"
+
+def _runs(rx: re.Pattern, text: str) -> tuple[int, int, str]:
+    # -> (number of runs, characters in them, text with them removed), all in C
+    rest, runs = rx.subn(" ", text)
+    return runs, len(text) - len(rest) + runs, rest
+
+_ASCII_LETTERS = bytes(range(65, 91)) + bytes(range(97, 123))
+_ASCII_DIGITS = b"0123456789"
+_ASCII_SPACE = b" \t\n\r\x0b\x0c"
+_ASCII_PUNCT = bytes(c for c in range(33, 127) if not chr(c).isalnum() and c != 95)
+
+def _ascii_tokens(b: bytes) -> int:
+    # same estimate as below from class counts only (bytes.translate is ~100x faster than re here)
+    size = len(b)
+    letters = size - len(b.translate(None, _ASCII_LETTERS))
+    digits = size - len(b.translate(None, _ASCII_DIGITS))
+    punct = size - len(b.translate(None, _ASCII_PUNCT))
+    words = len(b.split()) if size < 4096 else size - len(b.translate(None, _ASCII_SPACE)) + 1
+    words = min(words, letters + digits) if letters + digits else 0
+    return words + max(0, letters - 6 * words) // 4 + (digits + 2) // 3 + punct
+
+def heuristic_tokens(text: str) -> int:
+    if text.isascii():
+        return _ascii_tokens(text.encode("ascii"))
+    words, letters, rest = _runs(_LATIN, text)
+    # common English words are one token; longer ones split about every 4 letters
+    n = words + max(0, letters - 6 * words) // 4
+    words, letters, rest = _runs(_ARABIC, rest)
+    n += words + max(0, letters - 3 * words) // 2
+    cjk, _, rest = _runs(_CJK, rest)
+    groups, digits, rest = _runs(_DIGITS, rest)
+    n += cjk + groups + max(0, digits - 3 * groups) // 3
+    return n + _PUNCT.subn("", rest)[1]
+
+class TokenEstimator:
+    def __init__(self):
+        self.mode = os.getenv("TOKEN_ESTIMATOR", "auto").strip().lower()
+        self.overhead = int(os.getenv("TOKEN_CHAT_OVERHEAD", "4") or "4")
+        self.alpha = 0.1
+        self.ratio: dict[str, float] = {}   # model -> actual / heuristic prompt tokens
+        self.encoders: dict[str, t.Any] = {}   # filled by load(); empty = heuristic only
+
+    def load(self) -> list[str]:
+        # blocking (file reads, maybe a download): call it with asyncio.to_thread
+        if self.mode == "heuristic":
+            return []
+        for name in sorted({enc for _, enc in ENCODING_FOR}):
+            enc = _load_encoder(name)
+            if enc is not None:
+                self.encoders[name] = enc
+        return sorted(self.encoders)
+
+    def _exact(self, text: str, model: str) -> int | None:
+        enc = self.encoders.get(_encoding_name(model))
+        return len(enc.encode(text, disallowed_special=())) if enc is not None else None
+
+    def raw(self, text: str, model: str) -> tuple[int, bool]:
+        # -> (tokens, exact)
+        n = self._exact(text, model)
+        return (n, True) if n is not None else (heuristic_tokens(text), False)
+
+    def estimate(self, text: str, model: str) -> tuple[int, int]:
+        # -> (calibrated count, uncalibrated heuristic count or 0 when exact); keep the
+        # second for observe() so calibration never has to tokenize the prompt again
+        n, exact = self.raw(text, model)
+        if exact:
+            return n + self.overhead, 0
+        return math.ceil(n * self.ratio.get(model, 1.0)) + self.overhead, n
+
+    def count(self, text: str, model: str) -> int:
+        return self.estimate(text, model)[0]
+
+    def observe(self, model: str, heuristic_n: int, actual_prompt_tokens: float):
+        # calibrate the heuristic against what the provider reported for the prompt it was computed on
+        n = heuristic_n
+        if not actual_prompt_tokens or n <= 0:
+            return
+        r = max(0.2, min(5.0, (actual_prompt_tokens - self.overhead) / n))
+        prev = self.ratio.get(model)
+        self.ratio[model] = r if prev is None else prev + self.alpha * (r - prev)
+
+class TokenMeter:
+    # per-tenant tokens/second, exponentially decayed over `tau` seconds
+    def __init__(self, tau: float = 60.0):
+        self.tau = tau
+        self._rate: dict[str, tuple[float, float]] = {}   # tenant -> (rate, ts)
+
+    def add(self, tenant: str, tokens: float, now: float | None = None):
+        now = time.time() if now is None else now
+        rate, ts = self._rate.get(tenant, (0.0, now))
+        rate *= math.exp(-(now - ts) / self.tau)
+        self._rate[tenant] = (rate + tokens / self.tau, now)
+
+    def rates(self, now: float | None = None) -> dict[str, float]:
+        now = time.time() if now is None else now
+        return {k: r * math.exp(-(now - ts) / self.tau) for k, (r, ts) in self._rate.items()}
+
+ESTIMATOR = TokenEstimator()
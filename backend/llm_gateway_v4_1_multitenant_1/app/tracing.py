@@ -0,0 +1,135 @@
+import os, threading, typing as t
+from collections import OrderedDict
+from opentelemetry.trace import get_current_span, StatusCode
+from opentelemetry.trace.span import TraceState
+from opentelemetry.sdk.trace import SpanProcessor
+from opentelemetry.sdk.trace.sampling import Sampler, SamplingResult, Decision
+
+# ---------- Trace sampling ----------
+# Only imported when OTLP tracing is on (the SDK is optional).
+# Head: the root span (http.request) is sampled from its trace id with a per-tenant
+# ratio; children follow the root. Head-sampled spans go straight to the exporter.
+# Tail: when a keep rule is on, the other requests are still recorded, their spans
+# are buffered in process until the root ends, and the trace is exported only if
+# it failed or was slow; otherwise it is dropped before any serialization. With no
+# keep rule, unsampled requests get non-recording spans and cost next to nothing.
+#   TRACE_SAMPLE_RATIO=1.0   TRACE_SAMPLE_TENANTS="mars=1,milkyway=0.05"
+#   TRACE_KEEP_ERRORS=1      TRACE_KEEP_MIN_STATUS=500   TRACE_KEEP_SLOW_MS=10000 (0 = off)
+#   TRACE_TAIL_MAX_TRACES=5000   (buffered traces; the oldest is dropped beyond that)
+
+HEAD_KEY = "gwsample"   # trace state entry marking head-sampled traces, inherited by child spans
+
+def parse_ratios(spec: str) -> dict[str, float]:
+    out = {}
+    for part in spec.split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            out[k.strip()] = max(0.0, min(1.0, float(v)))
+    return out
+
+class TenantRatioSampler(Sampler):
+    def __init__(self, ratio: float, tenants: dict[str, float], tail: bool):
+        self.ratio = ratio
+        self.tenants = tenants
+        self.tail = tail
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        parent = get_current_span(parent_context).get_span_context()
+        if parent.is_valid:
+            return SamplingResult(Decision.RECORD_AND_SAMPLE if parent.trace_flags.sampled else Decision.DROP,
+                                  None, parent.trace_state)
+        ratio = self.tenants.get((attributes or {}).get("tenant", ""), self.ratio)
+        # same rule as TraceIdRatioBased: the low 64 bits of the id are uniformly random
+        if (trace_id & 0xFFFFFFFFFFFFFFFF) < ratio * (1 << 64):
+            return SamplingResult(Decision.RECORD_AND_SAMPLE, None, TraceState([(HEAD_KEY, "head")]))
+        if self.tail:
+            return SamplingResult(Decision.RECORD_AND_SAMPLE, None, TraceState([(HEAD_KEY, "tail")]))
+        return SamplingResult(Decision.DROP)
+
+    def get_description(self) -> str:
+        return f"TenantRatioSampler{{{self.ratio}, tenants={len(self.tenants)}, tail={self.tail}}}"
+
+class TailSampler(SpanProcessor):
+    def __init__(self, delegate: SpanProcessor, keep_errors: bool, min_status: int, slow_ms: float,
+                 max_traces: int = 5000):
+        self.delegate = delegate
+        self.keep_errors = keep_errors
+        self.min_status = min_status
+        self.slow_ns = int(slow_ms * 1e6)
+        self.max_traces = max_traces
+        self._buf: "OrderedDict[int, list]" = OrderedDict()     # trace id -> [error?, spans...]
+        self._decided: "OrderedDict[int, bool]" = OrderedDict()  # for spans ending after their root (streams)
+        self._lock = threading.Lock()
+        self.counts = {"head": 0, "error": 0, "slow": 0, "dropped": 0, "evicted": 0}
+
+    def _failed(self, span) -> bool:
+        if not self.keep_errors:
+            return False
+        if span.status.status_code is StatusCode.ERROR:
+            return True
+        status = (span.attributes or {}).get("http.status_code")
+        return isinstance(status, int) and status >= self.min_status
+
+    def on_start(self, span, parent_context=None):
+        pass
+
+    def on_end(self, span):
+        root = span.parent is None or span.parent.is_remote
+        if span.context.trace_state.get(HEAD_KEY) != "tail":
+            if root:
+                self.counts["head"] += 1
+            self.delegate.on_end(span)
+            return
+        tid = span.context.trace_id
+        failed = self._failed(span)
+        with self._lock:
+            if tid in self._decided:
+                if not (self._decided[tid] or failed):
+                    return
+                spans, reason = [span], None
+            else:
+                entry = self._buf.get(tid)
+                if entry is None:
+                    entry = self._buf[tid] = [False]
+                    if len(self._buf) > self.max_traces:
+                        self._buf.popitem(last=False)
+                        self.counts["evicted"] += 1
+                entry[0] = entry[0] or failed
+                entry.append(span)
+                if not root:
+                    return
+                del self._buf[tid]
+                spans = entry[1:]
+                reason = "error" if entry[0] else (
+                    "slow" if self.slow_ns and span.end_time - span.start_time >= self.slow_ns else None)
+                self._decided[tid] = reason is not None
+                if len(self._decided) > self.max_traces:
+                    self._decided.popitem(last=False)
+                self.counts[reason or "dropped"] += 1
+                if reason is None:
+                    return
+        for s in spans:
+            self.delegate.on_end(s)
+
+    def stats(self) -> dict:
+        return {**self.counts, "buffered": len(self._buf)}
+
+    def shutdown(self):
+        self.delegate.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.delegate.force_flush(timeout_millis)
+
+def sampling_from_env(delegate: SpanProcessor) -> tuple[Sampler, t.Optional[TailSampler]]:
+    e = os.getenv
+    keep_errors = e("TRACE_KEEP_ERRORS", "1") not in ("0", "false", "no")
+    slow_ms = float(e("TRACE_KEEP_SLOW_MS", "10000") or 0)
+    ratio = max(0.0, min(1.0, float(e("TRACE_SAMPLE_RATIO", "1") or 1)))
+    tenants = parse_ratios(e("TRACE_SAMPLE_TENANTS", ""))
+    # nothing to decide at the tail when every trace is head-sampled anyway
+    tail = (keep_errors or slow_ms > 0) and (ratio < 1.0 or any(r < 1.0 for r in tenants.values()))
+    sampler = TenantRatioSampler(ratio, tenants, tail)
+    if not tail:
+        return sampler, None
+    return sampler, TailSampler(delegate, keep_errors, int(e("TRACE_KEEP_MIN_STATUS", "500") or 500), slow_ms,
+                                int(e("TRACE_TAIL_MAX_TRACES", "5000") or 5000))
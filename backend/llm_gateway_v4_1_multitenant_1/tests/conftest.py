@@ -0,0 +1,4 @@
+import os, sys
+
+# the gateway is imported as the `app` package, as uvicorn app.main:app does
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
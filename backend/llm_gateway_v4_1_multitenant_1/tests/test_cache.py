@@ -0,0 +1,28 @@
+import asyncio, threading
+from app.cache import CompletionCache, DiskCache
+
+def test_disk_cache_runs_off_the_event_loop(tmp_path):
+    cache = CompletionCache()
+    cache.backend = DiskCache(str(tmp_path / "c.sqlite3"), 60, 1 << 20, 100)
+    loop_thread = []
+    get, set_ = cache.backend.get, cache.backend.set
+
+    def spy(fn):
+        def wrapped(*a):
+            loop_thread.append(threading.current_thread() is threading.main_thread())
+            return fn(*a)
+        return wrapped
+    cache.backend.get, cache.backend.set = spy(get), spy(set_)
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        return "answer"
+
+    async def go():
+        first = await cache.get_or_call("k", upstream)
+        second = await cache.get_or_call("k", upstream)
+        return first, second
+    assert asyncio.run(go()) == (("answer", "miss"), ("answer", "hit"))
+    assert calls == [1]
+    assert loop_thread and not any(loop_thread)
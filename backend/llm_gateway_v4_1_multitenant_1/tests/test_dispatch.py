@@ -0,0 +1,233 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app.dispatch import Dispatcher, MicroBatcher
+
+def run(coro):
+    return asyncio.run(coro)
+
+class Upstream:
+    # records every batch; replies "<prompt>!" in reverse order, tagged by index like vLLM
+    def __init__(self, fail: Exception | None = None):
+        self.batches: list[list] = []
+        self.fail = fail
+
+    async def send(self, model, temperature, max_tokens, prompts):
+        self.batches.append(list(prompts))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise self.fail
+        return [f"{p}!" for p in prompts], {"prompt_tokens": 4 * len(prompts), "completion_tokens": 2 * len(prompts)}
+
+def test_batch_flushes_on_size():
+    async def go():
+        up = Upstream()
+        b = MicroBatcher("vllm", 3, 60.0, up.send)    # window never fires
+        d = Dispatcher("vllm", 64, 100, 5)
+        res = await asyncio.wait_for(asyncio.gather(*(b.submit(d, "t", 1.0, "m", 0.0, 16, f"p{i}") for i in range(3))), 1)
+        return up, res, d
+    up, res, d = run(go())
+    assert up.batches == [["p0", "p1", "p2"]]
+    assert [text for text, _ in res] == ["p0!", "p1!", "p2!"]
+    assert res[0][1] == {"prompt_tokens": 4.0, "completion_tokens": 2.0}
+    assert d.active == 0
+
+def test_batch_flushes_on_deadline():
+    async def go():
+        up = Upstream()
+        b = MicroBatcher("vllm", 8, 0.01, up.send)
+        d = Dispatcher("vllm", 64, 100, 5)
+        first = await asyncio.wait_for(asyncio.gather(b.submit(d, "t", 1.0, "m", 0.0, 16, "a"),
+                                                      b.submit(d, "t", 1.0, "m", 0.0, 16, "b")), 1)
+        later = await asyncio.wait_for(b.submit(d, "t", 1.0, "m", 0.0, 16, "c"), 1)
+        return up, first, later
+    up, first, later = run(go())
+    assert up.batches == [["a", "b"], ["c"]]
+    assert [t for t, _ in first] == ["a!", "b!"] and later[0] == "c!"
+
+def test_batches_are_keyed_by_generation_params():
+    async def go():
+        up = Upstream()
+        b = MicroBatcher("vllm", 8, 0.01, up.send)
+        d = Dispatcher("vllm", 64, 100, 5)
+        await asyncio.gather(b.submit(d, "t", 1.0, "m", 0.0, 16, "a"), b.submit(d, "t", 1.0, "m", 0.0, 32, "b"),
+                             b.submit(d, "t", 1.0, "m", 0.0, 16, "c"))
+        return up
+    assert sorted(run(go()).batches) == [["a", "c"], ["b"]]
+
+def test_upstream_error_reaches_every_member():
+    async def go():
+        up = Upstream(fail=HTTPException(503, "down"))
+        b = MicroBatcher("vllm", 2, 60.0, up.send)
+        d = Dispatcher("vllm", 64, 100, 5)
+        res = await asyncio.gather(b.submit(d, "t", 1.0, "m", 0.0, 16, "a"),
+                                   b.submit(d, "u", 1.0, "m", 0.0, 16, "b"), return_exceptions=True)
+        return res, d
+    res, d = run(go())
+    assert [type(r) for r in res] == [HTTPException, HTTPException]
+    assert all(r.status_code == 503 for r in res)
+    assert d.active == 0
+
+def test_short_reply_fails_the_batch_instead_of_hanging():
+    async def short(model, temperature, max_tokens, prompts):
+        return ["only one"], {}
+
+    async def go():
+        b = MicroBatcher("vllm", 2, 60.0, short)
+        d = Dispatcher("vllm", 64, 100, 5)
+        return await asyncio.wait_for(asyncio.gather(b.submit(d, "t", 1.0, "m", 0.0, 16, "a"),
+                                                     b.submit(d, "t", 1.0, "m", 0.0, 16, "b"),
+                                                     return_exceptions=True), 1)
+    res = run(go())
+    assert all(isinstance(r, HTTPException) and r.status_code == 502 for r in res)
+
+def test_each_member_is_admitted_under_its_own_tenant():
+    # with one slot, a heavy tenant's prompts cannot ride along in a light tenant's turn
+    order = []
+
+    async def send(model, temperature, max_tokens, prompts):
+        order.extend(prompts)
+        await asyncio.sleep(0)
+        return list(prompts), {}
+
+    async def go():
+        b = MicroBatcher("vllm", 8, 0.0, send)
+        d = Dispatcher("vllm", 1, 100, 5)
+        hold = asyncio.get_running_loop().create_future()
+
+        async def blocker():
+            async with d.slot("x", 1.0):
+                await hold
+        blocking = asyncio.ensure_future(blocker())
+        await asyncio.sleep(0)
+        calls = [asyncio.ensure_future(b.submit(d, tenant, w, "m", 0.0, 16, f"{tenant}{i}"))
+                 for i in range(3) for tenant, w in (("heavy", 3.0), ("light", 1.0))]
+        await asyncio.sleep(0)
+        hold.set_result(None)
+        await asyncio.gather(blocking, *calls)
+    run(go())
+    assert order[:2] == ["heavy0", "heavy1"]
+    assert sum(p.startswith("heavy") for p in order[:4]) == 3     # 3:1 while both are backlogged
+
+def test_batch_texts_maps_choices_by_index():
+    from app.main import _batch_texts
+    data = {"choices": [{"index": 2, "text": "c"}, {"index": 0, "text": "a"}, {"index": 1, "text": "b"}]}
+    assert _batch_texts(data, 3) == ["a", "b", "c"]
+    with pytest.raises(HTTPException) as e:
+        _batch_texts({"choices": [{"index": 0, "text": "a"}, {"index": 0, "text": "a"}]}, 2)
+    assert e.value.status_code == 502
+
+async def _hold(d: Dispatcher, gate: asyncio.Event):
+    async with d.slot("holder"):
+        await gate.wait()
+
+def test_fair_queue_shares_follow_weights():
+    async def go():
+        d = Dispatcher("p", 1, 100, 5)
+        gate, order = asyncio.Event(), []
+
+        async def call(tenant, weight):
+            async with d.slot(tenant, weight):
+                order.append(tenant)
+                await asyncio.sleep(0)
+        holder = asyncio.create_task(_hold(d, gate))
+        await asyncio.sleep(0)
+        calls = [asyncio.create_task(call("heavy", 3.0)) for _ in range(12)]
+        calls += [asyncio.create_task(call("light", 1.0)) for _ in range(12)]
+        await asyncio.sleep(0)
+        assert d._waiting == 24
+        gate.set()
+        await asyncio.gather(holder, *calls)
+        return order, d
+    order, d = run(go())
+    # while both are backlogged heavy gets 3 of every 4 slots; light drains once heavy is done
+    assert order[:8] == ["heavy"] * 3 + ["light"] + ["heavy"] * 3 + ["light"]
+    assert order[:16].count("heavy") == 12 and order[16:] == ["light"] * 8
+    assert d.active == 0 and d._waiting == 0
+
+@pytest.mark.parametrize("handed", [False, True])
+def test_cancelled_waiter_does_not_leak_its_slot(handed):
+    async def go():
+        d = Dispatcher("p", 1, 100, 5)
+        holder = d.slot("holder")
+        await holder.__aenter__()
+
+        async def call():
+            async with d.slot("t"):
+                pass
+        waiter = asyncio.create_task(call())
+        await asyncio.sleep(0)
+        assert d._waiting == 1
+        if handed:
+            # cancelled, and handed the slot by a release before the cancellation is delivered
+            waiter.cancel()
+            await holder.__aexit__(None, None, None)
+            assert d._heap == [] and d.active == 1
+        else:
+            waiter.cancel()
+            await asyncio.sleep(0)
+            await holder.__aexit__(None, None, None)
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert d.active == 0 and d._waiting == 0
+        # the slot is free for the next caller straight away
+        async with d.slot("next"):
+            assert d.active == 1
+        return d
+    d = run(go())
+    assert d.active == 0 and not d._heap
+
+def test_prepare_runs_inside_the_dispatcher_slot():
+    async def go():
+        up = Upstream()
+        b = MicroBatcher("vllm", 2, 0.01, up.send)
+        d = Dispatcher("vllm", 1, 100, 5)
+        running, seen = [0], []
+
+        def prepare(p):
+            async def templated():
+                # e.g. the /tokenize call: must count against the upstream concurrency cap
+                running[0] += 1
+                seen.append((running[0], d.active))
+                await asyncio.sleep(0.005)
+                running[0] -= 1
+                return p
+            return templated
+        res = await asyncio.wait_for(asyncio.gather(*(b.submit(d, "t", 1.0, "m", 0.0, 16, prepare=prepare(f"p{i}"))
+                                                     for i in range(3))), 2)
+        return res, seen, d
+    res, seen, d = run(go())
+    assert [text for text, _ in res] == ["p0!", "p1!", "p2!"]
+    assert seen == [(1, 1)] * 3 and d.active == 0
+
+def test_prepare_none_skips_batching_and_frees_the_slot():
+    async def go():
+        up = Upstream()
+        b = MicroBatcher("vllm", 2, 0.01, up.send)
+        d = Dispatcher("vllm", 1, 100, 5)
+
+        async def untemplated():
+            return None
+        res = await b.submit(d, "t", 1.0, "m", 0.0, 16, prepare=untemplated)
+        return res, up, d
+    res, up, d = run(go())
+    assert res is None and up.batches == [] and d.active == 0
+
+def test_batch_tasks_are_kept_and_cancelled_on_close():
+    async def go():
+        gate = asyncio.Event()
+
+        async def send(model, temperature, max_tokens, prompts):
+            await gate.wait()
+            return prompts, {}
+        b = MicroBatcher("vllm", 2, 60.0, send)
+        d = Dispatcher("vllm", 64, 100, 5)
+        calls = [asyncio.ensure_future(b.submit(d, "t", 1.0, "m", 0.0, 16, p)) for p in "ab"]
+        await asyncio.sleep(0.01)
+        assert len(b._tasks) == 1
+        await b.aclose()
+        res = await asyncio.gather(*calls, return_exceptions=True)
+        return res, b, d
+    res, b, d = run(go())
+    assert all(isinstance(r, asyncio.CancelledError) for r in res)
+    assert not b._tasks and d.active == 0
@@ -0,0 +1,105 @@
+import asyncio, time
+import pytest
+from app.limiter import MemoryLimiter, SQLiteLimiter
+from app.tokens import TokenEstimator
+
+def _limiters(tmp_path):
+    return [MemoryLimiter(1.0, 10.0, sweep_s=0), SQLiteLimiter(str(tmp_path / "l.sqlite3"), 60.0)]
+
+@pytest.mark.parametrize("which", [0, 1])
+def test_quota_reject_does_not_drain_the_bucket(tmp_path, which):
+    lim = _limiters(tmp_path)[which]
+
+    async def go():
+        # quota of 3 used up, then far more rejected attempts than the bucket holds
+        got = [await lim.admit("key:a", 0.001, 5.0, "q:a", 3, 1.0) for _ in range(3)]
+        got += [await lim.admit("key:a", 0.001, 5.0, "q:a", 3, 1.0) for _ in range(10)]
+        # the two tokens left after the three admitted requests are still there
+        got += [await lim.admit("key:a", 0.001, 5.0) for _ in range(3)]
+        return got
+    assert asyncio.run(go()) == [None] * 3 + ["quota"] * 10 + [None, None, "rate"]
+
+def test_rate_reject_does_not_use_quota():
+    lim = MemoryLimiter(1.0, 10.0, sweep_s=0)
+
+    async def go():
+        got = [await lim.admit("key:b", 0.001, 2.0, "q:b", 100, 1.0) for _ in range(5)]
+        return got, lim.quota_used["q:b"]
+    assert asyncio.run(go()) == ([None, None, "rate", "rate", "rate"], 2.0)
+
+def test_estimator_calibrates_from_the_admission_count(monkeypatch):
+    est = TokenEstimator()
+    est.mode = "heuristic"
+    count, heuristic = est.estimate("one two three four", "m")
+    assert heuristic == 4 and count == 4 + est.overhead
+    calls = []
+    monkeypatch.setattr(est, "raw", lambda *a: calls.append(a))
+    est.observe("m", heuristic, 2 * heuristic + est.overhead)
+    assert not calls and est.ratio["m"] == 2.0
+    est.observe("m", 0, 100)   # exact counts carry no heuristic to calibrate
+    assert est.ratio["m"] == 2.0
+
+def test_sqlite_prunes_idle_full_buckets(tmp_path):
+    lim = SQLiteLimiter(str(tmp_path / "l.sqlite3"), 60.0, idle_s=60.0, sweep_s=0)
+
+    async def go():
+        assert await lim.admit("key:idle", 1.0, 5.0) is None      # full again 1 s later
+        assert await lim.admit("key:debt", 0.01, 5.0, cost=5.0) is None   # full 500 s later
+    asyncio.run(go())
+    rows = lambda: sorted(r[0] for r in lim._db().execute("SELECT ident FROM buckets"))
+    now = time.time()
+    assert lim.sweep(now) == 0 and rows() == ["key:debt", "key:idle"]
+    # idle but still refilling: dropping it would hand out a full bucket early
+    assert lim.sweep(now + 120) == 1 and rows() == ["key:debt"]
+    assert lim.sweep(now + 600) == 1 and rows() == [] and lim.stats()["evicted_idle"] == 2
+
+def test_sqlite_adds_full_at_to_old_files(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "old.sqlite3")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE buckets (ident TEXT PRIMARY KEY, tokens REAL, ts REAL)")
+    db.execute("INSERT INTO buckets VALUES ('key:old', 1.0, 0.0)")
+    db.commit()
+    db.close()
+    lim = SQLiteLimiter(path, 60.0, idle_s=60.0, sweep_s=0)
+    assert asyncio.run(lim.admit("key:new", 1.0, 5.0)) is None
+    assert lim.sweep() == 1
+
+def test_encoders_load_once_off_the_event_loop(monkeypatch):
+    import threading
+    from app import main, tokens
+    loads = []
+
+    def load(name):
+        loads.append((name, threading.current_thread() is threading.main_thread()))
+        return None   # e.g. offline without TIKTOKEN_CACHE_DIR
+    monkeypatch.setattr(tokens, "_load_encoder", load)
+    monkeypatch.setattr(main.ESTIMATOR, "mode", "auto")
+
+    async def go():
+        async with main.app.router.lifespan_context(main.app):
+            return main.ESTIMATOR.estimate("hello world", "gpt-4o")
+    count, heuristic = asyncio.run(go())
+    assert sorted(n for n, _ in loads) == ["cl100k_base", "o200k_base"]
+    assert not any(on_loop for _, on_loop in loads)
+    assert heuristic == 2   # falls back to the heuristic
+
+def test_no_estimate_without_token_limits(monkeypatch):
+    from app import main
+    monkeypatch.setattr(main, "TOKEN_TPS", 0.0)
+    monkeypatch.setattr(main, "TOKEN_QUOTA", 0)
+    monkeypatch.setattr(main.ESTIMATOR, "estimate", lambda *a: pytest.fail("estimated with limits off"))
+
+    class Req:
+        class state:
+            pass
+        client = None
+    metered = []
+    monkeypatch.setattr(main.TOKEN_METER, "add", lambda tenant, n: metered.append(n))
+
+    async def go():
+        grant = await main.reserve_tokens(Req(), None, "t", "m", "one two three", 16)
+        await main.settle_tokens(grant, "t", "m", {}, "four five")
+        return grant
+    grant = asyncio.run(go())
+    assert grant.ident is None and metered == [5]
@@ -0,0 +1,139 @@
+import asyncio, json, time
+import httpx
+import pytest
+from fastapi import HTTPException
+from app.routing import Health, Router
+
+def run(coro):
+    return asyncio.run(coro)
+
+@pytest.fixture
+def router(tmp_path, monkeypatch):
+    monkeypatch.setenv("ROUTER_BREAKER_FAILURES", "2")
+    monkeypatch.setenv("ROUTER_BREAKER_COOLDOWN_S", "30")
+    monkeypatch.setenv("ROUTER_HEDGE_MIN_MS", "20")
+    monkeypatch.setenv("ROUTER_HEDGE_MAX_MS", "20")
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps({
+        "backends": [{"name": "a", "provider": "openai"}, {"name": "b", "provider": "vllm"}],
+        "routes": [{"name": "solo", "tenant": "solo", "backends": ["a"]},
+                   {"name": "hedged", "tenant": "hedged", "backends": ["a", "b"], "hedge": True},
+                   {"name": "pair", "backends": ["a", "b"]}]}))
+    monkeypatch.setenv("ROUTES_FILE", str(path))
+    return Router()
+
+class Upstream:
+    # fn(backend) stub: per-backend behaviour is an exception to raise, a delay, or a reply
+    def __init__(self, **behaviour):
+        self.behaviour = behaviour
+        self.calls: list[str] = []
+        self.cancelled: list[str] = []
+
+    async def __call__(self, b):
+        self.calls.append(b.name)
+        how = self.behaviour.get(b.name, "ok")
+        if isinstance(how, BaseException):
+            raise how
+        try:
+            await asyncio.sleep(how if isinstance(how, (int, float)) else 0)
+        except asyncio.CancelledError:
+            self.cancelled.append(b.name)
+            raise
+        return f"from {b.name}"
+
+def test_failover_on_retryable_errors(router):
+    route = router.match("x", "m")
+    for err in (HTTPException(502, "bad gateway"), httpx.ConnectError("refused"), asyncio.TimeoutError()):
+        router.health["a"] = Health()   # two failures in a row would open its breaker
+        up = Upstream(a=err)
+        res, b = run(router.execute(route, up))
+        assert (res, b.name, up.calls) == ("from b", "b", ["a", "b"])
+
+def test_no_failover_on_non_retryable_errors(router):
+    up = Upstream(a=HTTPException(400, "bad request"))
+    with pytest.raises(HTTPException) as e:
+        run(router.execute(router.match("x", "m"), up))
+    assert e.value.status_code == 400 and up.calls == ["a"]
+    assert router.health["a"].failures == 0   # the caller's fault, not the backend's
+
+def test_open_breaker_fails_fast_without_a_call(router):
+    route = router.match("solo", "m")
+    up = Upstream(a=HTTPException(503, "down"))
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            run(router.execute(route, up))
+    assert router.health["a"].state == "open" and up.calls == ["a", "a"]
+    with pytest.raises(HTTPException) as e:
+        run(router.execute(route, up))
+    assert e.value.status_code == 503 and up.calls == ["a", "a"]
+    assert 1 <= int(e.value.headers["Retry-After"]) <= 30
+
+def test_open_breaker_is_skipped_for_the_next_candidate(router):
+    router.health["a"].state, router.health["a"].opened_at = "open", time.time()
+    up = Upstream()
+    res, b = run(router.execute(router.match("x", "m"), up))
+    assert b.name == "b" and up.calls == ["b"]
+
+def test_half_open_lets_one_probe_through_then_closes(router):
+    route = router.match("solo", "m")
+    h = router.health["a"]
+    h.state, h.opened_at, h.failures = "open", time.time() - 31, 2
+
+    async def go():
+        up = Upstream(a=0.05)
+        probe = asyncio.ensure_future(router.execute(route, up))
+        await asyncio.sleep(0.01)
+        assert h.state == "half_open" and h.probing
+        with pytest.raises(HTTPException) as e:
+            await router.execute(route, up)     # concurrent request while the probe runs
+        assert e.value.status_code == 503
+        res, _ = await probe
+        return res, up.calls
+    assert run(go()) == ("from a", ["a"])
+    assert h.state == "closed" and h.failures == 0 and not h.probing
+
+def test_failed_probe_reopens_the_breaker(router):
+    route = router.match("solo", "m")
+    h = router.health["a"]
+    h.state, h.opened_at = "open", time.time() - 31
+    with pytest.raises(HTTPException):
+        run(router.execute(route, Upstream(a=HTTPException(502, "still down"))))
+    assert h.state == "open" and not h.probing and time.time() - h.opened_at < 1
+
+def test_hedge_wins_and_the_slow_attempt_is_cancelled(router):
+    up = Upstream(a=1.0, b=0.0)
+
+    async def go():
+        started = time.perf_counter()
+        res, b = await router.execute(router.match("hedged", "m"), up)
+        await asyncio.sleep(0)
+        return res, b.name, time.perf_counter() - started
+    res, name, elapsed = run(go())
+    assert (res, name) == ("from b", "b") and elapsed < 0.5
+    assert up.calls == ["a", "b"] and up.cancelled == ["a"]
+    assert router.health["a"].failures == 0    # a cancelled loser is not a failure
+
+def test_primary_answers_before_the_hedge_timer(router):
+    up = Upstream(a=0.0)
+    res, b = run(router.execute(router.match("hedged", "m"), up))
+    assert b.name == "a" and up.calls == ["a"]
+
+def test_hedged_route_fails_over_when_the_primary_fails_early(router):
+    up = Upstream(a=HTTPException(502, "bad gateway"))
+    res, b = run(router.execute(router.match("hedged", "m"), up))
+    assert b.name == "b" and up.calls == ["a", "b"]
+
+def test_latency_provider_label_is_the_serving_backend(monkeypatch):
+    from app import main
+    seen = []
+    monkeypatch.setattr(main.M_LATENCY, "observe", lambda path, tenant, provider, *a, **k: seen.append(provider))
+
+    async def go():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://gw") as c:
+                body = {"prompt": "label me", "temperature": 0}
+                return [(await c.post("/llm/complete", json=body)).status_code for _ in range(2)]
+    assert run(go()) == [200, 200]
+    # the backend's name (not the route's "default"), then the cache hit
+    assert seen == [next(iter(main.ROUTER.backends)), "cache"]
@@ -0,0 +1,52 @@
+import asyncio, json
+import httpx
+import pytest
+from app.tenants import TenantConfig, TenantRegistry, parse_keys
+
+GOOD = [{"key": "k1", "tenant": "acme", "rps": 100, "burst": 100}]
+
+@pytest.mark.parametrize("bad", [
+    "[]",
+    '[{"key": "k1", "tenant": "acme", "rps": NaN}]',
+    '[{"key": "k1", "tenant": "acme", "burst": Infinity}]',
+    '[{"key": "k1", "tenant": "acme", "quota_daily": -Infinity}]',
+    '[{"key": "k1", "tenant": "acme", "token_quota_daily": 1e400}]',
+])
+def test_invalid_reload_keeps_the_previous_keys(tmp_path, bad):
+    path = tmp_path / "keys.json"
+    path.write_text(json.dumps(GOOD))
+    reg = TenantRegistry(str(path), 0)
+    reg.load()
+    assert reg.current.version == 1
+    path.write_text(bad)
+    res = asyncio.run(reg.reload("test"))
+    assert not res["ok"] and reg.current.version == 1 and list(reg.current.keys) == ["k1"]
+
+def test_parse_keys_accepts_numbers_as_strings():
+    keys = parse_keys([{"key": "k", "tenant": "t", "rps": "2.5", "quota_daily": ""}])
+    assert keys["k"]["rps"] == 2.5 and keys["k"]["quota_daily"] == 0
+
+def test_request_reads_the_tenant_config_once(monkeypatch):
+    from app import main
+    cfg = TenantConfig(parse_keys(GOOD), True, 7, "d")
+
+    class Spy:
+        reads = 0
+
+        @property
+        def current(self):
+            Spy.reads += 1
+            return cfg
+
+        async def close(self):
+            pass
+
+    async def go():
+        async with main.app.router.lifespan_context(main.app):
+            monkeypatch.setattr(main, "TENANTS", Spy())
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://gw") as c:
+                return await c.post("/llm/complete", json={"prompt": "hi"}, headers={"X-API-KEY": "k1"})
+    r = asyncio.run(go())
+    assert r.status_code == 200, r.text
+    assert Spy.reads == 1
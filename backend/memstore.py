@@ -0,0 +1,325 @@
+import os, re, json, glob, bisect, struct, threading, datetime
+from array import array
+from typing import Optional
+
+# ---------- Memory log store ----------
+# Append-only JSONL segments in data/memory/ (seg-00000001.jsonl, ...) with a sparse
+# offset index beside each one (seg-00000001.idx: a (ts, offset) pair every
+# MEMORY_INDEX_EVERY records). Appends are buffered and written in batches by a
+# background thread; tail reads seek backwards from the end of the newest segment
+# and time-range reads start from the index, so neither grows with the log.
+#   MEMORY_SEGMENT_BYTES=67108864  MEMORY_FLUSH_MS=50     MEMORY_BATCH=1000
+#   MEMORY_INDEX_EVERY=256         MEMORY_MAX_PENDING=100000
+#   MEMORY_MAX_SEGMENTS=0          (0 = keep every segment)
+
+IDX = struct.Struct("<dQ")
+BLOCK = 32 * 1024
+SEG_RE = re.compile(r"seg-(\d{8})\.jsonl$")
+
+def _ienv(name: str, default: int) -> int:
+    return int(os.getenv(name, "") or default)
+
+def parse_ts(v) -> Optional[float]:
+    # ISO-8601 ("2024-05-01T10:00:00Z", "2024-05-01") or epoch seconds -> epoch seconds
+    if v is None or v == "":
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    s = str(v).strip()
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+    d = datetime.datetime.fromisoformat(s)
+    if d.tzinfo is None:
+        d = d.replace(tzinfo=datetime.timezone.utc)
+    return d.timestamp()
+
+def _reverse_lines(path: str, end: int):
+    # lines of path[:end], last one first, reading BLOCK bytes at a time from the end
+    with open(path, "rb") as f:
+        pos, tail = end, b""
+        while pos > 0:
+            n = min(BLOCK, pos)
+            pos -= n
+            f.seek(pos)
+            parts = (f.read(n) + tail).split(b"\n")
+            tail = parts[0]
+            for line in reversed(parts[1:]):
+                if line:
+                    yield line
+        if tail:
+            yield tail
+
+class Segment:
+    __slots__ = ("num", "path", "idx_path", "size", "first_ts", "last_ts", "idx_ts", "idx_off", "since_idx")
+
+    def __init__(self, directory: str, num: int):
+        self.num = num
+        self.path = os.path.join(directory, f"seg-{num:08d}.jsonl")
+        self.idx_path = self.path[:-6] + ".idx"
+        self.size = 0              # committed bytes; readers never look past this
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.idx_ts = array("d")
+        self.idx_off = array("Q")
+        self.since_idx = 1 << 30   # records since the last index entry (forces one on first write)
+
+    def load(self, index_every: int):
+        self.size = os.path.getsize(self.path)
+        if os.path.exists(self.idx_path):
+            with open(self.idx_path, "rb") as f:
+                raw = f.read()
+            for ts, off in IDX.iter_unpack(raw[:len(raw) - len(raw) % IDX.size]):
+                if off < self.size:
+                    self.idx_ts.append(ts)
+                    self.idx_off.append(off)
+        elif self.size:
+            self._rebuild_index(index_every)
+        for line in _reverse_lines(self.path, self.size):
+            self.last_ts = parse_ts(json.loads(line).get("ts"))
+            break
+        if self.idx_ts:
+            self.first_ts = self.idx_ts[0]
+
+    def _rebuild_index(self, index_every: int):
+        # one forward pass, only for segments without an .idx (e.g. an imported memory.jsonl)
+        with open(self.path, "rb") as f, open(self.idx_path, "wb") as out:
+            off = 0
+            for i, line in enumerate(f):
+                if i % index_every == 0 and line.strip():
+                    ts = parse_ts(json.loads(line).get("ts")) or 0.0
+                    self.idx_ts.append(ts)
+                    self.idx_off.append(off)
+                    out.write(IDX.pack(ts, off))
+                off += len(line)
+
+    def end_before(self, until: float, size: int) -> int:
+        # byte offset no record after `until` needs to be read from
+        i = bisect.bisect_right(self.idx_ts, until)
+        return self.idx_off[i] if i < len(self.idx_off) else size
+
+class MemoryStore:
+    def __init__(self, directory: str, legacy: Optional[str] = None):
+        self.dir = directory
+        self.segment_bytes = _ienv("MEMORY_SEGMENT_BYTES", 64 * 1024 * 1024)
+        self.flush_s = _ienv("MEMORY_FLUSH_MS", 50) / 1000.0
+        self.batch = _ienv("MEMORY_BATCH", 1000)
+        self.index_every = _ienv("MEMORY_INDEX_EVERY", 256)
+        self.max_pending = _ienv("MEMORY_MAX_PENDING", 100000)
+        self.max_segments = _ienv("MEMORY_MAX_SEGMENTS", 0)
+        os.makedirs(directory, exist_ok=True)
+        self._cv = threading.Condition()
+        self._pending: list[tuple[float, dict]] = []
+        self._inflight: list[tuple[float, dict]] = []
+        self._closing = False
+        self._flush_req = 0
+        self.written = 0
+        self._segments = self._open_segments(legacy)
+        self._fh = open(self._segments[-1].path, "ab")
+        self._ih = open(self._segments[-1].idx_path, "ab")
+        self._thread = threading.Thread(target=self._run, name="memory-store", daemon=True)
+        self._thread.start()
+
+    def _open_segments(self, legacy: Optional[str]) -> list[Segment]:
+        nums = sorted(int(m.group(1)) for m in (SEG_RE.search(p) for p in glob.glob(os.path.join(self.dir, "seg-*.jsonl"))) if m)
+        if not nums and legacy and os.path.exists(legacy) and os.path.getsize(legacy):
+            # adopt the old single-file log as the first segment
+            os.replace(legacy, Segment(self.dir, 1).path)
+            nums = [1]
+        segs = []
+        for n in nums:
+            s = Segment(self.dir, n)
+            if n == nums[-1]:
+                self._truncate_partial(s.path)
+            s.load(self.index_every)
+            segs.append(s)
+        if not segs:
+            segs.append(Segment(self.dir, 1))
+            open(segs[0].path, "ab").close()
+        return segs
+
+    @staticmethod
+    def _truncate_partial(path: str):
+        # drop a half-written last line left by a crash
+        size = os.path.getsize(path)
+        if not size:
+            return
+        with open(path, "rb+") as f:
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            pos = size
+            while pos > 0:
+                n = min(BLOCK, pos)
+                pos -= n
+                f.seek(pos)
+                cut = f.read(n).rfind(b"\n")
+                if cut >= 0:
+                    f.truncate(pos + cut + 1)
+                    return
+            f.truncate(0)
+
+    # ----- writes -----
+    def append(self, record: dict):
+        # called from request threads; only blocks if the writer is MEMORY_MAX_PENDING records behind
+        ts = parse_ts(record.get("ts"))
+        with self._cv:
+            if len(self._pending) >= self.max_pending:
+                self._cv.wait_for(lambda: len(self._pending) < self.max_pending or self._closing)
+            self._pending.append((ts, record))
+            if len(self._pending) >= self.batch:
+                self._cv.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        # wait until everything appended so far is on disk
+        with self._cv:
+            self._flush_req += 1
+            self._cv.notify_all()
+            try:
+                return self._cv.wait_for(lambda: not self._pending and not self._inflight, timeout)
+            finally:
+                self._flush_req -= 1
+
+    def close(self):
+        with self._cv:
+            self._closing = True
+            self._cv.notify_all()
+        self._thread.join()
+        self._fh.close()
+        self._ih.close()
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: len(self._pending) >= self.batch or self._closing or self._flush_req,
+                                  self.flush_s)
+                if not self._pending:
+                    if self._closing:
+                        return
+                    continue
+                batch, self._pending = self._pending, []
+                self._inflight = list(batch)   # _commit drops each written prefix from this copy
+                self._cv.notify_all()
+            try:
+                self._write(batch)
+            except Exception as e:
+                print("Memory store write failed:", e)
+            with self._cv:
+                self._inflight = []
+                self._cv.notify_all()
+
+    def _write(self, batch: list[tuple[float, dict]]):
+        seg = self._segments[-1]
+        buf, idx = [], []
+        size, first, last = seg.size, None, None
+        for ts, rec in batch:
+            line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+            if size and size + len(line) > self.segment_bytes:
+                self._commit(seg, buf, idx, size, first, last)
+                seg = self._rotate()
+                buf, idx = [], []
+                size, first, last = 0, None, None
+            ts = ts or 0.0
+            if seg.since_idx >= self.index_every:
+                idx.append((ts, size))
+                seg.since_idx = 0
+            seg.since_idx += 1
+            buf.append(line)
+            size += len(line)
+            first = ts if first is None else first
+            last = ts
+        self._commit(seg, buf, idx, size, first, last)
+
+    def _commit(self, seg: Segment, buf: list[bytes], idx: list[tuple[float, int]], size: int,
+                first: Optional[float], last: Optional[float]):
+        if not buf:
+            return
+        self._fh.write(b"".join(buf))
+        self._fh.flush()
+        if idx:
+            self._ih.write(b"".join(IDX.pack(ts, off) for ts, off in idx))
+            self._ih.flush()
+        with self._cv:
+            for ts, off in idx:
+                seg.idx_ts.append(ts)
+                seg.idx_off.append(off)
+            if seg.first_ts is None:
+                seg.first_ts = first
+            seg.last_ts = last
+            # publish the new size and stop serving these records from memory in one step,
+            # so a query never sees them both in the segment and in _inflight
+            seg.size = size
+            del self._inflight[:len(buf)]
+            self.written += len(buf)
+
+    def _rotate(self) -> Segment:
+        self._fh.close()
+        self._ih.close()
+        seg = Segment(self.dir, self._segments[-1].num + 1)
+        self._fh = open(seg.path, "ab")
+        self._ih = open(seg.idx_path, "ab")
+        with self._cv:
+            self._segments.append(seg)
+            drop = self._segments[:-self.max_segments] if self.max_segments > 0 else []
+            del self._segments[:len(drop)]
+        for old in drop:
+            for p in (old.path, old.idx_path):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+        return seg
+
+    # ----- reads -----
+    def query(self, limit: int = 100, type: Optional[str] = None, since=None, until=None) -> list[dict]:
+        # newest `limit` records matching type/time range, returned oldest first
+        since, until = parse_ts(since), parse_ts(until)
+        if limit <= 0:
+            return []
+        with self._cv:
+            segs = [(s, s.size) for s in self._segments]
+            mem = self._inflight + self._pending
+        out: list[dict] = []
+
+        def take(ts: Optional[float], rec: dict) -> Optional[bool]:
+            # True = keep scanning, False = everything older is out of range too
+            if since is not None and ts is not None and ts < since:
+                return False
+            if until is not None and ts is not None and ts > until:
+                return True
+            if type is None or rec.get("type") == type:
+                out.append(rec)
+            return len(out) < limit
+
+        for ts, rec in reversed(mem):
+            if not take(ts, rec):
+                out.reverse()
+                return out
+        # records are written with json.dumps defaults, so a type match must contain this
+        needle = b'"type": ' + json.dumps(type, ensure_ascii=False).encode("utf-8") if type is not None else None
+        for seg, size in reversed(segs):
+            if since is not None and seg.last_ts is not None and seg.last_ts < since:
+                break
+            if until is not None and seg.first_ts is not None and seg.first_ts > until:
+                continue
+            end = size if until is None else seg.end_before(until, size)
+            try:
+                for line in _reverse_lines(seg.path, end):
+                    if needle and needle not in line:
+                        continue
+                    rec = json.loads(line)
+                    if not take(parse_ts(rec.get("ts")), rec):
+                        out.reverse()
+                        return out
+            except FileNotFoundError:
+                continue  # removed by retention while we were reading
+        out.reverse()
+        return out
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {"segments": len(self._segments), "bytes": sum(s.size for s in self._segments),
+                    "pending": len(self._pending) + len(self._inflight), "written": self.written}
@@ -0,0 +1,244 @@
+import os, re, json, time, asyncio, hashlib, tempfile, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional
+from fastapi import HTTPException
+
+# ---------- Reports ----------
+# HTML (Jinja2, autoescaped) and PDF (reportlab) reports are rendered in a process
+# pool so a heavy render never blocks the event loop. A report's id is the hash of
+# its kind + content, so an identical request reuses the finished file (or joins the
+# render already running). At most REPORT_MAX_CONCURRENCY renders run at once, and
+# REPORT_MAX_QUEUE more may wait; beyond that submissions get 503. Rendered files
+# live for REPORT_JOB_TTL_S after they were last rendered or reused; the same sweep that
+# forgets old jobs deletes them (and leftover .part files), at most once a minute.
+#   REPORT_WORKERS=2   REPORT_MAX_CONCURRENCY=2   REPORT_MAX_QUEUE=32   REPORT_JOB_TTL_S=3600
+# Workers are spawned, not forked, so they never inherit a lock held by another thread
+# (the memory store writer, the thread pool). PDF text is shaped with arabic_reshaper +
+# python-bidi and set in a TTF that covers Arabic: REPORT_PDF_FONT=<file.ttf>, otherwise
+# the first of PDF_FONTS that exists (reportlab's built-in fonts have no Arabic glyphs).
+
+ID_RE = re.compile(r"^[0-9a-f]{32}$")
+KINDS = {"html": "text/html; charset=utf-8", "pdf": "application/pdf"}
+FILE_RE = re.compile(r"^[0-9a-f]{32}\.(?:html|pdf)$|\.part$")
+SWEEP_EVERY_S = 60.0
+PDF_FONTS = (
+    "/usr/share/fonts/truetype/noto/NotoNaskhArabic-Regular.ttf",
+    "/usr/share/fonts/opentype/noto/NotoNaskhArabic-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+    "C:\\Windows\\Fonts\\tahoma.ttf",
+)
+RTL_RE = re.compile("[\u0590-\u08ff\ufb1d-\ufdff\ufe70-\ufefc]")
+
+HTML_TEMPLATE = """<!doctype html>
+<html lang="ar" dir="auto"><head><meta charset="utf-8"><title>{{ title }}</title>
+<style>body{font-family:system-ui,sans-serif;margin:2rem}h1{font-size:1.6rem}li{margin:.25rem 0}
+.meta{color:#666;font-size:.85rem}</style></head>
+<body><h1>{{ title }}</h1><p class="meta">{{ generated }}</p>
+<ul>{% for x in items %}<li>{{ x }}</li>{% endfor %}</ul></body></html>
+"""
+
+def _render_html(title: str, items: list[str], generated: str) -> bytes:
+    from jinja2 import Environment
+    env = Environment(autoescape=True)
+    return env.from_string(HTML_TEMPLATE).render(title=title, items=items, generated=generated).encode("utf-8")
+
+@lru_cache(maxsize=1)
+def _pdf_font() -> str:
+    # registers the configured / first available TTF once per worker process
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    for path in filter(None, (os.getenv("REPORT_PDF_FONT"),) + PDF_FONTS):
+        if os.path.exists(path):
+            pdfmetrics.registerFont(TTFont("ReportFont", path))
+            return "ReportFont"
+    print("No TTF with Arabic glyphs found (set REPORT_PDF_FONT); Arabic PDF text will not render")
+    return "Helvetica"
+
+def _visual(text: str) -> str:
+    # joined Arabic letter forms in display (right-to-left) order; other text is left alone
+    if not RTL_RE.search(text):
+        return text
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+    return get_display(arabic_reshaper.reshape(text))
+
+def _render_pdf(title: str, items: list[str], generated: str) -> bytes:
+    import io
+    from xml.sax.saxutils import escape
+    from reportlab.lib.enums import TA_LEFT, TA_RIGHT
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, ListFlowable, ListItem, Spacer
+    styles = getSampleStyleSheet()
+    font = _pdf_font()
+    for name in ("Title", "Normal"):
+        styles[name].fontName = font
+
+    def para(text: str, style: str) -> Paragraph:
+        # shape first, then escape: Paragraph text is reportlab markup, so user text must be escaped
+        rtl = bool(RTL_RE.search(text))
+        st = styles[style].clone(f"{style}-{'rtl' if rtl else 'ltr'}")
+        if style != "Title":
+            st.alignment = TA_RIGHT if rtl else TA_LEFT
+        return Paragraph(escape(_visual(text)), st)
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, title=title)
+    story = [para(title, "Title"), para(generated, "Normal"), Spacer(1, 12),
+             ListFlowable([ListItem(para(x, "Normal")) for x in items], bulletType="bullet", bulletFontName=font)]
+    doc.build(story)
+    return buf.getvalue()
+
+def render_to_file(kind: str, title: str, items: list[str], generated: str, path: str) -> int:
+    # runs in a worker process; writes tmp + rename so readers never see half a file
+    data = (_render_pdf if kind == "pdf" else _render_html)(title, items, generated)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data)
+
+def report_id(kind: str, title: str, items: list[str]) -> str:
+    raw = json.dumps([kind, title, items], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+class Job:
+    __slots__ = ("id", "kind", "status", "error", "created", "finished", "task")
+
+    def __init__(self, id: str, kind: str):
+        self.id = id
+        self.kind = kind
+        self.status = "queued"   # queued -> running -> done | error
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+class ReportService:
+    def __init__(self, directory: str):
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+        self.workers = int(os.getenv("REPORT_WORKERS", "") or 2)
+        self.max_concurrency = int(os.getenv("REPORT_MAX_CONCURRENCY", "") or self.workers)
+        self.max_queue = int(os.getenv("REPORT_MAX_QUEUE", "") or 32)
+        self.job_ttl = float(os.getenv("REPORT_JOB_TTL_S", "") or 3600)
+        self.jobs: dict[str, Job] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.rendered = self.cache_hits = self.files_expired = 0
+        self._swept = 0.0
+
+    def path(self, id: str, kind: str) -> str:
+        return os.path.join(self.dir, f"{id}.{kind}")
+
+    def _pending(self) -> int:
+        return sum(1 for j in self.jobs.values() if j.status in ("queued", "running"))
+
+    def _expire(self):
+        now = time.time()
+        cutoff = now - self.job_ttl
+        for id in [id for id, j in self.jobs.items() if j.finished and j.finished < cutoff]:
+            del self.jobs[id]
+        if now - self._swept >= min(SWEEP_EVERY_S, self.job_ttl):
+            self._swept = now
+            self._expire_files(cutoff)
+
+    def _expire_files(self, cutoff: float):
+        try:
+            entries = list(os.scandir(self.dir))
+        except OSError:
+            return
+        for e in entries:
+            if not FILE_RE.search(e.name) or e.name[:32] in self.jobs:
+                continue  # not ours, or a job still in the table points at it
+            try:
+                if e.stat().st_mtime < cutoff:
+                    os.remove(e.path)
+                    self.files_expired += 1
+            except OSError:
+                pass  # removed concurrently, or still open on Windows; next sweep
+
+    def submit(self, kind: str, title: str, items: list[str]) -> tuple[Job, bool]:
+        # -> (job, served from cache)
+        if kind not in KINDS:
+            raise HTTPException(400, "format must be html or pdf")
+        id = report_id(kind, title, items)
+        job = self.jobs.get(id)
+        if job and job.status != "error":
+            return job, job.status == "done"
+        self._expire()
+        if os.path.exists(self.path(id, kind)):
+            try:
+                os.utime(self.path(id, kind))   # reused: keep it another REPORT_JOB_TTL_S
+            except OSError:
+                pass
+            self.cache_hits += 1
+            job = self.jobs[id] = Job(id, kind)
+            job.status, job.finished = "done", time.time()
+            return job, True
+        if self._pending() >= self.max_concurrency + self.max_queue:
+            raise HTTPException(503, "report queue is full, try again later", headers={"Retry-After": "5"})
+        job = self.jobs[id] = Job(id, kind)
+        job.task = asyncio.get_running_loop().create_task(self._run(job, title, items))
+        return job, False
+
+    async def start(self):
+        # start the workers at startup rather than inside the first report request
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self._pool, time.sleep, 0.05) for _ in range(self.workers)))
+
+    async def _run(self, job: Job, title: str, items: list[str]):
+        await self.start()
+        generated = time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime())
+        try:
+            async with self._sem:
+                job.status = "running"
+                await asyncio.get_running_loop().run_in_executor(
+                    self._pool, render_to_file, job.kind, title, items, generated, self.path(job.id, job.kind))
+            job.status = "done"
+            self.rendered += 1
+        except Exception as e:
+            job.status, job.error = "error", f"{type(e).__name__}: {e}"
+        finally:
+            job.finished = time.time()
+            job.task = None
+
+    async def wait(self, job: Job) -> Job:
+        if job.task is not None:
+            await asyncio.shield(job.task)
+        return job
+
+    def get(self, id: str) -> Optional[Job]:
+        if not ID_RE.match(id):
+            return None
+        job = self.jobs.get(id)
+        if job is None:
+            # finished before a restart or expired from the job table: the file is the record,
+            # until it is older than REPORT_JOB_TTL_S (the sweep may not have reached it yet)
+            cutoff = time.time() - self.job_ttl
+            for kind in KINDS:
+                try:
+                    fresh = os.path.getmtime(self.path(id, kind)) >= cutoff
+                except OSError:
+                    continue
+                if fresh:
+                    job = Job(id, kind)
+                    job.status, job.finished = "done", time.time()
+                    break
+        return job
+
+    def info(self, job: Job) -> dict:
+        return {"id": job.id, "format": job.kind, "status": job.status, "error": job.error,
+                "created": job.created, "finished": job.finished}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,152 @@
+import os, re, math, threading, zlib
+from array import array
+from typing import Optional
+import numpy as np
+from intent import normalize
+
+# ---------- Local retrieval ----------
+# Offline BM25 over past asks and uploaded text. Terms (normalized words, Arabic
+# article stripped) are hashed to ints; each term keeps one compact int array of
+# (doc, tf) pairs that grows as documents are added, so indexing is incremental and
+# a query only touches the postings of its own terms.
+#   RETRIEVAL_MAX_DOCS=100000   RETRIEVAL_MAX_UPLOAD_BYTES=1048576
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+K1, B = 1.2, 0.75
+
+AR_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+def _stem(w: str) -> str:
+    # drop the Arabic article / attached preposition so "للحديد" and "الحديد" match "حديد"
+    for p in AR_PREFIXES:
+        if w.startswith(p) and len(w) - len(p) >= 3:
+            return w[len(p):]
+    return w
+
+def terms(text: str) -> list[int]:
+    return [zlib.crc32(_stem(w).encode("utf-8")) for w in WORD_RE.findall(normalize(text)) if len(w) > 1 or not w.isascii()]
+
+def chunks(text: str, size: int = 800) -> list[str]:
+    # paragraph-ish passages of about `size` characters
+    out, cur = [], ""
+    for para in re.split(r"\n\s*\n", text):
+        para = para.strip()
+        if not para:
+            continue
+        if cur and len(cur) + len(para) > size:
+            out.append(cur)
+            cur = ""
+        cur = (cur + "\n\n" + para) if cur else para
+        while len(cur) > size * 2:
+            out.append(cur[:size])
+            cur = cur[size:]
+    if cur:
+        out.append(cur)
+    return out
+
+class RetrievalIndex:
+    def __init__(self):
+        self.max_docs = int(os.getenv("RETRIEVAL_MAX_DOCS", "") or 100_000)
+        self.max_upload_bytes = int(os.getenv("RETRIEVAL_MAX_UPLOAD_BYTES", "") or 1024 * 1024)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.postings: dict[int, array] = {}   # term -> [doc, tf, doc, tf, ...]
+        self.texts: list[str] = []
+        self.meta: list[dict] = []
+        self.lengths = array("f")
+        self.total_len = 0.0
+
+    def add(self, text: str, meta: Optional[dict] = None):
+        counts = self._counts(text)
+        if counts:
+            with self._lock:
+                if len(self.texts) >= self.max_docs + self.max_docs // 4:
+                    self._compact()
+                self._insert(text, meta or {}, counts)
+
+    @staticmethod
+    def _counts(text: str) -> dict[int, int]:
+        counts: dict[int, int] = {}
+        for h in terms(text):
+            counts[h] = counts.get(h, 0) + 1
+        return counts
+
+    def _insert(self, text: str, meta: dict, counts: dict[int, int]):
+        # texts/meta go last and a failure is undone, so texts, meta, lengths and the
+        # postings always describe the same documents
+        doc = len(self.texts)
+        size = sum(counts.values())
+        try:
+            self.lengths.append(size)
+            for h, c in counts.items():
+                p = self.postings.get(h)
+                if p is None:
+                    p = self.postings[h] = array("i")
+                p.append(doc)
+                p.append(c)
+            self.texts.append(text)
+            self.meta.append(meta)
+        except BaseException:
+            self._undo(doc, counts)
+            raise
+        self.total_len += size
+
+    def _undo(self, doc: int, counts: dict[int, int]):
+        del self.texts[doc:], self.meta[doc:], self.lengths[doc:]
+        for h in counts:
+            p = self.postings.get(h)
+            if p is None:
+                continue
+            if len(p) % 2:
+                del p[-1]
+            if len(p) >= 2 and p[-2] == doc:
+                del p[-2:]
+            if not p:
+                del self.postings[h]
+
+    def _compact(self):
+        # keep the newest max_docs documents; runs once per max_docs/4 adds
+        keep = list(zip(self.texts, self.meta))[-self.max_docs:]
+        self._reset()
+        for text, meta in keep:
+            self._insert(text, meta, self._counts(text))
+
+    def search(self, query: str, k: int = 5) -> list[dict]:
+        q = set(terms(query))
+        with self._lock:
+            n = len(self.texts)
+            if not n or not q:
+                return []
+            avg = self.total_len / n
+            # copies only: a numpy view of an array("i"/"f") that outlives the lock makes the
+            # next add() fail with BufferError (arrays cannot grow while exporting a buffer)
+            found = [np.array(p, dtype=np.int32) for p in (self.postings.get(h) for h in q) if p is not None]
+            if not found:
+                return []
+            lengths = np.frombuffer(self.lengths, dtype=np.float32, count=n)
+            try:
+                doc_lens = [lengths[pairs[0::2]] for pairs in found]
+            finally:
+                del lengths
+            # doc ids stay valid in these lists: add() only appends, _compact() swaps in new ones
+            texts, meta = self.texts, self.meta
+        ids, weights = [], []
+        for pairs, dl in zip(found, doc_lens):
+            docs, tf = pairs[0::2], pairs[1::2].astype(np.float32)
+            df = len(docs)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            ids.append(docs)
+            weights.append(idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / avg)))
+        ids = np.concatenate(ids)
+        uniq, inv = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inv, weights=np.concatenate(weights))
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [{"text": texts[d], "score": round(float(scores[i]), 4), **meta[d]}
+                for i, d in ((i, int(uniq[i])) for i in top)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"docs": len(self.texts), "terms": len(self.postings)}
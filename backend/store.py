@@ -0,0 +1,124 @@
+import os, copy, json, hashlib, tempfile, threading
+from typing import Any, Callable, Optional
+
+# ---------- JSON file store ----------
+# Keeps a JSON file (settings.json, catalog.json) parsed in memory. Each read does one
+# os.stat and re-parses only when mtime/size changed, i.e. the file was edited outside
+# the app. Updates run under a lock on a copy of the current state and are written
+# atomically (temp file + fsync + rename). Updates that arrive while a write is in
+# flight are folded into the next single write (group commit). An update that changes
+# nothing is not written. If a write fails, every change not yet on disk is dropped
+# and the file is read again, so a failed write never pins stale state in memory.
+
+def _stamp(path: str) -> Optional[tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def atomic_write_json(path: str, data: Any):
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match: comma-separated entity tags or "*", weak ones compared by their opaque value
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+class JsonStore:
+    def __init__(self, path: str, default: Any = None):
+        self.path = path
+        self.default = default
+        self._lock = threading.Lock()        # guards the in-memory state
+        self._write_lock = threading.Lock()  # one disk write at a time
+        self._data: Any = None
+        self._stamp: Optional[tuple[int, int]] = None
+        self._loaded = False
+        self._body: Optional[tuple[bytes, str]] = None
+        self._version = 0   # bumped on every in-memory change
+        self._durable = 0   # last version known to be on disk
+        self._lost = 0      # versions up to this one were dropped by a failed write
+        self.reloads = self.writes = 0
+
+    def _refresh(self):
+        # caller holds _lock; never reload over changes that are not on disk yet
+        if self._loaded and self._version != self._durable:
+            return
+        st = _stamp(self.path)
+        if self._loaded and st == self._stamp:
+            return
+        if st is None:
+            data = copy.deepcopy(self.default)
+        else:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        self._data, self._stamp, self._body, self._loaded = data, st, None, True
+        self.reloads += 1
+
+    def get(self) -> Any:
+        # shared snapshot: treat as read-only, change it through update()
+        with self._lock:
+            self._refresh()
+            return self._data
+
+    def body(self) -> tuple[bytes, str]:
+        # compact JSON bytes + strong ETag, serialized once per version
+        with self._lock:
+            self._refresh()
+            if self._body is None:
+                raw = json.dumps(self._data, ensure_ascii=False).encode("utf-8")
+                self._body = (raw, '"%s"' % hashlib.sha1(raw).hexdigest()[:20])
+            return self._body
+
+    def update(self, fn: Callable[[Any], Any]) -> Any:
+        # fn(state) mutates a private copy and returns the caller's result; the copy
+        # becomes the current state and is on disk when update() returns
+        with self._lock:
+            self._refresh()
+            data = copy.deepcopy(self._data)
+            result = fn(data)
+            if data == self._data:
+                if self._version == self._durable:
+                    return result
+                mine = self._version   # no change of ours, but wait for the state we saw
+            else:
+                self._data, self._body = data, None
+                self._version += 1
+                mine = self._version
+        self._persist(mine)
+        return result
+
+    def _persist(self, version: int):
+        with self._write_lock:
+            if version <= self._lost:
+                raise OSError(f"{self.path}: an earlier write failed, update discarded")
+            if self._durable >= version:
+                return  # an earlier writer already saved a state that includes ours
+            with self._lock:
+                data, version = self._data, self._version
+            try:
+                atomic_write_json(self.path, data)
+            except BaseException:
+                with self._lock:
+                    # back to what is on disk; updates queued behind this write fail too
+                    self._lost = self._durable = self._version
+                    self._loaded, self._body = False, None
+                raise
+            with self._lock:
+                self._durable, self._stamp = version, _stamp(self.path)
+                self.writes += 1
@@ -0,0 +1,4 @@
+import os, sys
+
+# backend modules are imported flat (as app.py does): python -m pytest backend/tests
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,54 @@
+import os, hashlib
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from blobs import BlobStore
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("UPLOAD_MAX_BYTES", "100000")
+    monkeypatch.setenv("UPLOAD_CHUNK_BYTES", "4096")
+    store = BlobStore(str(tmp_path / "blobs"))
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        return await store.save(request)
+
+    with TestClient(app) as c:
+        c.store = store
+        yield c
+    store.close()
+
+def test_upload_is_hashed_and_deduplicated(client):
+    data = b"line of text\n" * 5000
+    r = client.post("/upload", data={"note": "x"}, files={"file": ("../a b.txt", data, "text/plain")})
+    assert r.status_code == 200, r.text
+    meta = r.json()
+    assert meta["sha256"] == hashlib.sha256(data).hexdigest()
+    assert meta["size"] == len(data) and meta["filename"] == "a_b.txt" and meta["content_type"] == "text/plain"
+    assert not meta["duplicate"]
+    with open(client.store.path(meta["sha256"]), "rb") as f:
+        assert f.read() == data
+    again = client.post("/upload", files={"file": ("b.txt", data, "text/plain")}).json()
+    assert again["duplicate"] and again["sha256"] == meta["sha256"]
+
+def test_content_length_over_limit_is_rejected_up_front(client):
+    r = client.post("/upload", content=b"", headers={"Content-Type": "multipart/form-data; boundary=x",
+                                                     "Content-Length": "10000000"})
+    assert r.status_code == 413
+
+def test_limit_is_enforced_while_streaming(client):
+    def body():
+        # chunked: no Content-Length, so only the streaming check can stop it
+        yield b'--x\r\nContent-Disposition: form-data; name="file"; filename="big.bin"\r\n\r\n'
+        for _ in range(50):
+            yield b"0" * 8192
+        yield b"\r\n--x--\r\n"
+    r = client.post("/upload", content=body(), headers={"Content-Type": "multipart/form-data; boundary=x"})
+    assert r.status_code == 413
+    assert client.store.list() == [] and os.listdir(client.store.tmp) == []
+
+def test_missing_file_part(client):
+    r = client.post("/upload", data={"other": "value"}, files={"doc": ("a.txt", b"abc", "text/plain")})
+    assert r.status_code == 400
@@ -0,0 +1,33 @@
+import json, os
+import pytest
+from intent import IntentRouter
+
+with open(os.path.join(os.path.dirname(__file__), "..", "catalog.json"), encoding="utf-8") as f:
+    CATALOG = json.load(f)
+
+@pytest.fixture
+def router():
+    return IntentRouter()
+
+@pytest.mark.parametrize("text, intent", [
+    ("what is the SPI this month?", "evm"),
+    ("compute eac and cpi", "evm"),
+    ("generate the IFRS 15 schedule", "ifrs15"),
+    ("احسب مؤشر الأداء للمشروع", "evm"),
+    ("طلب شراء حديد تسليح", "procure"),
+    ("والتقرير الشهري", "reports"),
+    ("ask the ai", "ai"),
+    ("(spi)", "evm"),
+])
+def test_routes(router, text, intent):
+    assert router.route(text, CATALOG) == intent
+
+@pytest.mark.parametrize("text", [
+    "I need each contract listed",        # eac
+    "spin up a server",                   # spi
+    "what did you say about aim",         # ai
+    "she said hello",                     # ai on the left
+    "hello there",
+])
+def test_partial_latin_words_do_not_route(router, text):
+    assert router.route(text, CATALOG) is None
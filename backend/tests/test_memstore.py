@@ -0,0 +1,39 @@
+from memstore import MemoryStore
+
+def _store(tmp_path, monkeypatch, **env):
+    for k, v in {"MEMORY_FLUSH_MS": "10", "MEMORY_BATCH": "50", **env}.items():
+        monkeypatch.setenv(k, v)
+    return MemoryStore(str(tmp_path / "memory"))
+
+def test_query_returns_appended_records_once(tmp_path, monkeypatch):
+    store = _store(tmp_path, monkeypatch)
+    try:
+        for i in range(120):
+            store.append({"ts": 1_800_000_000 + i, "type": "ask", "n": i})
+        assert store.flush(5)
+        assert [r["n"] for r in store.query(limit=1000)] == list(range(120))
+        assert [r["n"] for r in store.query(limit=5, type="ask")] == list(range(115, 120))
+    finally:
+        store.close()
+
+def test_no_duplicates_right_after_a_commit(tmp_path, monkeypatch):
+    # query from the writer thread between _commit and the end of the batch: records that
+    # just reached the segment must no longer be served from the in-flight batch too
+    store = _store(tmp_path, monkeypatch, MEMORY_SEGMENT_BYTES="2000")   # several commits per batch
+    seen: list[list[int]] = []
+    commit = store._commit
+
+    def checked(*args):
+        commit(*args)
+        seen.append([r["n"] for r in store.query(limit=1000)])
+    store._commit = checked
+    try:
+        for i in range(200):
+            store.append({"ts": 1_800_000_000 + i, "type": "ask", "n": i})
+        assert store.flush(5)
+        assert len(seen) > 1
+        for ns in seen:
+            assert len(ns) == len(set(ns))
+        assert [r["n"] for r in store.query(limit=1000)] == list(range(200))
+    finally:
+        store.close()
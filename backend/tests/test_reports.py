@@ -0,0 +1,77 @@
+import os, asyncio
+import pytest
+import reports
+from reports import ReportService, _visual, _render_pdf
+
+DEJAVU = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+def test_arabic_is_shaped_and_reordered():
+    out = _visual("تقرير المشروع")
+    # joined presentation forms, last word first in display order
+    assert all("ﹰ" <= ch <= "ﻼ" or ch == " " for ch in out)
+    assert out != "تقرير المشروع"[::-1]
+    assert _visual("Report 2024 & <b>") == "Report 2024 & <b>"
+
+@pytest.mark.skipif(not os.path.exists(DEJAVU), reason="no DejaVu font on this host")
+def test_pdf_embeds_a_unicode_font(monkeypatch):
+    monkeypatch.setenv("REPORT_PDF_FONT", DEJAVU)
+    reports._pdf_font.cache_clear()
+    try:
+        pdf = _render_pdf("تقرير المشروع", ["بند أول", "Second & <item>"], "2024-05-01 10:00 UTC")
+    finally:
+        reports._pdf_font.cache_clear()
+    assert pdf.startswith(b"%PDF") and b"DejaVuSans" in pdf
+
+def test_service_renders_pdf_in_spawned_workers(tmp_path, monkeypatch):
+    monkeypatch.setenv("REPORT_WORKERS", "1")
+
+    async def run():
+        svc = ReportService(str(tmp_path))
+        try:
+            job, cached = svc.submit("pdf", "تقرير", ["بند"])
+            assert not cached
+            await svc.wait(job)
+            assert svc._pool._mp_context.get_start_method() == "spawn"
+            return job, svc.path(job.id, "pdf")
+        finally:
+            svc.close()
+    job, path = asyncio.run(run())
+    assert job.status == "done", job.error
+    with open(path, "rb") as f:
+        assert f.read(4) == b"%PDF"
+
+def test_rendered_files_expire_with_the_job_ttl(tmp_path, monkeypatch):
+    monkeypatch.setenv("REPORT_JOB_TTL_S", "600")
+    svc = ReportService(str(tmp_path))
+    old, fresh = reports.report_id("html", "old", []), reports.report_id("pdf", "fresh", [])
+    for id, kind in ((old, "html"), (fresh, "pdf")):
+        with open(svc.path(id, kind), "wb") as f:
+            f.write(b"x")
+    stale_part = tmp_path / "tmpabc.part"
+    stale_part.write_bytes(b"half")
+    other = tmp_path / "notes.txt"
+    other.write_text("not a report")
+    hour_ago = reports.time.time() - 3600
+    for p in (svc.path(old, "html"), stale_part, other):
+        os.utime(p, (hour_ago, hour_ago))
+    assert svc.get(old) is None              # past the TTL even before the sweep runs
+    assert svc.get(fresh).status == "done"
+    svc._expire()
+    assert sorted(os.listdir(tmp_path)) == sorted([f"{fresh}.pdf", "notes.txt"])
+    assert svc.files_expired == 2
+
+def test_reused_file_is_kept_and_sweep_is_throttled(tmp_path, monkeypatch):
+    monkeypatch.setenv("REPORT_JOB_TTL_S", "600")
+    svc = ReportService(str(tmp_path))
+    id = reports.report_id("html", "t", ["a"])
+    path = svc.path(id, "html")
+    with open(path, "wb") as f:
+        f.write(b"x")
+    hour_ago = reports.time.time() - 3600
+    os.utime(path, (hour_ago, hour_ago))
+    svc._swept = reports.time.time()        # swept moments ago: no directory scan yet
+    job, cached = svc.submit("html", "t", ["a"])
+    assert cached and os.path.getmtime(path) > hour_ago + 3000
+    svc._swept = 0.0
+    svc._expire()
+    assert os.path.exists(path) and svc.files_expired == 0
@@ -0,0 +1,85 @@
+import sys, threading
+from array import array
+import pytest
+from retrieval import RetrievalIndex, terms
+
+def test_search_ranks_matching_documents():
+    idx = RetrievalIndex()
+    idx.add("steel rebar price per ton", {"id": 1})
+    idx.add("concrete mix design", {"id": 2})
+    idx.add("سعر حديد التسليح للطن", {"id": 3})
+    assert [r["id"] for r in idx.search("steel price")] == [1]
+    assert [r["id"] for r in idx.search("الحديد")] == [3]
+    assert idx.search("nothing here") == []
+
+def test_failed_insert_is_rolled_back():
+    idx = RetrievalIndex()
+    idx.add("alpha beta", {"id": 1})
+
+    class Full(array):
+        def append(self, v):
+            raise MemoryError
+    idx.postings[terms("gamma")[0]] = Full("i")
+    with pytest.raises(MemoryError):
+        idx.add("delta gamma", {"id": 2})
+    assert len(idx.texts) == len(idx.meta) == len(idx.lengths) == 1
+    assert terms("delta")[0] not in idx.postings
+    idx.postings.pop(terms("gamma")[0], None)
+    idx.add("delta epsilon", {"id": 3})
+    assert [r["id"] for r in idx.search("delta")] == [3]
+    assert [r["id"] for r in idx.search("alpha")] == [1]
+
+def test_concurrent_add_and_search():
+    old = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    idx = RetrievalIndex()
+    errors: list[BaseException] = []
+    stop = threading.Event()
+
+    def adder(w):
+        try:
+            for i in range(1500):
+                idx.add(f"steel price {w} {i} rebar", {"w": w})
+        except BaseException as e:
+            errors.append(e)
+
+    def searcher():
+        try:
+            while not stop.is_set():
+                idx.search("steel rebar price", k=3)
+        except BaseException as e:
+            errors.append(e)
+    try:
+        adders = [threading.Thread(target=adder, args=(w,)) for w in range(4)]
+        searchers = [threading.Thread(target=searcher) for _ in range(4)]
+        for th in adders + searchers:
+            th.start()
+        for th in adders:
+            th.join()
+        stop.set()
+        for th in searchers:
+            th.join()
+    finally:
+        sys.setswitchinterval(old)
+    assert errors == []
+    assert len(idx.texts) == len(idx.meta) == len(idx.lengths) == 6000
+    assert len(idx.search("rebar", k=10)) == 10
+
+def test_add_can_run_while_a_search_is_scoring(monkeypatch):
+    # scoring happens after the lock is released and with no views of the index arrays left,
+    # so an add() from another thread at that point neither blocks nor hits BufferError
+    import retrieval
+    idx = RetrievalIndex()
+    for i in range(50):
+        idx.add(f"steel rebar lot {i}", {"id": i})
+    unique = retrieval.np.unique
+    added: list = []
+
+    def unique_and_add(*a, **k):
+        th = threading.Thread(target=lambda: added.append(idx.add("steel rebar extra", {"id": "x"}) or "ok"))
+        th.start()
+        th.join(2)
+        return unique(*a, **k)
+    monkeypatch.setattr(retrieval.np, "unique", unique_and_add)
+    assert len(idx.search("steel rebar", k=3)) == 3
+    assert added == ["ok"] and len(idx.lengths) == len(idx.texts) == 51
@@ -0,0 +1,42 @@
+import json
+import pytest
+import store
+from store import JsonStore, etag_matches
+
+def test_noop_update_is_not_written(tmp_path):
+    s = JsonStore(str(tmp_path / "catalog.json"), default=[])
+    s.update(lambda cats: cats.append({"key": "evm"}))
+    assert s.writes == 1
+    exists = s.update(lambda cats: any(c["key"] == "evm" for c in cats))
+    assert exists and s.writes == 1
+
+def test_failed_write_drops_the_change_and_keeps_reloading(tmp_path, monkeypatch):
+    path = tmp_path / "settings.json"
+    s = JsonStore(str(path), default={})
+    s.update(lambda st: st.update(a=1))
+
+    def fail(*a):
+        raise OSError("disk full")
+    monkeypatch.setattr(store, "atomic_write_json", fail)
+    with pytest.raises(OSError):
+        s.update(lambda st: st.update(b=2))
+    assert s.get() == {"a": 1}
+    monkeypatch.undo()
+    # edits made outside the app are picked up again
+    path.write_text(json.dumps({"a": 1, "c": 3}))
+    assert s.get() == {"a": 1, "c": 3}
+    s.update(lambda st: st.update(d=4))
+    assert json.loads(path.read_text()) == {"a": 1, "c": 3, "d": 4}
+
+@pytest.mark.parametrize("header,match", [
+    ('"abc"', True),
+    ('"x", "abc"', True),
+    ('W/"abc"', True),
+    ("*", True),
+    ('"abcd"', False),
+    ('"ab"', False),
+    ('"xabc", "abcx"', False),
+    ("", False),
+])
+def test_if_none_match(header, match):
+    assert etag_matches(header, '"abc"') is match
@@ -0,0 +1,20 @@
+import pandas as pd
+import tools_batch
+
+def test_ifrs15_schedule_periods():
+    df = pd.DataFrame({"id": ["a", "b"], "contract_value": [1200, 300], "months": [12, 3],
+                       "start": ["2026-11-01", "2026-01-15"]})
+    out = tools_batch.ifrs15(df)
+    assert len(out) == 15
+    a = out[out["id"] == "a"]
+    assert list(a["period"][:3]) == ["2026-11", "2026-12", "2027-01"]
+    assert a["recognition"].iloc[0] == 100.0 and a["cumulative"].iloc[-1] == 1200.0
+    assert list(out[out["id"] == "b"]["period"]) == ["2026-01", "2026-02", "2026-03"]
+
+def test_ifrs15_bad_or_missing_start_gives_null_period():
+    df = pd.DataFrame({"id": [1, 2, 3], "contract_value": [600, 600, 600], "months": [2, 2, 2],
+                       "start": ["bad", None, "2026-03-01"]})
+    out = tools_batch.ifrs15(df)
+    assert out["period"][:4].isna().all()
+    assert list(out["period"][4:]) == ["2026-03", "2026-04"]
+    assert "1431657735" not in out.to_csv(index=False)
@@ -0,0 +1,113 @@
+import io, os, json
+from typing import Iterator, Optional
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+
+# ---------- Batch tools (EVM / IFRS-15) ----------
+# Columnar versions of run_evm / run_ifrs15 for whole portfolios in one call.
+# Input: CSV, JSON (list of rows or {column: [values]}), NDJSON, or Parquet (needs pyarrow).
+# Output is streamed as CSV or NDJSON in BATCH_CHUNK_ROWS slices.
+#   BATCH_MAX_ROWS=1000000   BATCH_MAX_SCHEDULE_ROWS=20000000   BATCH_CHUNK_ROWS=20000
+
+MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "") or 1_000_000)
+MAX_SCHEDULE_ROWS = int(os.getenv("BATCH_MAX_SCHEDULE_ROWS", "") or 20_000_000)
+CHUNK_ROWS = int(os.getenv("BATCH_CHUNK_ROWS", "") or 20_000)
+
+MEDIA = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+def input_format(content_type: str, override: Optional[str] = None) -> str:
+    if override:
+        return override.lower()
+    ct = (content_type or "").split(";")[0].strip().lower()
+    if ct in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+        return "ndjson"
+    if ct.endswith("json"):
+        return "json"
+    if "parquet" in ct:
+        return "parquet"
+    return "csv"
+
+def read_table(body: bytes, fmt: str) -> pd.DataFrame:
+    try:
+        if fmt == "csv":
+            df = pd.read_csv(io.BytesIO(body))
+        elif fmt == "ndjson":
+            df = pd.read_json(io.BytesIO(body), lines=True)
+        elif fmt == "json":
+            data = json.loads(body)
+            df = pd.DataFrame(data.get("rows", data) if isinstance(data, dict) and "rows" in data else data)
+        elif fmt == "parquet":
+            df = pd.read_parquet(io.BytesIO(body))
+        else:
+            raise HTTPException(415, f"unsupported input format: {fmt}")
+    except ImportError:
+        raise HTTPException(415, "parquet input needs pyarrow installed")
+    except (ValueError, pd.errors.ParserError) as e:
+        raise HTTPException(400, f"could not parse {fmt} input: {e}")
+    if len(df) > MAX_ROWS:
+        raise HTTPException(413, f"more than {MAX_ROWS} rows")
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df
+
+def _num(df: pd.DataFrame, col: str, default: float = 0.0) -> np.ndarray:
+    if col not in df:
+        return np.full(len(df), default, dtype=np.float64)
+    return pd.to_numeric(df[col], errors="coerce").fillna(default).to_numpy(dtype=np.float64)
+
+def _ratio(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # a / b, NaN (null in the output) where b == 0, same as the per-row tool's None
+    out = np.full(a.shape, np.nan)
+    np.divide(a, b, out=out, where=b != 0)
+    return out
+
+def _ids(df: pd.DataFrame) -> pd.Series:
+    for c in ("id", "key", "contract_id", "wbs"):
+        if c in df:
+            return df[c]
+    return pd.Series(np.arange(1, len(df) + 1), name="id")
+
+def evm(df: pd.DataFrame) -> pd.DataFrame:
+    ev, ac, pv = _num(df, "ev"), _num(df, "ac"), _num(df, "pv")
+    bac = _num(df, "bac") if "bac" in df else _num(df, "boq_total")
+    spi, cpi = _ratio(ev, pv), _ratio(ev, ac)
+    eac = _ratio(bac, cpi)
+    return pd.DataFrame({
+        "id": _ids(df).to_numpy(),
+        "SPI": spi, "CPI": cpi,
+        "SV": ev - pv, "CV": ev - ac,
+        "EAC": eac, "ETC": eac - ac, "VAC": bac - eac,
+    })
+
+def ifrs15(df: pd.DataFrame) -> pd.DataFrame:
+    # straight-line monthly recognition, one output row per contract-month
+    value = _num(df, "contract_value")
+    months = np.clip(_num(df, "months"), 0, None).astype(np.int64)
+    total = int(months.sum())
+    if total > MAX_SCHEDULE_ROWS:
+        raise HTTPException(413, f"schedule would have {total} rows (max {MAX_SCHEDULE_ROWS})")
+    per = _ratio(value, months.astype(np.float64))
+    starts = np.cumsum(months) - months
+    month = np.arange(total, dtype=np.int64) - np.repeat(starts, months) + 1
+    rec = np.repeat(per, months)
+    out = {"id": np.repeat(_ids(df).to_numpy(), months), "month": month}
+    if "start" in df:
+        # a missing or unparseable start gives a null period for that contract's rows
+        start = pd.PeriodIndex(pd.to_datetime(df["start"], errors="coerce", format="mixed"), freq="M")
+        missing = np.repeat(np.asarray(start.isna()), months)
+        base = np.repeat(np.where(start.isna(), 0, start.asi8), months) + month - 1
+        period = pd.PeriodIndex.from_ordinals(base, freq="M").astype(str).to_numpy(dtype=object)
+        period[missing] = None
+        out["period"] = period
+    out["recognition"] = rec
+    out["cumulative"] = rec * month
+    return pd.DataFrame(out)
+
+def stream(df: pd.DataFrame, fmt: str) -> Iterator[bytes]:
+    # sync generator: StreamingResponse iterates it in the threadpool
+    for i in range(0, max(len(df), 1), CHUNK_ROWS):
+        part = df.iloc[i:i + CHUNK_ROWS]
+        if fmt == "csv":
+            yield part.to_csv(index=False, header=(i == 0)).encode("utf-8")
+        elif len(part):
+            yield part.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n").encode("utf-8") + b"\n"
@@ -0,0 +1,38 @@
+# Memory of the gateway's in-process rate limiter under millions of distinct identities.
+#   python bench/bench_limiter_memory.py --identities 3000000 --max-buckets 100000
+# Prints one JSON line per checkpoint; with the LRU bound the traced size stays flat.
+import os, sys, json, time, asyncio, argparse, tracemalloc, resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "llm_gateway_v4_1_multitenant_1"))
+from app.limiter import MemoryLimiter  # noqa: E402
+
+def rss_mb() -> float:
+    # peak RSS; Linux reports KiB, macOS bytes
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r / 1024.0 if sys.platform != "darwin" else r / (1024.0 * 1024.0)
+
+async def run(identities: int, max_buckets: int, every: int):
+    lim = MemoryLimiter(5.0, 20.0, max_buckets=max_buckets, sweep_s=0)
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(1, identities + 1):
+        await lim.admit(f"ip:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}#{i}", 5.0, 20.0)
+        if i % every == 0:
+            cur, _ = tracemalloc.get_traced_memory()
+            print(json.dumps({
+                "identities": i,
+                "buckets": len(lim.buckets),
+                "traced_mb": round(cur / 1e6, 2),
+                "estimated_mb": round(lim.memory_bytes() / 1e6, 2),
+                "peak_rss_mb": round(rss_mb(), 1),
+                "admits_per_s": round(i / (time.perf_counter() - started)),
+            }), flush=True)
+    tracemalloc.stop()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--identities", type=int, default=2_000_000)
+    ap.add_argument("--max-buckets", type=int, default=100_000)
+    ap.add_argument("--every", type=int, default=250_000)
+    a = ap.parse_args()
+    asyncio.run(run(a.identities, a.max_buckets, a.every))
@@ -0,0 +1,73 @@
+# Read latency of the backend memory log as it grows to 10M+ entries.
+#   python bench/bench_memstore.py --entries 10000000 --dir /tmp/memstore-bench
+# Prints one JSON line per checkpoint with median latencies for a tail read, a typed
+# tail read and a time-range read. With --legacy the old readlines() tail is timed on a
+# single memory.jsonl of the same size (up to --legacy-max entries, it gets slow).
+import os, sys, json, time, shutil, argparse, statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+from memstore import MemoryStore  # noqa: E402
+
+BASE_TS = 1_700_000_000.0
+
+def record(i: int) -> dict:
+    ts = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(BASE_TS + i)) + "Z"
+    return {"ts": ts, "type": "reply" if i % 10 == 0 else "ask", "text": f"entry {i} " + "x" * 40}
+
+def timed(fn, reps: int) -> float:
+    xs = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        xs.append(time.perf_counter() - t0)
+    return round(statistics.median(xs) * 1000.0, 3)
+
+def legacy_tail(path: str, limit: int):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f.readlines()[-limit:]]
+
+def run(a):
+    shutil.rmtree(a.dir, ignore_errors=True)
+    os.makedirs(a.dir)
+    store = MemoryStore(os.path.join(a.dir, "memory"))
+    legacy = open(os.path.join(a.dir, "memory.jsonl"), "w", encoding="utf-8") if a.legacy else None
+    checkpoints = sorted({int(x) for x in a.checkpoints.split(",") if int(x) <= a.entries} | {a.entries})
+    n, started = 0, time.perf_counter()
+    for cp in checkpoints:
+        while n < cp:
+            rec = record(n)
+            store.append(rec)
+            if legacy and n < a.legacy_max:
+                legacy.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            n += 1
+        store.flush()
+        mid = BASE_TS + n // 2
+        row = {
+            "entries": n,
+            "append_per_s": round(n / (time.perf_counter() - started)),
+            "tail_ms": timed(lambda: store.query(a.limit), a.reps),
+            "tail_typed_ms": timed(lambda: store.query(a.limit, type="reply"), a.reps),
+            "range_ms": timed(lambda: store.query(a.limit, since=mid, until=mid + 3600), a.reps),
+            **store.stats(),
+        }
+        if legacy and n <= a.legacy_max:
+            legacy.flush()
+            row["legacy_tail_ms"] = timed(lambda: legacy_tail(legacy.name, a.limit), max(1, a.reps // 10))
+        print(json.dumps(row), flush=True)
+    store.close()
+    if legacy:
+        legacy.close()
+    if not a.keep:
+        shutil.rmtree(a.dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=10_000_000)
+    ap.add_argument("--checkpoints", default="10000,100000,1000000,5000000,10000000")
+    ap.add_argument("--limit", type=int, default=100)
+    ap.add_argument("--reps", type=int, default=50)
+    ap.add_argument("--dir", default="/tmp/memstore-bench")
+    ap.add_argument("--legacy", action="store_true")
+    ap.add_argument("--legacy-max", type=int, default=1_000_000)
+    ap.add_argument("--keep", action="store_true")
+    run(ap.parse_args())
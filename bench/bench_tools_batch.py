@@ -0,0 +1,85 @@
+# Batch EVM / IFRS-15 endpoints vs one per-row call for each project/contract.
+#   python bench/bench_tools_batch.py --rows 100000
+#   python bench/bench_tools_batch.py --rows 100000 --url http://127.0.0.1:8010   # against a running server
+# In-process by default (httpx ASGI transport, no sockets, so per-row numbers are a lower
+# bound). The per-row path is timed on --per-row-sample rows and scaled to --rows.
+import os, sys, json, time, asyncio, argparse
+import numpy as np
+import pandas as pd
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+def make_client(url: str) -> httpx.AsyncClient:
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=600)
+    import app as backend
+    from fastapi import FastAPI
+    api = FastAPI()  # just the /api routes, whatever the static mount does
+    api.router.routes = [r for r in backend.app.routes if getattr(r, "path", "").startswith("/api/")]
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=api), base_url="http://bench", timeout=600)
+
+def portfolio(rows: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    rng = np.random.default_rng(7)
+    bac = rng.uniform(1e4, 1e7, rows).round(2)
+    pv = (bac * rng.uniform(0.1, 1.0, rows)).round(2)
+    evm = pd.DataFrame({"id": np.arange(rows), "ev": (pv * rng.uniform(0.7, 1.2, rows)).round(2),
+                        "ac": (pv * rng.uniform(0.8, 1.3, rows)).round(2), "pv": pv, "bac": bac})
+    ifrs = pd.DataFrame({"id": np.arange(rows), "contract_value": bac, "months": rng.integers(1, 37, rows)})
+    return evm, ifrs
+
+async def per_row(c: httpx.AsyncClient, evm: pd.DataFrame, ifrs: pd.DataFrame, n: int, concurrency: int) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def call(path: str, params: dict):
+        async with sem:
+            r = await c.post(path, params=params)
+            r.raise_for_status()
+            return r.json()
+
+    out = {}
+    t0 = time.perf_counter()
+    await asyncio.gather(*(call("/api/tools/run_evm", {"boq_total": r.bac, "ev": r.ev, "ac": r.ac, "pv": r.pv})
+                           for r in evm.head(n).itertuples()))
+    out["evm_s"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    await asyncio.gather(*(call("/api/tools/run_ifrs15", {"contract_value": r.contract_value, "months": r.months})
+                           for r in ifrs.head(n).itertuples()))
+    out["ifrs15_s"] = time.perf_counter() - t0
+    return out
+
+async def batch(c: httpx.AsyncClient, path: str, df: pd.DataFrame, fmt: str) -> tuple[float, int]:
+    t0 = time.perf_counter()
+    body = df.to_csv(index=False).encode()
+    size = 0
+    async with c.stream("POST", f"{path}?format={fmt}", content=body, headers={"content-type": "text/csv"}) as r:
+        r.raise_for_status()
+        async for chunk in r.aiter_bytes():
+            size += len(chunk)
+    return time.perf_counter() - t0, size
+
+async def main(a):
+    evm, ifrs = portfolio(a.rows)
+    n = min(a.per_row_sample, a.rows)
+    async with make_client(a.url) as c:
+        pr = await per_row(c, evm, ifrs, n, a.concurrency)
+        scale = a.rows / n
+        for name, path, df in (("evm", "/api/tools/batch/evm", evm), ("ifrs15", "/api/tools/batch/ifrs15", ifrs)):
+            for fmt in ("csv", "ndjson"):
+                secs, size = await batch(c, path, df, fmt)
+                per = pr[f"{name}_s"] * scale
+                print(json.dumps({
+                    "tool": name, "rows": a.rows, "format": fmt,
+                    "batch_s": round(secs, 3), "batch_rows_per_s": round(a.rows / secs),
+                    "response_mb": round(size / 1e6, 1),
+                    "per_row_s": round(per, 2), "per_row_measured_on": n,
+                    "speedup": round(per / secs, 1),
+                }), flush=True)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--per-row-sample", type=int, default=5_000)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--url", default="")
+    asyncio.run(main(ap.parse_args()))
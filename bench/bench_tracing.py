@@ -0,0 +1,103 @@
+# What tracing costs per gateway request. Every mode gets a fresh mock + gateway (see
+# loadtest.py) and the same closed-loop run; spans are exported over OTLP/HTTP to the mock's
+# /v1/traces, so serialization and export are part of the gateway's CPU time.
+#   python bench/bench_tracing.py                                  # all modes, 10 s each
+#   python bench/bench_tracing.py --modes off,all,tail_only --duration 20 --scenario gateway_stream
+# Modes: off (no OTLP endpoint), all (ratio 1), head10 (10 % head sampling, no tail rules),
+# head10_tail (10 % + keep errors / slow requests), tail_only (ratio 0, errors / slow only).
+# The mock fails --mock-error-rate of the calls so the keep-errors rule has work to do.
+# Output: server CPU ms per request, p50 / p99 and their overhead against "off" (ms and %),
+# plus how many export batches and bytes reached the mock; saved to bench/results/tracing-<time>.json.
+import os, sys, json, time, asyncio, argparse, platform, tempfile
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import loadtest
+
+MODES = {
+    "off": None,
+    "all": {"TRACE_SAMPLE_RATIO": "1"},
+    "head10": {"TRACE_SAMPLE_RATIO": "0.1", "TRACE_KEEP_ERRORS": "0", "TRACE_KEEP_SLOW_MS": "0"},
+    "head10_tail": {"TRACE_SAMPLE_RATIO": "0.1", "TRACE_KEEP_ERRORS": "1", "TRACE_KEEP_SLOW_MS": "1000"},
+    "tail_only": {"TRACE_SAMPLE_RATIO": "0", "TRACE_KEEP_ERRORS": "1", "TRACE_KEEP_SLOW_MS": "1000"},
+}
+
+async def mock_stats(mock: loadtest.Server) -> dict:
+    async with httpx.AsyncClient(timeout=5) as c:
+        return (await c.get(mock.url + "/stats")).json()
+
+async def run_mode(mode: str, a) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench-tracing-") as tmp:
+        procs = loadtest.servers(a, tmp)
+        _, tenants = loadtest.tenant_keys(tmp, a.keep_limits)
+        mock, gateway = procs["mock"], procs["gateway"]
+        if MODES[mode] is not None:
+            gateway.env.update({"OTEL_EXPORTER_OTLP_ENDPOINT": mock.url + "/v1/traces",
+                                "OTEL_EXPORTER_OTLP_PROTOCOL": "http/protobuf", **MODES[mode]})
+        streaming = a.scenario == "gateway_stream"
+        build = loadtest._complete(streaming)
+        try:
+            await mock.start()
+            await gateway.start()
+            res = await loadtest.run(gateway, build, streaming, tenants, a)
+            gateway.stop()     # flushes the span batch still queued
+            st = await mock_stats(mock)
+        finally:
+            for p in procs.values():
+                p.stop()
+    res["trace_exports"] = st.get("trace_exports", 0)
+    res["trace_kb"] = round(st.get("trace_bytes", 0) / 1024, 1)
+    return res
+
+def overhead(base: dict, res: dict) -> dict:
+    out = {}
+    for key, new, old in (("cpu", res["server_cpu_ms_per_request"], base["server_cpu_ms_per_request"]),
+                          ("p50", res["latency_ms"]["p50"], base["latency_ms"]["p50"]),
+                          ("p99", res["latency_ms"]["p99"], base["latency_ms"]["p99"])):
+        if new is not None and old:
+            out[key + "_ms"] = round(new - old, 3)
+            out[key + "_pct"] = round(100.0 * (new - old) / old, 1)
+    return out
+
+async def main(a) -> int:
+    modes = [m.strip() for m in a.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        raise SystemExit(f"unknown modes {unknown}; choose from {list(MODES)}")
+    result = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "git": loadtest.git_rev(),
+                       "python": platform.python_version(), "cpus": os.cpu_count(), "args": vars(a)},
+              "modes": {}}
+    for mode in modes:
+        res = await run_mode(mode, a)
+        if "off" in result["modes"]:
+            res["overhead"] = overhead(result["modes"]["off"], res)
+        result["modes"][mode] = res
+        lat, ov = res["latency_ms"], res.get("overhead", {})
+        print(f"{mode:12s} {res['throughput_rps']:>8} req/s  cpu {res['server_cpu_ms_per_request']} ms/req"
+              f" ({ov.get('cpu_pct', 0):+}%)  p50 {lat['p50']} ms  p99 {lat['p99']} ms"
+              f" ({ov.get('p99_pct', 0):+}%)  exports {res['trace_exports']} / {res['trace_kb']} KB", flush=True)
+    out = a.out or os.path.join(loadtest.ROOT, "bench", "results", time.strftime("tracing-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print("results:", out)
+    return 0
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--modes", default=",".join(MODES), help="comma separated; put off first for overheads")
+    ap.add_argument("--scenario", default="gateway_complete", choices=("gateway_complete", "gateway_stream"))
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--warmup", type=float, default=2.0)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--provider", default="openai", choices=("openai", "vllm", "ollama"))
+    ap.add_argument("--keep-limits", action="store_true")
+    ap.add_argument("--gateway-env", action="append", default=[], metavar="KEY=VALUE")
+    ap.add_argument("--mock-latency-ms", type=float, default=20.0)
+    ap.add_argument("--mock-jitter-ms", type=float, default=5.0)
+    ap.add_argument("--mock-tokens-per-s", type=float, default=0.0)
+    ap.add_argument("--mock-reply-tokens", type=int, default=32)
+    ap.add_argument("--mock-error-rate", type=float, default=0.02)
+    ap.add_argument("--out", default="")
+    sys.exit(asyncio.run(main(ap.parse_args())))
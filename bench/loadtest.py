@@ -0,0 +1,336 @@
+# Load tests for the gateway and the backend against the local mock provider (bench/mock_llm.py).
+#   python bench/loadtest.py                                   # every scenario, 10 s each, 32 connections
+#   python bench/loadtest.py --scenarios gateway_complete,ask --duration 30 --concurrency 64
+#   python bench/loadtest.py --mock-latency-ms 200 --mock-tokens-per-s 50 --mock-error-rate 0.02
+#   python bench/loadtest.py --compare bench/results/loadtest-20261018-120000.json
+# The mock, the gateway (uvicorn app.main:app, tenants from its api_keys.json, limits raised
+# unless --keep-limits) and the backend (DATA_DIR in a temp dir) run as separate processes, so
+# the CPU / RSS figures are the server's own. Each scenario is a closed loop of --concurrency
+# clients; the first --warmup seconds are not counted. mock_direct is the upstream on its own,
+# so gateway_complete minus mock_direct is what the gateway adds. Results go to
+# bench/results/loadtest-<time>.json; --compare exits 1 when a scenario's throughput drops or
+# its p99 grows by more than --tolerance against an earlier run.
+import os, sys, json, time, uuid, random, signal, socket, asyncio, argparse, platform, resource, tempfile, subprocess
+from collections import Counter
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+GATEWAY = os.path.join(ROOT, "backend", "llm_gateway_v4_1_multitenant_1")
+BACKEND = os.path.join(ROOT, "backend")
+
+ASKS = ("احسب مؤشر الأداء SPI للمشروع", "generate the IFRS 15 revenue schedule", "طلب شراء حديد تسليح",
+        "build the monthly report", "ما حالة المشروع هذا الأسبوع؟", "earned value for contract %d")
+
+# ---------- Servers ----------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class ProcStats:
+    # CPU seconds and RSS of a server process: psutil when installed, /proc otherwise (Linux)
+    def __init__(self, pid: int):
+        self.pid = pid
+        try:
+            import psutil
+            self._p = psutil.Process(pid)
+        except ImportError:
+            self._p = None
+
+    def cpu_s(self) -> float:
+        if self._p is not None:
+            c = self._p.cpu_times()
+            return c.user + c.system
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_mb(self) -> float:
+        if self._p is not None:
+            return self._p.memory_info().rss / 1e6
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024 / 1e6
+        return 0.0
+
+class Server:
+    def __init__(self, name: str, argv: list[str], cwd: str, env: dict, port: int, ready_path: str):
+        self.name, self.argv, self.cwd, self.env, self.port, self.ready_path = name, argv, cwd, env, port, ready_path
+        self.url = f"http://127.0.0.1:{port}"
+        self.proc: subprocess.Popen | None = None
+        self.stats: ProcStats | None = None
+
+    async def start(self, timeout: float = 30.0):
+        self.proc = subprocess.Popen(self.argv, cwd=self.cwd, env={**os.environ, **self.env},
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self.stats = ProcStats(self.proc.pid)
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(timeout=2) as c:
+            while time.monotonic() < deadline:
+                if self.proc.poll() is not None:
+                    raise RuntimeError(f"{self.name} exited: {self.proc.stderr.read().decode(errors='replace')[-2000:]}")
+                try:
+                    await c.get(self.url + self.ready_path)
+                    return
+                except httpx.HTTPError:
+                    await asyncio.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"{self.name} did not come up on {self.url}")
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT)  # lets the lifespan flush its logs
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+def uvicorn(app: str, port: int) -> list[str]:
+    return [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--no-access-log"]
+
+def tenant_keys(tmp: str, keep_limits: bool) -> tuple[str, list[dict]]:
+    with open(os.path.join(GATEWAY, "api_keys.json"), encoding="utf-8") as f:
+        tenants = json.load(f)
+    if not keep_limits:
+        for t in tenants:
+            t.update(rps=1e6, burst=1e6, quota_daily=10**12)
+    path = os.path.join(tmp, "api_keys.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(tenants, f)
+    return path, tenants
+
+def servers(a, tmp: str) -> dict[str, Server]:
+    mock_port = free_port()
+    mock = Server("mock", [sys.executable, os.path.join(ROOT, "bench", "mock_llm.py"), "--port", str(mock_port),
+                           "--latency-ms", str(a.mock_latency_ms), "--jitter-ms", str(a.mock_jitter_ms),
+                           "--tokens-per-s", str(a.mock_tokens_per_s), "--reply-tokens", str(a.mock_reply_tokens),
+                           "--error-rate", str(a.mock_error_rate)], ROOT, {}, mock_port, "/stats")
+    keys, _ = tenant_keys(tmp, a.keep_limits)
+    gw_port = free_port()
+    endpoint = mock.url + ("" if a.provider == "ollama" else "/v1")
+    gw_env = {"API_KEYS_FILE": keys, "LLM_PROVIDER": a.provider, "LLM_ENDPOINT": endpoint, "LLM_API_KEY": "bench",
+              "ACCESS_LOG_FILE": os.path.join(tmp, "access.log"), "LIMITER_SQLITE_PATH": os.path.join(tmp, "limiter.sqlite3"),
+              "CACHE_DIR": os.path.join(tmp, "cache")}
+    gw_env.update(kv.split("=", 1) for kv in a.gateway_env)
+    gateway = Server("gateway", uvicorn("app.main:app", gw_port), GATEWAY, gw_env, gw_port, "/healthz")
+    be_port = free_port()
+    backend = Server("backend", uvicorn("app:app", be_port), BACKEND,
+                     {"DATA_DIR": os.path.join(tmp, "backend-data")}, be_port, "/api/healthz")
+    return {"mock": mock, "gateway": gateway, "backend": backend}
+
+# ---------- Scenarios ----------
+# build(i, tenant) -> (method, path, request kwargs); the tenant's key goes in X-API-KEY
+def _complete(stream: bool):
+    def build(i: int, tenant: dict):
+        body = {"prompt": f"[{i}] {random.choice(ASKS)} — summarise in one paragraph", "max_tokens": 64,
+                "temperature": 0.7, "stream": stream}   # > CACHE_MAX_TEMPERATURE: every call goes upstream
+        return "POST", "/llm/complete", {"json": body}
+    return build
+
+def _mock_direct(i: int, tenant: dict):
+    body = {"model": "mock", "messages": [{"role": "user", "content": f"[{i}] {random.choice(ASKS)}"}], "max_tokens": 64}
+    return "POST", "/v1/chat/completions", {"json": body}
+
+def _ask(i: int, tenant: dict):
+    text = random.choice(ASKS)
+    return "POST", "/api/ask", {"json": {"text": text % i if "%d" in text else text}}
+
+def _uploads(size_kb: int):
+    def build(i: int, tenant: dict):
+        # unique content, so every upload is stored rather than deduplicated
+        data = (f"upload {i} {uuid.uuid4()}\n".encode() * (size_kb * 1024 // 50 + 1))[:size_kb * 1024]
+        return "POST", "/api/memory/upload", {"files": {"file": (f"bench-{i}.txt", data, "text/plain")}}
+    return build
+
+def scenarios(a) -> dict[str, tuple[str, object, bool]]:
+    # name -> (server, build, streaming)
+    return {
+        "mock_direct": ("mock", _mock_direct, False),
+        "gateway_healthz": ("gateway", lambda i, t: ("GET", "/healthz", {}), False),
+        "gateway_complete": ("gateway", _complete(False), False),
+        "gateway_stream": ("gateway", _complete(True), True),
+        "ask": ("backend", _ask, False),
+        "memory_logs": ("backend", lambda i, t: ("GET", "/api/memory/logs", {"params": {"limit": a.logs_limit}}), False),
+        "uploads": ("backend", _uploads(a.upload_kb), False),
+        "static": ("backend", lambda i, t: ("GET", "/", {"headers": {"Accept-Encoding": "br, gzip"}}), False),
+    }
+
+def pct(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summary(lat: list[float]) -> dict:
+    lat = sorted(lat)
+    r = lambda v: round(v * 1000.0, 3) if v is not None else None
+    return {"p50": r(pct(lat, 0.50)), "p90": r(pct(lat, 0.90)), "p99": r(pct(lat, 0.99)),
+            "max": r(lat[-1] if lat else None), "mean": r(sum(lat) / len(lat) if lat else None)}
+
+async def run(server: Server, build, streaming: bool, tenants: list[dict], a) -> dict:
+    lat: list[float] = []
+    ttft: list[float] = []
+    statuses: Counter = Counter()
+    per_tenant: Counter = Counter()
+    counter = iter(range(10**12))
+    started = time.monotonic()
+    measure_from = started + a.warmup
+    stop_at = measure_from + a.duration
+    limits = httpx.Limits(max_connections=a.concurrency, max_keepalive_connections=a.concurrency)
+
+    async def client_loop(c: httpx.AsyncClient):
+        while time.monotonic() < stop_at:
+            i = next(counter)
+            tenant = tenants[i % len(tenants)]
+            method, path, kw = build(i, tenant)
+            headers = {"X-API-KEY": tenant["key"], **kw.pop("headers", {})}
+            t0 = time.perf_counter()
+            first = None
+            try:
+                if streaming:
+                    async with c.stream(method, path, headers=headers, **kw) as r:
+                        async for _ in r.aiter_raw():
+                            if first is None:
+                                first = time.perf_counter() - t0
+                    status = str(r.status_code)
+                else:
+                    r = await c.request(method, path, headers=headers, **kw)
+                    status = str(r.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - t0
+            if time.monotonic() - elapsed >= measure_from:
+                statuses[status] += 1
+                per_tenant[tenant["tenant"]] += 1
+                if status.startswith("2"):
+                    lat.append(elapsed)
+                    if first is not None:
+                        ttft.append(first)
+
+    rss_peak = 0.0
+
+    async def sample_rss():
+        nonlocal rss_peak
+        while True:
+            rss_peak = max(rss_peak, server.stats.rss_mb())
+            await asyncio.sleep(0.1)
+
+    async with httpx.AsyncClient(base_url=server.url, limits=limits, timeout=a.timeout) as c:
+        sampler = asyncio.create_task(sample_rss())
+        loops = asyncio.gather(*(client_loop(c) for _ in range(a.concurrency)))
+        await asyncio.sleep(a.warmup)
+        cpu0, self0, t0 = server.stats.cpu_s(), _self_cpu(), time.monotonic()
+        await loops
+        cpu1, self1, wall = server.stats.cpu_s(), _self_cpu(), time.monotonic() - t0
+        sampler.cancel()
+    total = sum(statuses.values())
+    ok = sum(n for s, n in statuses.items() if s.startswith("2"))
+    out = {"server": server.name, "requests": total, "ok": ok, "errors": total - ok,
+           "throughput_rps": round(ok / wall, 1), "latency_ms": summary(lat),
+           "statuses": dict(statuses), "per_tenant": dict(per_tenant),
+           "server_cpu_s": round(cpu1 - cpu0, 3), "server_cpu_pct": round(100.0 * (cpu1 - cpu0) / wall, 1),
+           "server_cpu_ms_per_request": round(1000.0 * (cpu1 - cpu0) / ok, 3) if ok else None,
+           "server_rss_mb": round(server.stats.rss_mb(), 1), "server_rss_peak_mb": round(rss_peak, 1),
+           "client_cpu_pct": round(100.0 * (self1 - self0) / wall, 1)}
+    if ttft:
+        out["ttft_ms"] = summary(ttft)
+    return out
+
+def _self_cpu() -> float:
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    return r.ru_utime + r.ru_stime
+
+# ---------- Comparison ----------
+def compare(old: dict, new: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, n in new["scenarios"].items():
+        o = old.get("scenarios", {}).get(name)
+        if not o:
+            continue
+        rps = (n["throughput_rps"] - o["throughput_rps"]) / o["throughput_rps"] if o["throughput_rps"] else 0.0
+        p99o, p99n = o["latency_ms"]["p99"], n["latency_ms"]["p99"]
+        p99 = (p99n - p99o) / p99o if p99o and p99n else 0.0
+        line = (f"{name:18s} rps {o['throughput_rps']:>9} -> {n['throughput_rps']:>9} ({rps:+.1%})   "
+                f"p99 {p99o} -> {p99n} ms ({p99:+.1%})")
+        bad = rps < -tolerance or p99 > tolerance
+        print(("REGRESSION " if bad else "           ") + line)
+        if bad:
+            regressions.append(name)
+    return regressions
+
+def git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+async def main(a) -> int:
+    table = scenarios(a)
+    names = [s.strip() for s in a.scenarios.split(",") if s.strip()] if a.scenarios else list(table)
+    unknown = [n for n in names if n not in table]
+    if unknown:
+        raise SystemExit(f"unknown scenarios {unknown}; choose from {list(table)}")
+    result = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "git": git_rev(),
+                       "python": platform.python_version(), "platform": platform.platform(),
+                       "cpus": os.cpu_count(), "args": vars(a)},
+              "scenarios": {}}
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as tmp:
+        procs = servers(a, tmp)
+        _, tenants = tenant_keys(tmp, a.keep_limits)
+        needed = {table[n][0] for n in names} | ({"mock"} if "gateway" in {table[n][0] for n in names} else set())
+        try:
+            for name in ("mock", "gateway", "backend"):
+                if name in needed:
+                    await procs[name].start()
+            if "memory_logs" in names:
+                # a log worth tailing, whether or not "ask" ran first
+                async with httpx.AsyncClient(base_url=procs["backend"].url, timeout=a.timeout) as c:
+                    for i in range(a.seed_logs):
+                        await c.post("/api/ask", json={"text": f"seed {i} {random.choice(ASKS)}", "context": 0})
+            for name in names:
+                server, build, streaming = table[name]
+                res = await run(procs[server], build, streaming, tenants, a)
+                result["scenarios"][name] = res
+                lat = res["latency_ms"]
+                print(f"{name:18s} {res['throughput_rps']:>9} req/s  p50 {lat['p50']} ms  p99 {lat['p99']} ms  "
+                      f"errors {res['errors']}  cpu {res['server_cpu_pct']}%  rss {res['server_rss_peak_mb']} MB",
+                      flush=True)
+        finally:
+            for p in procs.values():
+                p.stop()
+    out = a.out or os.path.join(ROOT, "bench", "results", time.strftime("loadtest-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print("results:", out)
+    if a.compare:
+        with open(a.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), result, a.tolerance)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scenarios", default="", help="comma separated; default: all")
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--warmup", type=float, default=2.0)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--provider", default="openai", choices=("openai", "vllm", "ollama"))
+    ap.add_argument("--keep-limits", action="store_true", help="use the rps/quota from api_keys.json as is")
+    ap.add_argument("--gateway-env", action="append", default=[], metavar="KEY=VALUE")
+    ap.add_argument("--mock-latency-ms", type=float, default=50.0)
+    ap.add_argument("--mock-jitter-ms", type=float, default=10.0)
+    ap.add_argument("--mock-tokens-per-s", type=float, default=0.0)
+    ap.add_argument("--mock-reply-tokens", type=int, default=32)
+    ap.add_argument("--mock-error-rate", type=float, default=0.0)
+    ap.add_argument("--logs-limit", type=int, default=100)
+    ap.add_argument("--seed-logs", type=int, default=2000)
+    ap.add_argument("--upload-kb", type=int, default=64)
+    ap.add_argument("--out", default="")
+    ap.add_argument("--compare", default="", help="earlier results JSON")
+    ap.add_argument("--tolerance", type=float, default=0.10)
+    sys.exit(asyncio.run(main(ap.parse_args())))
@@ -0,0 +1,178 @@
+# Local mock LLM provider for load tests: OpenAI chat (/v1/chat/completions, plain + SSE
+# with usage), vLLM-style batched /v1/completions and /tokenize, and Ollama /api/generate
+# (plain + NDJSON).
+#   python bench/mock_llm.py --port 8999 --latency-ms 50 --tokens-per-s 200 --error-rate 0.01
+# A reply of --reply-tokens words costs latency (+/- jitter) to the first token, then
+# reply_tokens / tokens_per_s, so streamed and non-streamed calls take the same time.
+# Every flag can also come from the environment (MOCK_LATENCY_MS, MOCK_ERROR_RATE, ...).
+# It also accepts OTLP/HTTP trace exports on /v1/traces (counted, then discarded), so
+# OTEL_EXPORTER_OTLP_ENDPOINT=http://127.0.0.1:8999/v1/traces measures tracing end to end.
+import os, json, random, asyncio, argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+WORDS = ("alpha", "beta", "gamma", "delta", "omega", "مشروع", "تقرير", "token", "stream", "reply")
+
+class MockConfig:
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 10.0, tokens_per_s: float = 0.0,
+                 reply_tokens: int = 32, error_rate: float = 0.0, error_status: int = 503):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_s = tokens_per_s    # 0 = the whole reply at once
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    @classmethod
+    def from_env(cls) -> "MockConfig":
+        e = os.getenv
+        return cls(float(e("MOCK_LATENCY_MS", "50")), float(e("MOCK_JITTER_MS", "10")),
+                   float(e("MOCK_TOKENS_PER_S", "0")), int(e("MOCK_REPLY_TOKENS", "32")),
+                   float(e("MOCK_ERROR_RATE", "0")), int(e("MOCK_ERROR_STATUS", "503")))
+
+def create_app(cfg: MockConfig | None = None) -> FastAPI:
+    cfg = cfg or MockConfig.from_env()
+    app = FastAPI()
+    app.state.cfg = cfg
+    stats = app.state.stats = {"requests": 0, "errors": 0, "streams": 0, "trace_exports": 0, "trace_bytes": 0}
+
+    def prompt_tokens(text: str) -> int:
+        return max(1, len(text.split()))
+
+    def reply(max_tokens: int | None) -> list[str]:
+        n = min(cfg.reply_tokens, max_tokens or cfg.reply_tokens)
+        return [random.choice(WORDS) + " " for _ in range(max(1, n))]
+
+    async def first_token():
+        await asyncio.sleep(max(0.0, cfg.latency_ms + random.uniform(-cfg.jitter_ms, cfg.jitter_ms)) / 1000.0)
+
+    async def generate(n: int):
+        if cfg.tokens_per_s > 0:
+            await asyncio.sleep(n / cfg.tokens_per_s)
+
+    def failed() -> JSONResponse | None:
+        stats["requests"] += 1
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "mock upstream error", "type": "server_error"}},
+                                status_code=cfg.error_status)
+        return None
+
+    async def pace(tokens: list[str]):
+        # one token at a time at tokens_per_s (or all at once)
+        delay = 1.0 / cfg.tokens_per_s if cfg.tokens_per_s > 0 else 0.0
+        for tok in tokens:
+            if delay:
+                await asyncio.sleep(delay)
+            yield tok
+
+    @app.post("/v1/chat/completions")
+    async def chat(req: Request):
+        body = await req.json()
+        err = failed()
+        if err:
+            return err
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages") or ())
+        tokens = reply(body.get("max_tokens"))
+        usage = {"prompt_tokens": prompt_tokens(prompt), "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = body.get("model", "mock")
+        await first_token()
+        if not body.get("stream"):
+            await generate(len(tokens))
+            return {"id": "mock", "object": "chat.completion", "model": model, "usage": usage,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(tokens)}}]}
+        stats["streams"] += 1
+
+        async def sse():
+            async for tok in pace(tokens):
+                chunk = {"object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": tok}}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    @app.post("/v1/completions")
+    async def completions(req: Request):
+        body = await req.json()
+        err = failed()
+        if err:
+            return err
+        # a string, a list of strings, token ids, or a list of token id lists (what the gateway batches)
+        prompts = body.get("prompt", "")
+        if not isinstance(prompts, list) or (prompts and isinstance(prompts[0], int)):
+            prompts = [prompts]
+        replies = [reply(body.get("max_tokens")) for _ in prompts]
+        await first_token()
+        await generate(max(len(r) for r in replies))
+        return {"model": body.get("model", "mock"),
+                "choices": [{"index": i, "text": "".join(r)} for i, r in enumerate(replies)],
+                "usage": {"prompt_tokens": sum(len(p) if isinstance(p, list) else prompt_tokens(p) for p in prompts),
+                          "completion_tokens": sum(len(r) for r in replies)}}
+
+    @app.post("/tokenize")
+    async def tokenize(req: Request):
+        # vLLM: chat messages -> token ids of the templated prompt (one id per word here)
+        body = await req.json()
+        if "messages" in body:
+            text = " ".join(f"<|{m.get('role', 'user')}|> {m.get('content', '')}" for m in body["messages"])
+            if body.get("add_generation_prompt"):
+                text += " <|assistant|>"
+        else:
+            text = body.get("prompt", "")
+        tokens = [sum(map(ord, w)) % 32000 for w in text.split()]
+        return {"tokens": tokens, "count": len(tokens), "max_model_len": 32768}
+
+    @app.post("/api/generate")
+    async def ollama(req: Request):
+        body = await req.json()
+        err = failed()
+        if err:
+            return err
+        tokens = reply((body.get("options") or {}).get("num_predict"))
+        done = {"done": True, "prompt_eval_count": prompt_tokens(body.get("prompt", "")), "eval_count": len(tokens)}
+        await first_token()
+        if body.get("stream") is False:
+            await generate(len(tokens))
+            return {"model": body.get("model", "mock"), "response": "".join(tokens), **done}
+        stats["streams"] += 1
+
+        async def ndjson():
+            async for tok in pace(tokens):
+                yield json.dumps({"response": tok, "done": False}, ensure_ascii=False) + "\n"
+            yield json.dumps({"response": "", **done}) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    @app.post("/v1/traces")
+    async def traces(req: Request):
+        # an empty body is a valid ExportTraceServiceResponse
+        stats["trace_exports"] += 1
+        stats["trace_bytes"] += len(await req.body())
+        return Response(b"", media_type="application/x-protobuf")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+app = create_app()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8999)
+    ap.add_argument("--latency-ms", type=float, default=float(os.getenv("MOCK_LATENCY_MS", "50")))
+    ap.add_argument("--jitter-ms", type=float, default=float(os.getenv("MOCK_JITTER_MS", "10")))
+    ap.add_argument("--tokens-per-s", type=float, default=float(os.getenv("MOCK_TOKENS_PER_S", "0")))
+    ap.add_argument("--reply-tokens", type=int, default=int(os.getenv("MOCK_REPLY_TOKENS", "32")))
+    ap.add_argument("--error-rate", type=float, default=float(os.getenv("MOCK_ERROR_RATE", "0")))
+    ap.add_argument("--error-status", type=int, default=int(os.getenv("MOCK_ERROR_STATUS", "503")))
+    a = ap.parse_args()
+    import uvicorn
+    uvicorn.run(create_app(MockConfig(a.latency_ms, a.jitter_ms, a.tokens_per_s, a.reply_tokens,
+                                      a.error_rate, a.error_status)),
+                host=a.host, port=a.port, log_level="warning", access_log=False)
@@ -1,3 +1,31 @@
+// VERSION and PRECACHE are filled in by backend/assets.py from the asset manifest on every build,
+// so a new deploy gets a new cache and old caches are dropped on activate.
+const VERSION = 'dev';
+const PRECACHE = ['/', '/index.html', '/admin.html', '/assets/app.js', '/assets/admin.js', '/manifest.json'];
+const CACHE = 'unified-' + VERSION;
 
-self.addEventListener('install', e=>{e.waitUntil(caches.open('unified-v3').then(c=>c.addAll(['/','/index.html','/admin.html','/assets/app.js','/assets/admin.js','/manifest.json'])))});
-self.addEventListener('fetch', e=>{e.respondWith(caches.match(e.request).then(r=>r||fetch(e.request))) });
+self.addEventListener('install', e => {
+  e.waitUntil(caches.open(CACHE).then(c => c.addAll(PRECACHE)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', e => {
+  e.waitUntil(caches.keys()
+    .then(keys => Promise.all(keys.filter(k => k.startsWith('unified-') && k !== CACHE).map(k => caches.delete(k))))
+    .then(() => self.clients.claim()));
+});
+
+self.addEventListener('fetch', e => {
+  const url = new URL(e.request.url);
+  if (e.request.method !== 'GET' || url.origin !== location.origin || url.pathname.startsWith('/api/')) return;
+  if (e.request.mode === 'navigate') {
+    // pages: network first so a deploy shows up at once, cached copy when offline
+    e.respondWith(fetch(e.request).then(r => {
+      const copy = r.clone();
+      caches.open(CACHE).then(c => c.put(e.request, copy));
+      return r;
+    }).catch(() => caches.match(e.request).then(r => r || caches.match('/'))));
+    return;
+  }
+  // fingerprinted assets never change under the same URL: cache first
+  e.respondWith(caches.match(e.request).then(r => r || fetch(e.request)));
+});